@@ -0,0 +1,476 @@
+"""
+Joint solver for the logistic models of all the columns of a MSA.
+
+All the column models of a MSA share the same predictors (the binary matrix
+of the other MSA) and differ only in the response (the residues of the
+column). Instead of fitting one SGDClassifier per column, the elastic net
+multinomial logistic regressions of all the columns are fitted at once with
+accelerated proximal gradient descent (FISTA): every iteration is a couple of
+large matrix products with the shared predictor matrix, for all the columns
+together.
+
+The fitted models are exposed one per column as BatchColumnModel objects,
+which provide the attributes and methods of SGDClassifier that the rest of
+the analysis uses (classes_, coef_, intercept_, predict_proba(),
+predict_log_proba()).
+
+Note that these are multinomial (softmax) models, while SGDClassifier fits
+one-versus-rest binary models: for the same alpha, the fitted probabilities
+and coefficients are similar but not identical.
+"""
+import numpy as np
+from scipy.sparse import issparse
+from scipy.special import logsumexp
+
+from dummyestimator import DummyEstimator
+from globalvars import ALPHA_RANGE, AA_TABLE
+
+
+class BatchColumnModel():
+    """
+    Fitted multinomial logistic model of a single MSA column.
+
+    For two classes, the model is presented as a binary logistic model of the
+    second class, as SGDClassifier does: coef_ has a single row.
+
+    Parameters
+    ----------
+    weights: array, (n_features, n_symbols) coefficients of every symbol of
+             the alphabet; those of symbols absent from the column are 0
+    bias:    array, (n_symbols,) intercepts
+    classes: array, symbols present in the column
+    alpha:   float, regularization strength the model was fitted with
+
+    Attributes
+    ----------
+    classes_:    array, classes found in the column
+    coef_:       array, (n_classes, n_features), or (1, n_features) for two
+                 classes
+    intercept_:  array, (n_classes,), or (1,) for two classes
+    """
+
+    def __init__(self, weights, bias, classes, alpha):
+        self.weights = weights
+        self.bias = bias
+        self.classes_ = np.asarray(classes)
+        self.alpha = alpha
+        if len(self.classes_) == 2:
+            self.coef_ = (weights[:, classes[1]] -
+                          weights[:, classes[0]])[np.newaxis, :]
+            self.intercept_ = np.array([bias[classes[1]] - bias[classes[0]]])
+        else:
+            self.coef_ = weights[:, classes].T.copy()
+            self.intercept_ = bias[classes].copy()
+
+    def decision_function(self, X):
+        scores = X @ self.coef_.T + self.intercept_
+        return np.asarray(scores)
+
+    def predict_log_proba(self, X):
+        return self.log_proba_from_scores(self.decision_function(X))
+
+    def log_proba_from_scores(self, scores):
+        """
+        Log-probabilities of the classes given the scores X @ coef_.T +
+        intercept_, e.g. computed for many models in a single product.
+        """
+        if len(self.classes_) == 2:
+            # log(1 / (1 + exp(-z))) and its complement
+            return np.hstack((-np.logaddexp(0, scores),
+                              -np.logaddexp(0, -scores)))
+        return scores - logsumexp(scores, axis=1, keepdims=True)
+
+    def predict_proba(self, X):
+        return np.exp(self.predict_log_proba(X))
+
+
+def as_design_matrix(bin_mtx):
+    """
+    Convert the binary matrix to floating point once, rather than in every
+    matrix product.
+    """
+    if issparse(bin_mtx):
+        return bin_mtx.astype(np.float64).tocsr()
+    return np.asarray(bin_mtx, dtype=np.float64)
+
+
+def lipschitz_constant(X, obs_weights, n_power_iters=30):
+    """
+    Upper bound of the Lipschitz constant of the gradient of the weighted
+    softmax loss: half the largest eigenvalue of X'WX, with a column of ones
+    for the intercepts, estimated by power iteration.
+    """
+    rng = np.random.RandomState(0)
+    v = rng.normal(size=X.shape[1] + 1)
+    eigenvalue = 0
+    for _ in range(n_power_iters):
+        v /= np.linalg.norm(v)
+        Xv = X @ v[:-1] + v[-1]
+        v = np.append(X.T @ (obs_weights * Xv), np.sum(obs_weights * Xv))
+        eigenvalue = np.linalg.norm(v)
+    # Safety margin for the power iteration estimate
+    return 0.5 * eigenvalue * 1.1
+
+
+def column_chunks(n_cols, bytes_per_col, chunk_bytes):
+    """
+    Split the columns into chunks of approximately chunk_bytes of working
+    memory (at least one column per chunk).
+    """
+    chunk_cols = max(1, chunk_bytes // bytes_per_col)
+    return [slice(start, min(start + chunk_cols, n_cols))
+            for start in range(0, n_cols, chunk_cols)]
+
+
+def masked_logits(X, weights, bias, class_mask):
+    """
+    Logits of all the columns and symbols of a chunk with a single product,
+    -inf for the symbols absent from each column.
+
+    Arguments
+    ---------
+    X:          array-like, (n_obs, n_features) predictors, dense or CSR
+    weights:    array, (n_features, n_cols, n_symbols) C-contiguous
+                coefficients
+    bias:       array, (n_cols, n_symbols) intercepts
+    class_mask: array, (n_cols, n_symbols) bool, symbols present in each
+                column
+
+    Returns
+    -------
+    logits:     array, (n_obs, n_cols, n_symbols)
+    """
+    n_features, n_cols, n_symbols = weights.shape
+    logits = np.asarray(X @ weights.reshape(n_features, -1)).reshape(
+        X.shape[0], n_cols, n_symbols)
+    logits += bias
+    logits[:, ~class_mask] = -np.inf
+    return logits
+
+
+def fit_chunk(X, targets, class_mask, obs_weights, l1, l2, step, weights,
+              bias, cols, max_iter, tol):
+    """
+    Auxiliary function for fit_columns(): FISTA iterations on a chunk of
+    columns, which are written to weights[:, cols] and bias[cols] as they
+    converge. The columns are independent problems: each one has its own
+    momentum and stopping criterion, and converged columns are dropped from
+    the working arrays. These are updated in place, and the observed residues
+    are subtracted by indexing rather than with a one-hot tensor.
+    """
+    n_obs = X.shape[0]
+    rows = np.arange(n_obs)[:, np.newaxis]
+    cols = np.asarray(cols)
+    x_weights = np.ascontiguousarray(weights[:, cols])
+    x_bias = bias[cols]
+    y_weights, y_bias = x_weights.copy(), x_bias.copy()
+    # Buffer for the shrunk coefficients and the change of the coefficients
+    buffer = np.empty_like(x_weights)
+    momentum = np.ones(len(cols))
+    for _ in range(max_iter):
+        # Residuals: softmax probabilities minus 1 for the observed residue,
+        # computed in place of the logits
+        residuals = masked_logits(X, y_weights, y_bias, class_mask)
+        residuals -= residuals.max(axis=2, keepdims=True)
+        np.exp(residuals, out=residuals)
+        residuals /= residuals.sum(axis=2, keepdims=True)
+        residuals[rows, np.arange(len(cols)), targets] -= 1
+        residuals *= obs_weights[:, np.newaxis, np.newaxis]
+
+        # Gradient step: y - step * (X'R + l2 * y)
+        new_weights = np.asarray(X.T @ residuals.reshape(n_obs, -1)).reshape(
+            x_weights.shape)
+        new_weights *= -step
+        np.multiply(y_weights, 1 - step * l2[:, np.newaxis], out=buffer)
+        new_weights += buffer
+        new_bias = y_bias - step * residuals.sum(axis=0)
+        del residuals
+        # Proximal step: soft thresholding for the L1 penalty
+        np.abs(new_weights, out=buffer)
+        buffer -= step * l1[:, np.newaxis]
+        np.maximum(buffer, 0, out=buffer)
+        np.copysign(buffer, new_weights, out=new_weights)
+
+        # Largest change and largest coefficient of each column
+        np.subtract(new_weights, x_weights, out=buffer)
+        delta = np.maximum.reduce([buffer.max(axis=(0, 2)),
+                                   -buffer.min(axis=(0, 2)),
+                                   np.abs(new_bias - x_bias).max(axis=1)])
+        scale = np.maximum.reduce([new_weights.max(axis=(0, 2)),
+                                   -new_weights.min(axis=(0, 2)),
+                                   np.abs(new_bias).max(axis=1),
+                                   np.ones(len(cols))])
+
+        # Restart the momentum of the columns where it goes against the
+        # gradient: the extrapolation step is then 0
+        y_weights -= new_weights
+        restart = np.einsum('ijk,ijk->j', y_weights, buffer) > 0
+        new_momentum = np.where(restart, 1,
+                                (1 + np.sqrt(1 + 4 * momentum ** 2)) / 2)
+        beta = np.where(restart, 0, (momentum - 1) / new_momentum)
+        np.multiply(buffer, beta[:, np.newaxis], out=y_weights)
+        y_weights += new_weights
+        y_bias = new_bias + beta[:, np.newaxis] * (new_bias - x_bias)
+        x_weights, x_bias, momentum = new_weights, new_bias, new_momentum
+
+        done = delta <= tol * scale
+        if np.any(done):
+            weights[:, cols[done]] = x_weights[:, done]
+            bias[cols[done]] = x_bias[done]
+            if np.all(done):
+                return
+            keep = ~done
+            cols, targets, class_mask = cols[keep], targets[:, keep], \
+                class_mask[keep]
+            l1, l2, momentum = l1[keep], l2[keep], momentum[keep]
+            x_weights, y_weights = x_weights[:, keep], y_weights[:, keep]
+            x_bias, y_bias = x_bias[keep], y_bias[keep]
+            buffer = np.empty_like(x_weights)
+
+    weights[:, cols] = x_weights
+    bias[cols] = x_bias
+
+
+def fit_columns(X, targets, class_mask, obs_weights, alphas, l1_ratio,
+                weights=None, bias=None, max_iter=500, tol=1e-4,
+                chunk_bytes=64 * 2 ** 20):
+    """
+    Fit elastic net multinomial logistic regressions for several columns at
+    once, with FISTA.
+
+    The columns are independent problems: they are solved in chunks of
+    columns, so that the working memory (the logits of the chunk and a few
+    copies of its coefficients) stays around chunk_bytes whatever the size of
+    the alignments. All the columns use the same step size; the results do
+    not depend on the size of the chunks.
+
+    Arguments
+    ---------
+    X:           array-like, (n_obs, n_features) predictors, dense or CSR
+    targets:     array, (n_obs, n_cols) numeric residues of each column
+    class_mask:  array, (n_cols, n_symbols) bool, symbols present in each
+                 column
+    obs_weights: array, (n_obs,) weight of each observation in the loss
+    alphas:      array, (n_cols,) regularization strength of each column
+    l1_ratio:    float, elastic net mixing parameter
+    weights:     array, (n_features, n_cols, n_symbols) initial coefficients
+                 (optional); updated in place
+    bias:        array, (n_cols, n_symbols) initial intercepts (optional);
+                 updated in place
+    max_iter:    int, maximum number of iterations
+    tol:         float, tolerance on the largest change of a coefficient of a
+                 column, relative to its largest coefficient
+    chunk_bytes: int, approximate working memory of a chunk of columns
+
+    Returns
+    -------
+    weights:     array, (n_features, n_cols, n_symbols) coefficients
+    bias:        array, (n_cols, n_symbols) intercepts
+    """
+    n_obs, n_features = X.shape
+    n_cols, n_symbols = class_mask.shape
+    if weights is None:
+        weights = np.zeros((n_features, n_cols, n_symbols))
+    if bias is None:
+        bias = np.zeros((n_cols, n_symbols))
+
+    l1 = np.asarray(alphas) * l1_ratio
+    l2 = np.asarray(alphas) * (1 - l1_ratio)
+
+    step = 1 / (lipschitz_constant(X, obs_weights) + l2.max())
+
+    # Residuals, and four copies of the coefficients of each column
+    bytes_per_col = 8 * n_symbols * (n_obs + 4 * n_features)
+    for chunk in column_chunks(n_cols, bytes_per_col, chunk_bytes):
+        fit_chunk(X, targets[:, chunk], class_mask[chunk], obs_weights,
+                  l1[chunk], l2[chunk], step, weights, bias,
+                  np.arange(n_cols)[chunk], max_iter, tol)
+
+    return weights, bias
+
+
+def observed_logprobs(X, targets, weights, bias, class_mask, pc,
+                      chunk_bytes=64 * 2 ** 20):
+    """
+    Log-probability of the observed residue of each column, for every
+    observation. The columns are processed in chunks of approximately
+    chunk_bytes of working memory.
+    """
+    n_obs = X.shape[0]
+    n_features, n_cols, n_symbols = weights.shape
+    log_probs = np.empty((n_obs, n_cols))
+    bytes_per_col = 8 * n_symbols * (n_obs + n_features)
+    for chunk in column_chunks(n_cols, bytes_per_col, chunk_bytes):
+        logits = masked_logits(X, np.ascontiguousarray(weights[:, chunk]),
+                               bias[chunk], class_mask[chunk])
+        observed = np.take_along_axis(
+            logits, targets[:, chunk, np.newaxis], axis=2)[:, :, 0]
+        # Log-sum-exp over the symbols, in place
+        max_logits = logits.max(axis=2, keepdims=True)
+        logits -= max_logits
+        np.exp(logits, out=logits)
+        log_probs[:, chunk] = observed - max_logits[:, :, 0] - \
+            np.log(logits.sum(axis=2))
+    log_probs[np.isneginf(log_probs)] = pc
+    return log_probs
+
+
+def degrees_freedom(weights, class_mask):
+    """
+    Number of features with a non-zero coefficient for any class of each
+    column, as corrmut.calc_degrees_freedom() counts them on coef_.
+    """
+    dfs = []
+    for i, classes in enumerate(class_mask):
+        classes = np.flatnonzero(classes)
+        if len(classes) == 2:
+            nonzero = weights[:, i, classes[1]] != weights[:, i, classes[0]]
+        else:
+            nonzero = np.any(weights[:, i, classes] != 0, axis=1)
+        dfs.append(np.count_nonzero(nonzero))
+    return np.array(dfs)
+
+
+def fit_batch_msa_models(num_mtx, bin_mtx, seqs_weight, fixed_alphas=None,
+                         sample_weights=None, l1_ratio=0.99, dfmax=100,
+                         n_obs=None, prev_models=None, max_iter=500, tol=1e-4,
+                         pc=np.log(1 / 210), chunk_bytes=64 * 2 ** 20):
+    """
+    Fit the logistic models of all the columns of a MSA jointly; counterpart
+    of corrmut.fit_msa_models() with solver='batch'.
+
+    If no values of alpha are given, the models are fitted over ALPHA_RANGE,
+    from the strongest to the weakest regularization, each fit starting from
+    the previous solution. As with SGD, a column stops at the first value of
+    alpha whose model has more than dfmax degrees of freedom, and the model
+    with the minimum Bayesian Information Criterion is selected. A column
+    whose first model is already too complex keeps it.
+
+    Arguments
+    ---------
+    num_mtx:        array-like, MSA in numeric matrix form (responses)
+    bin_mtx:        array-like, other MSA in binary matrix form (predictors);
+                    dense or scipy.sparse CSR
+    seqs_weight:    list, weight of each observation when they are in one
+                    cluster; used with fixed_alphas, as in
+                    corrmut.fit_column_model()
+    fixed_alphas:   list, values of alpha to use for each column
+    sample_weights: list, weight for each observation
+    l1_ratio:       float, elastic net mixing parameter
+    dfmax:          int, maximum number of degrees of freedom allowed in the
+                    models
+    n_obs:          int, number of observations used to compute the BIC; by
+                    default, the number of rows of num_mtx
+    prev_models:    list, models of the previous EM iteration, one per
+                    column; with fixed_alphas, each column's fit starts from
+                    the coefficients of its previous model if it has the same
+                    classes
+    max_iter:       int, maximum number of FISTA iterations per fit
+    tol:            float, tolerance of the FISTA iterations
+    pc:             float, log pseudocount for residues predicted with 0
+                    probability
+    chunk_bytes:    int, approximate working memory of the solver; the
+                    columns are fitted in chunks of this size, see
+                    fit_columns()
+
+    Returns
+    -------
+    models:         list of BatchColumnModel (or DummyEstimator) objects
+    alpha_per_col:  list, selected values of alpha; None if fixed_alphas
+                    were given
+    """
+    num_mtx = np.asarray(num_mtx).astype(int)
+    n_rows, n_cols = num_mtx.shape
+    if n_obs is None:
+        n_obs = n_rows
+    X = as_design_matrix(bin_mtx)
+    n_features = X.shape[1]
+    n_symbols = len(AA_TABLE)
+
+    if sample_weights is None:
+        sample_weights = np.ones(n_rows)
+    if fixed_alphas is not None:
+        obs_weights = np.multiply(sample_weights, seqs_weight)
+    else:
+        obs_weights = np.asarray(sample_weights, dtype=float)
+    # Average loss over the observations, as in SGDClassifier
+    obs_weights = np.asarray(obs_weights, dtype=float) / n_rows
+
+    class_mask = np.zeros((n_cols, n_symbols), dtype=bool)
+    class_mask[np.arange(n_cols), num_mtx] = True
+    # Columns with a single class get a dummy model, as in
+    # corrmut.fit_column_model()
+    constant = class_mask.sum(axis=1) <= 1
+    fitted = np.flatnonzero(~constant)
+
+    models = [None] * n_cols
+    alpha_per_col = [None] * n_cols
+    for i in np.flatnonzero(constant):
+        models[i] = DummyEstimator(prob=0.99 - (1 / 210))
+        models[i].fit(bin_mtx, num_mtx[:, i])
+        alpha_per_col[i] = 0.01
+
+    targets = num_mtx[:, fitted]
+    mask = class_mask[fitted]
+
+    if fixed_alphas is not None:
+        weights = np.zeros((n_features, len(fitted), n_symbols))
+        bias = np.zeros((len(fitted), n_symbols))
+        if prev_models is not None:
+            for j, i in enumerate(fitted):
+                prev_model = prev_models[i]
+                if isinstance(prev_model, BatchColumnModel) and \
+                        np.array_equal(prev_model.classes_,
+                                       np.flatnonzero(mask[j])):
+                    weights[:, j] = prev_model.weights
+                    bias[j] = prev_model.bias
+        alphas = np.asarray(fixed_alphas, dtype=float)[fitted]
+        fit_columns(X, targets, mask, obs_weights, alphas, l1_ratio, weights,
+                    bias, max_iter=max_iter, tol=tol, chunk_bytes=chunk_bytes)
+        for j, i in enumerate(fitted):
+            models[i] = BatchColumnModel(weights[:, j], bias[j],
+                                         np.flatnonzero(mask[j]), alphas[j])
+        return models, None
+
+    # Path over ALPHA_RANGE for the columns that have not exceeded dfmax yet
+    active = np.ones(len(fitted), dtype=bool)
+    best_bics = np.full(len(fitted), np.inf)
+    weights = np.zeros((n_features, len(fitted), n_symbols))
+    bias = np.zeros((len(fitted), n_symbols))
+    for alpha_idx, alpha in enumerate(ALPHA_RANGE):
+        if not np.any(active):
+            break
+        idxs = np.flatnonzero(active)
+        if len(idxs) == len(fitted):
+            # All the columns are still active: fit them in place
+            path_weights, path_bias = weights, bias
+        else:
+            path_weights, path_bias = weights[:, idxs], bias[idxs]
+        fit_columns(X, targets[:, idxs], mask[idxs], obs_weights,
+                    np.full(len(idxs), alpha), l1_ratio, path_weights,
+                    path_bias, max_iter=max_iter, tol=tol,
+                    chunk_bytes=chunk_bytes)
+        if path_weights is not weights:
+            weights[:, idxs] = path_weights
+            bias[idxs] = path_bias
+
+        dfs = degrees_freedom(path_weights, mask[idxs])
+        log_probs = observed_logprobs(X, targets[:, idxs], path_weights,
+                                      path_bias, mask[idxs], pc,
+                                      chunk_bytes=chunk_bytes)
+        bics = dfs * np.log(n_obs) - 2 * log_probs.sum(axis=0)
+        for k, j in enumerate(idxs):
+            if dfs[k] > dfmax and alpha_idx > 0:
+                active[j] = False
+                continue
+            if dfs[k] > dfmax:
+                active[j] = False
+            if bics[k] < best_bics[j]:
+                best_bics[j] = bics[k]
+                i = fitted[j]
+                models[i] = BatchColumnModel(path_weights[:, k].copy(),
+                                             path_bias[k].copy(),
+                                             np.flatnonzero(mask[j]), alpha)
+                alpha_per_col[i] = alpha
+
+    return models, alpha_per_col
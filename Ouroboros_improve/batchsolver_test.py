@@ -0,0 +1,151 @@
+"""
+Unit tests for the batchsolver module
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.special import logsumexp
+from sklearn.linear_model import LogisticRegression
+
+import batchsolver
+import corrmut
+import msa_fun
+from dummyestimator import DummyEstimator
+from globalvars import AA_TABLE, ALPHA_RANGE
+
+
+def random_msas(seed, n_obs=80, n_cols_a=4, n_cols_b=6):
+    """
+    MSA A partly copies the first columns of MSA B, so that the models have
+    something to learn
+    """
+    rng = np.random.RandomState(seed)
+    num_mtx_b = rng.randint(0, 4, size=(n_obs, n_cols_b))
+    num_mtx_a = np.where(rng.rand(n_obs, n_cols_a) < 0.6,
+                         num_mtx_b[:, :n_cols_a],
+                         rng.randint(0, 4, size=(n_obs, n_cols_a)))
+    return num_mtx_a, msa_fun.make_bin_mtx(num_mtx_b, AA_TABLE)
+
+
+class TestBatchColumnModel():
+
+    def test_log_probs(self):
+        rng = np.random.RandomState(0)
+        weights = rng.normal(size=(10, len(AA_TABLE)))
+        bias = rng.normal(size=len(AA_TABLE))
+        X = rng.randint(0, 2, size=(7, 10))
+        for classes in ([2, 5], [0, 3, 4]):
+            model = batchsolver.BatchColumnModel(weights, bias, classes, 0.1)
+            log_probs = model.predict_log_proba(X)
+            # Softmax over the classes of the column only
+            logits = X @ weights[:, classes] + bias[classes]
+            expected = logits - logsumexp(logits, axis=1, keepdims=True)
+            assert np.allclose(log_probs, expected)
+        # Binary models have a single row of coefficients, as SGDClassifier
+        assert model.coef_.shape == (3, 10)
+        model = batchsolver.BatchColumnModel(weights, bias, [2, 5], 0.1)
+        assert model.coef_.shape == (1, 10)
+
+
+class TestFitColumns():
+
+    def test_matches_sklearn(self):
+        num_mtx, bin_mtx = random_msas(1)
+        n_obs = num_mtx.shape[0]
+        alpha = 0.01
+        models, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * n_obs, fixed_alphas=[alpha] * 4,
+            sample_weights=[1] * n_obs, max_iter=5000, tol=1e-8)
+        X = bin_mtx.astype(float)
+        for i, model in enumerate(models):
+            reference = LogisticRegression(
+                penalty='elasticnet', solver='saga', l1_ratio=0.99,
+                C=1 / (alpha * n_obs), max_iter=10000, tol=1e-8,
+                multi_class='multinomial').fit(X, num_mtx[:, i])
+            assert np.array_equal(model.classes_, reference.classes_)
+            assert np.allclose(model.predict_log_proba(X),
+                               reference.predict_log_proba(X), atol=0.01)
+
+    def test_sparse(self):
+        num_mtx, bin_mtx = random_msas(2)
+        dense, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, fixed_alphas=[0.05] * 4)
+        sparse, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, csr_matrix(bin_mtx), [1] * 80, fixed_alphas=[0.05] * 4)
+        for dense_model, sparse_model in zip(dense, sparse):
+            assert np.allclose(dense_model.coef_, sparse_model.coef_)
+
+    def test_chunks(self):
+        # The columns are independent problems: fitting them one at a time
+        # gives the same models
+        num_mtx, bin_mtx = random_msas(6)
+        whole, alphas_whole = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, dfmax=30)
+        chunked, alphas_chunked = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, dfmax=30, chunk_bytes=1)
+        assert alphas_whole == alphas_chunked
+        for whole_model, chunked_model in zip(whole, chunked):
+            assert np.allclose(whole_model.coef_, chunked_model.coef_)
+
+    def test_observed_logprobs(self):
+        rng = np.random.RandomState(7)
+        num_mtx, bin_mtx = random_msas(7)
+        X = batchsolver.as_design_matrix(bin_mtx)
+        class_mask = np.zeros((4, len(AA_TABLE)), dtype=bool)
+        class_mask[np.arange(4), num_mtx] = True
+        weights = rng.normal(size=(X.shape[1], 4, len(AA_TABLE)))
+        bias = rng.normal(size=(4, len(AA_TABLE)))
+        log_probs = batchsolver.observed_logprobs(X, num_mtx, weights, bias,
+                                                  class_mask, np.log(1 / 210),
+                                                  chunk_bytes=1)
+        for i in range(4):
+            model = batchsolver.BatchColumnModel(
+                weights[:, i], bias[i], np.flatnonzero(class_mask[i]), 0.1)
+            expected = model.predict_log_proba(X)[
+                np.arange(80), np.searchsorted(model.classes_, num_mtx[:, i])]
+            assert np.allclose(log_probs[:, i], expected)
+
+
+class TestFitBatchMsaModels():
+
+    def test_alpha_selection(self):
+        num_mtx, bin_mtx = random_msas(3)
+        # Constant column: dummy model
+        num_mtx[:, 1] = 2
+        models, alphas = batchsolver.fit_batch_msa_models(num_mtx, bin_mtx,
+                                                          [1] * 80, dfmax=30)
+        assert isinstance(models[1], DummyEstimator)
+        assert alphas[1] == 0.01
+        for i in [0, 2, 3]:
+            assert isinstance(models[i], batchsolver.BatchColumnModel)
+            assert alphas[i] in ALPHA_RANGE
+            assert models[i].alpha == alphas[i]
+            assert corrmut.calc_degrees_freedom(models[i]) <= 30
+
+    def test_warm_start(self):
+        num_mtx, bin_mtx = random_msas(4)
+        weights = np.linspace(0.2, 1, 80)
+        cold, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, fixed_alphas=[0.05] * 4,
+            sample_weights=weights, tol=1e-8, max_iter=5000)
+        prev, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, fixed_alphas=[0.05] * 4, tol=1e-8,
+            max_iter=5000)
+        warm, _ = batchsolver.fit_batch_msa_models(
+            num_mtx, bin_mtx, [1] * 80, fixed_alphas=[0.05] * 4,
+            sample_weights=weights, prev_models=prev, tol=1e-8,
+            max_iter=5000)
+        # Convex problem: same solution from either starting point
+        for cold_model, warm_model in zip(cold, warm):
+            assert np.allclose(cold_model.coef_, warm_model.coef_, atol=1e-4)
+
+    def test_fit_msa_models(self):
+        num_mtx, bin_mtx = random_msas(5)
+        models, alphas = corrmut.fit_msa_models(num_mtx, bin_mtx, 'soft',
+                                                [1] * 80, n_jobs=1,
+                                                solver='batch')
+        assert len(models) == len(alphas) == 4
+        couplings, contact_mtx = corrmut.compute_couplings(models, models)
+        assert contact_mtx.shape == (4, 4)
+        alt_mtx = corrmut.get_alt_model(num_mtx, bin_mtx, models)
+        assert alt_mtx.shape == num_mtx.shape
+        assert np.all(alt_mtx < 0)
@@ -4,6 +4,8 @@ Module containing functions for intermolecular contact prediction.
 @author: Miguel Correa
 """
 
+from collections.abc import Mapping
+
 import numpy as np
 from sklearn.metrics import matthews_corrcoef
 import warnings
@@ -13,6 +15,21 @@ import warnings
 ######################
 
 
+def interacting_idxs(labels, mode, soft_threshold=0.5):
+    """
+    Auxiliary function for get_interacting().
+    Indexes of the observations selected as putatively interacting: those
+    with a hidden variable value of 1 in hard EM, and those above
+    soft_threshold in soft EM.
+    """
+    labels = np.asarray(labels)
+    if mode == 'hard':
+        return np.where(labels == 1)[0]
+    elif mode == 'soft':
+        return np.where(labels >= soft_threshold)[0]
+    raise ValueError(f'Unknown mode: {mode}')
+
+
 def get_interacting(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, labels,
                     mode, soft_threshold=0.5):
     """
@@ -27,6 +44,7 @@ def get_interacting(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, labels,
     bin_mtx_a, bin_mtx_b: array-like. Contains a multiple sequence alignment as
                           a binary matrix with all proteins under
                           consideration, interacting and non-interacting.
+                          Dense or scipy.sparse CSR.
     labels:               array-like, values of the hidden variables
     mode:                 str, whether to perform soft or hard
                           expectation-maximization
@@ -40,35 +58,83 @@ def get_interacting(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, labels,
     weights:              array-like, selected values of the hidden variables
 
     """
-    labels = np.asarray(labels)
-    if mode == 'hard':
-        idxs = np.where(np.asarray(labels) == 1)[0]
-
-    elif mode == 'soft':
-        idxs = np.where(labels >= soft_threshold)[0]
+    idxs = interacting_idxs(labels, mode, soft_threshold)
 
     int_num_a = np.take(num_mtx_a, idxs, axis=0)
     int_num_b = np.take(num_mtx_b, idxs, axis=0)
 
-    int_bin_a = np.take(bin_mtx_a, idxs, axis=0)
-    int_bin_b = np.take(bin_mtx_b, idxs, axis=0)
+    # Row indexing works for both dense and sparse (CSR) binary matrices
+    int_bin_a = bin_mtx_a[idxs]
+    int_bin_b = bin_mtx_b[idxs]
 
     weights = np.take(labels, idxs)
 
     return int_num_a, int_bin_b, int_num_b, int_bin_a, weights
 
 
-def select_coefs(model_coefs, idx):
+def stack_squared_coefs(models, n_cols, no_aas=20):
     """
     Auxiliary function for compute_couplings().
-    Used to select the desired subvector/submatrix from the vector/matrix
-    of model coefficients.
+    Stack the squared coefficients of all models into a single array, summed
+    over the classes (binomial and multinomial models alike) and over the
+    features that encode each column of the other MSA.
+
+    Arguments
+    ---------
+    models: list of SGDClassifier (or DummyEstimator) objects
+    n_cols: int, number of columns of the MSA used as predictor
+    no_aas: int, number of features per column of the predictor
+
+    Returns
+    -------
+    sq_coefs: array of dimensions (len(models), n_cols); element [i, j] is the
+              squared 2-norm of the coefficients of model i for column j
+    """
+    sq_coefs = np.empty((len(models), n_cols * no_aas))
+    for i, model in enumerate(models):
+        # DummyEstimator coefficients are a vector; multinomial models have
+        # one row per class
+        coefs = np.atleast_2d(model.coef_)[:, :n_cols * no_aas]
+        sq_coefs[i] = np.einsum('kf,kf->f', coefs, coefs)
+    return sq_coefs.reshape(len(models), n_cols, no_aas).sum(axis=2)
+
+
+class Couplings(Mapping):
+    """
+    Read-only dictionary of intermolecular coupling strengths in the format
+    {"Ai:Bj": float, ...}, built from the contact matrix.
+
+    The keys are generated only when the dictionary is accessed, rather than
+    for every pair of positions on every call to compute_couplings().
+
+    Parameters
+    ----------
+    contact_mtx: array, 2D matrix of coupling strengths
     """
-    if len(model_coefs.shape) == 1:  # Binomial case
-        sel_coefs = model_coefs[range(idx, idx + 20)]
-    else:  # Multinomial case
-        sel_coefs = model_coefs[:, range(idx, idx + 20)]
-    return sel_coefs, idx + 20
+
+    def __init__(self, contact_mtx):
+        self.contact_mtx = contact_mtx
+
+    def __getitem__(self, key):
+        try:
+            name_a, name_b = key.split(':')
+            if name_a[0] != 'A' or name_b[0] != 'B':
+                raise ValueError
+            i, j = int(name_a[1:]), int(name_b[1:])
+        except (AttributeError, ValueError):
+            raise KeyError(key)
+        if not (0 <= i < self.contact_mtx.shape[0] and
+                0 <= j < self.contact_mtx.shape[1]):
+            raise KeyError(key)
+        return self.contact_mtx[i, j]
+
+    def __iter__(self):
+        for i in range(self.contact_mtx.shape[0]):
+            for j in range(self.contact_mtx.shape[1]):
+                yield ''.join(['A', str(i), ':', 'B', str(j)])
+
+    def __len__(self):
+        return self.contact_mtx.size
 
 
 def compute_couplings(models_a, models_b):
@@ -95,48 +161,20 @@ def compute_couplings(models_a, models_b):
 
     Returns
     -------
-    couplings:   dict, contains intermolecular coupling strengths in the format
-                 {"Ai:Bj":float,...}
+    couplings:   Couplings, read-only dictionary of intermolecular coupling
+                 strengths in the format {"Ai:Bj":float,...}
     contact_mtx: array, 2D matrix of dimensions (models_a, models_b); contains
                  the value of the coupling strength for each pair of positions
 
     """
-    # Dictionary to store couplings between residues
-    couplings = {}
-    # To keep track of the submatrix we need to take from the matrix of
-    # coefficients from protein B
-
-    # Iterate over models / columns of MSA A
-    # Variable to keep track of the submatrix we need to take from the matrix
-    # of coefficients of models of B
-    offset_a = 0
-    contact_mtx = np.zeros((len(models_a), len(models_b)))
-    for i, model_a in enumerate(models_a):
-        # Variable to keep track of the submatrix we need to take from the
-        # matrix of coefficients from protein A
-        end_point_a = 0
-
-        for j, model_b in enumerate(models_b):
-            # Select the relevant submatrices of coefficients, this is,
-            # the columns in A that indicate coupling to B and vice versa
-            # Taking the 2-norm of a vector and a matrix is equivalent. In case
-            # of mismatching dimensions, flatten the matrices into vectors and
-            # concatenate them
-            sel_coefs_a, end_point_a = select_coefs(model_a.coef_, end_point_a)
-            sel_coefs_a = sel_coefs_a.flatten()
-            sel_coefs_b, _ = select_coefs(model_b.coef_, offset_a)
-            sel_coefs_b = sel_coefs_b.flatten()
-            coef_vector = np.concatenate((sel_coefs_a, sel_coefs_b))
-
-            # Calculate coupling strength (as the 2-norm of the vector of
-            # coefficients) and store the value in the output
-            coupling = np.linalg.norm(coef_vector)
-            coupling_name = ''.join(['A', str(i), ':', 'B', str(j)])
-            couplings[coupling_name] = coupling
-            contact_mtx[i][j] = coupling
-        offset_a += 20
-
-    return couplings, contact_mtx
+    # The squared 2-norm of the concatenation is the sum of the squared
+    # 2-norms of the submatrices: the coefficients of model i of A for column
+    # j of B, and those of model j of B for column i of A
+    sq_coefs_a = stack_squared_coefs(models_a, len(models_b))
+    sq_coefs_b = stack_squared_coefs(models_b, len(models_a))
+    contact_mtx = np.sqrt(sq_coefs_a + sq_coefs_b.T)
+
+    return Couplings(contact_mtx), contact_mtx
 
 
 def normalize_contact_mtx(contact_mtx):
@@ -148,59 +186,145 @@ def normalize_contact_mtx(contact_mtx):
     "Mutual information without the influence of phylogeny or entropy
     dramatically improves residue contact prediction."
     Bioinformatics 24.3 (2007): 333-340
-    """
-    norm_mtx = np.zeros_like(contact_mtx)
 
+    Arguments
+    ---------
+    contact_mtx: array, contact matrix, or stack of contact matrices along
+                 the first axes (each one is corrected with its own means)
+
+    Returns
+    -------
+    norm_mtx:    array, corrected contact matrix (or matrices)
+    """
+    contact_mtx = np.asarray(contact_mtx)
     # Precompute means
-    mean_coupling = contact_mtx.mean()
-    row_means = contact_mtx.mean(axis=1)
-    col_means = contact_mtx.mean(axis=0)
+    mean_coupling = contact_mtx.mean(axis=(-2, -1), keepdims=True)
+    row_means = contact_mtx.mean(axis=-1, keepdims=True)
+    col_means = contact_mtx.mean(axis=-2, keepdims=True)
+
+    # Outer product of the row and column means
+    apc = (row_means * col_means) / mean_coupling
+    return contact_mtx - apc
+
 
-    # Iterate over array to compute the corresponding correction
-    for idxs, coupling in np.ndenumerate(contact_mtx):
-        apc = (row_means[idxs[0]] * col_means[idxs[1]]) / mean_coupling
-        corr_coupling = coupling - apc
-        norm_mtx[idxs] = corr_coupling
-    return norm_mtx
+def normalize_contact_mtxs(contact_mtxs):
+    """
+    Apply Average Product Correction to several contact matrices at once,
+    e.g. the contact matrices of every EM iteration.
+
+    Arguments
+    ---------
+    contact_mtxs: list of arrays of identical dimensions
+
+    Returns
+    -------
+    norm_mtxs:    array, corrected contact matrices stacked along the first
+                  axis
+    """
+    return normalize_contact_mtx(np.stack(contact_mtxs))
 
 
 def eval_contact_metrics(true_contact_mtx, pred_contact_mtx, limit=100):
     """
     Calculate contact prediction accuracy for a number X of predicted contacts,
     starting from the strongest ones.
-    """
 
-    # Obtain indexes of true contacts
-    true_idxs = list(zip(*np.where(true_contact_mtx == 1)))
-    if limit > pred_contact_mtx.size:
+    The predictions are sorted once; the number of true positives among the
+    top i predictions is then a cumulative sum, for every i up to limit.
+
+    Arguments
+    ---------
+    true_contact_mtx: array-like, ground truth contact matrix
+    pred_contact_mtx: array-like, predicted contact matrix
+    limit:            int, number of top predictions to evaluate, or None
+                      for all of them
+
+    Returns
+    -------
+    tpr_per_rank:     list, true positive rate (over the positives that can
+                      be found with i predictions) of the top i predictions,
+                      for i = 1...limit; NaN if there are no true contacts
+    ppv_per_rank:     list, positive predictive value of the top i
+                      predictions, for i = 1...limit
+    """
+    pred_contact_mtx = np.asarray(pred_contact_mtx)
+    if limit is None:
+        limit = pred_contact_mtx.size
+    elif limit > pred_contact_mtx.size:
         warnings.warn("""Limit of predicted contacts greater than contact
              matrix size; truncating""", RuntimeWarning)
         limit = pred_contact_mtx.size
 
-    tpr_per_rank = []
-    ppv_per_rank = []
-    for i in range(1, limit + 1):
-        # How many positive samples do we consider?
-        if i > len(true_idxs):  # We have exhausted the positives
-            no_positives = len(true_idxs)
-        else:
-            no_positives = i
-
-        no_true_positives = 0
-        no_false_positives = 0
-        # Obtain indexes of top i contacts
-        top_n_idxs = largest_indices(pred_contact_mtx, i)
-        for contact in top_n_idxs:
-            if contact in true_idxs:
-                no_true_positives += 1
-            else:
-                no_false_positives += 1
-        tpr = no_true_positives / no_positives
-        tpr_per_rank.append(tpr)
-        ppv = no_true_positives / (no_true_positives + no_false_positives)
-        ppv_per_rank.append(ppv)
-
-    return tpr_per_rank, ppv_per_rank
+    true_positives = ranked_true_positives(true_contact_mtx, pred_contact_mtx,
+                                           limit)
+    ranks = np.arange(1, limit + 1)
+    # How many positive samples do we consider? All of them once we have
+    # exhausted the positives
+    no_positives = np.minimum(ranks, np.sum(np.asarray(true_contact_mtx) == 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tpr_per_rank = true_positives / no_positives
+    ppv_per_rank = true_positives / ranks
+
+    return tpr_per_rank.tolist(), ppv_per_rank.tolist()
+
+
+def ranked_true_positives(true_contact_mtx, pred_contact_mtxs, limit):
+    """
+    Number of true contacts among the top i predictions, for i = 1...limit.
+
+    Arguments
+    ---------
+    true_contact_mtx:  array-like, ground truth contact matrix
+    pred_contact_mtxs: array-like, predicted contact matrix, or stack of
+                       predicted contact matrices along the first axis
+    limit:             int, maximum number of predictions
+
+    Returns
+    -------
+    true_positives:    array of dimensions (limit,), or (n_mtxs, limit) for a
+                       stack of matrices
+    """
+    true_flat = np.asarray(true_contact_mtx).ravel() == 1
+    pred_contact_mtxs = np.asarray(pred_contact_mtxs)
+    pred_flat = pred_contact_mtxs.reshape(-1, true_flat.size)
+    # Strongest predictions first; ties are ranked by position
+    order = np.argsort(-pred_flat, axis=1, kind='stable')[:, :limit]
+    true_positives = np.cumsum(true_flat[order], axis=1)
+    if pred_contact_mtxs.ndim == 2:
+        return true_positives[0]
+    return true_positives
+
+
+def precision_at_length(true_contact_mtx, pred_contact_mtxs, ks=(1, 2, 5, 10),
+                        length=None):
+    """
+    Precision of the top L/k predicted contacts, the usual summary of contact
+    prediction accuracy, for several contact matrices at once (e.g. those of
+    every EM iteration).
+
+    Arguments
+    ---------
+    true_contact_mtx:  array-like, ground truth contact matrix
+    pred_contact_mtxs: list or array of predicted contact matrices
+    ks:                iterable of int, divisors of L
+    length:            int, L; by default, the length of the shortest
+                       protein (the smaller dimension of the contact matrix)
+
+    Returns
+    -------
+    precisions:        array of dimensions (len(pred_contact_mtxs), len(ks));
+                       element [i, j] is the precision of the top L/ks[j]
+                       contacts of matrix i
+    """
+    pred_contact_mtxs = np.stack(pred_contact_mtxs)
+    if length is None:
+        length = min(pred_contact_mtxs.shape[1:])
+    # At least one prediction per k, and no more than the matrix size
+    n_preds = np.array([min(max(length // k, 1), pred_contact_mtxs[0].size)
+                        for k in ks])
+    true_positives = ranked_true_positives(true_contact_mtx, pred_contact_mtxs,
+                                           n_preds.max())
+    return true_positives[:, n_preds - 1] / n_preds
 
 
 def largest_indices(array, n):
@@ -238,12 +362,9 @@ def evaluate_contact_predictions(true_contact_mtx, pred_contact_mtx):
     -------
     mcc:              float, value of the Matthews Correlation Coefficient
     """
-    # Discretize predictions
-    for idxs, val in np.ndenumerate(pred_contact_mtx):
-        if val > 0:
-            pred_contact_mtx[idxs] = 1
-        if val <= 0:
-            pred_contact_mtx[idxs] = 0
+    # Discretize predictions (in place); NaNs are left as they are
+    pred_contact_mtx[pred_contact_mtx > 0] = 1
+    pred_contact_mtx[pred_contact_mtx <= 0] = 0
     mcc = matthews_corrcoef(true_contact_mtx.flatten(),
                             pred_contact_mtx.flatten())
     return mcc
@@ -264,10 +385,6 @@ def discretize_pred_contact_mtx(pred_contact_mtx, contact_threshold=0):
     -------
     pred_contact_mtx: array-like, discretized predicted contact matrix
     """
-    for idx, item in np.ndenumerate(pred_contact_mtx):
-        if pred_contact_mtx[idx] > contact_threshold:
-            pred_contact_mtx[idx] = 1
-        else:
-            pred_contact_mtx[idx] = 0
+    pred_contact_mtx[...] = pred_contact_mtx > contact_threshold
     return pred_contact_mtx
 
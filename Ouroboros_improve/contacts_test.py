@@ -0,0 +1,179 @@
+"""
+Unit tests for the contacts module
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import contacts
+from dummyestimator import DummyEstimator
+
+
+def couplings_reference(models_a, models_b):
+    """
+    Contact matrix computed pair by pair, as compute_couplings used to
+    """
+    contact_mtx = np.zeros((len(models_a), len(models_b)))
+    for i, model_a in enumerate(models_a):
+        for j, model_b in enumerate(models_b):
+            coefs_a = np.atleast_2d(model_a.coef_)[:, 20 * j:20 * (j + 1)]
+            coefs_b = np.atleast_2d(model_b.coef_)[:, 20 * i:20 * (i + 1)]
+            contact_mtx[i, j] = np.linalg.norm(
+                np.concatenate((coefs_a.flatten(), coefs_b.flatten())))
+    return contact_mtx
+
+
+def random_models(rng, n_models, n_cols):
+    """
+    Mix of binomial, multinomial and dummy models
+    """
+    models = []
+    for i in range(n_models):
+        if i % 3 == 0:
+            coef = rng.normal(size=(1, n_cols * 20))
+        elif i % 3 == 1:
+            coef = rng.normal(size=(4, n_cols * 20))
+        else:
+            dummy = DummyEstimator(0.9)
+            dummy.fit(np.zeros((2, n_cols * 20)), [1, 1])
+            models.append(dummy)
+            continue
+        models.append(SimpleNamespace(coef_=coef))
+    return models
+
+
+class TestComputeCouplings():
+
+    def test_matches_reference(self):
+        rng = np.random.RandomState(0)
+        models_a = random_models(rng, 7, 5)
+        models_b = random_models(rng, 5, 7)
+        couplings, contact_mtx = contacts.compute_couplings(models_a,
+                                                            models_b)
+        assert contact_mtx.shape == (7, 5)
+        assert np.allclose(contact_mtx,
+                           couplings_reference(models_a, models_b))
+
+    def test_couplings_dict(self):
+        rng = np.random.RandomState(1)
+        models_a = random_models(rng, 3, 2)
+        models_b = random_models(rng, 2, 3)
+        couplings, contact_mtx = contacts.compute_couplings(models_a,
+                                                            models_b)
+        assert len(couplings) == 6
+        assert list(couplings.keys())[:3] == ['A0:B0', 'A0:B1', 'A1:B0']
+        assert couplings['A2:B1'] == contact_mtx[2, 1]
+        assert dict(couplings) == {f'A{i}:B{j}': contact_mtx[i, j]
+                                   for i in range(3) for j in range(2)}
+        for key in ['A3:B0', 'B0:A1', 'A0', 0]:
+            with pytest.raises(KeyError):
+                _ = couplings[key]
+
+
+def apc_reference(contact_mtx):
+    """
+    Average Product Correction element by element
+    """
+    norm_mtx = np.zeros_like(contact_mtx)
+    for (i, j), coupling in np.ndenumerate(contact_mtx):
+        norm_mtx[i, j] = coupling - (contact_mtx[i].mean() *
+                                     contact_mtx[:, j].mean() /
+                                     contact_mtx.mean())
+    return norm_mtx
+
+
+class TestNormalizeContactMtx():
+
+    def test_matches_reference(self):
+        contact_mtx = np.random.RandomState(2).rand(6, 4)
+        assert np.allclose(contacts.normalize_contact_mtx(contact_mtx),
+                           apc_reference(contact_mtx))
+
+    def test_stack(self):
+        rng = np.random.RandomState(3)
+        contact_mtxs = [rng.rand(5, 3) for _ in range(4)]
+        norm_mtxs = contacts.normalize_contact_mtxs(contact_mtxs)
+        assert norm_mtxs.shape == (4, 5, 3)
+        for norm_mtx, contact_mtx in zip(norm_mtxs, contact_mtxs):
+            assert np.allclose(norm_mtx, apc_reference(contact_mtx))
+
+
+class TestDiscretize():
+
+    def test_discretize(self):
+        pred_contact_mtx = np.array([[0.5, -0.1], [0.2, 0.]])
+        out = contacts.discretize_pred_contact_mtx(pred_contact_mtx, 0.3)
+        assert np.array_equal(out, [[1, 0], [0, 0]])
+
+    def test_evaluate(self):
+        true_contact_mtx = np.array([[1, 0], [0, 1]])
+        pred_contact_mtx = np.array([[0.5, -0.1], [0.2, 0.]])
+        mcc = contacts.evaluate_contact_predictions(true_contact_mtx,
+                                                    pred_contact_mtx)
+        assert np.array_equal(pred_contact_mtx, [[1, 0], [1, 0]])
+        assert np.isclose(mcc, 0)
+
+
+def metrics_reference(true_contact_mtx, pred_contact_mtx, limit):
+    """
+    TPR and PPV per rank, recomputing the top contacts for every rank
+    """
+    true_idxs = list(zip(*np.where(true_contact_mtx == 1)))
+    tprs, ppvs = [], []
+    for i in range(1, limit + 1):
+        top_n_idxs = contacts.largest_indices(pred_contact_mtx, i)
+        true_positives = sum(contact in true_idxs for contact in top_n_idxs)
+        tprs.append(true_positives / min(i, len(true_idxs)))
+        ppvs.append(true_positives / i)
+    return tprs, ppvs
+
+
+class TestEvalContactMetrics():
+
+    def test_matches_reference(self):
+        rng = np.random.RandomState(4)
+        # Continuous values, so that there are no ties
+        pred_contact_mtx = rng.rand(8, 6)
+        true_contact_mtx = (rng.rand(8, 6) < 0.2).astype(int)
+        tprs, ppvs = contacts.eval_contact_metrics(true_contact_mtx,
+                                                   pred_contact_mtx, limit=30)
+        exp_tprs, exp_ppvs = metrics_reference(true_contact_mtx,
+                                               pred_contact_mtx, 30)
+        assert np.allclose(tprs, exp_tprs)
+        assert np.allclose(ppvs, exp_ppvs)
+
+    def test_full_matrix(self):
+        rng = np.random.RandomState(5)
+        pred_contact_mtx = rng.rand(4, 5)
+        true_contact_mtx = (rng.rand(4, 5) < 0.3).astype(int)
+        tprs, ppvs = contacts.eval_contact_metrics(true_contact_mtx,
+                                                   pred_contact_mtx,
+                                                   limit=None)
+        assert len(tprs) == len(ppvs) == 20
+        assert tprs[-1] == 1
+        assert np.isclose(ppvs[-1], true_contact_mtx.mean())
+        with pytest.warns(RuntimeWarning):
+            tprs, _ = contacts.eval_contact_metrics(true_contact_mtx,
+                                                    pred_contact_mtx,
+                                                    limit=100)
+        assert len(tprs) == 20
+
+
+class TestPrecisionAtLength():
+
+    def test_per_iteration(self):
+        rng = np.random.RandomState(6)
+        true_contact_mtx = (rng.rand(10, 12) < 0.2).astype(int)
+        pred_contact_mtxs = [rng.rand(10, 12) for _ in range(3)]
+        precisions = contacts.precision_at_length(true_contact_mtx,
+                                                  pred_contact_mtxs,
+                                                  ks=(1, 2, 5, 20))
+        assert precisions.shape == (3, 4)
+        for i, pred_contact_mtx in enumerate(pred_contact_mtxs):
+            _, ppvs = contacts.eval_contact_metrics(true_contact_mtx,
+                                                    pred_contact_mtx,
+                                                    limit=10)
+            # L = 10; L/20 is rounded up to one prediction
+            assert np.allclose(precisions[i], [ppvs[9], ppvs[4], ppvs[1],
+                                               ppvs[0]])
@@ -7,20 +7,28 @@ expectation-maximization.
 """
 
 import os
+import hashlib
+import pickle
 
 import numpy as np
+from scipy.special import expit
 from tqdm import tqdm
 
 from copy import copy
 import warnings
 
 from sklearn.linear_model import SGDClassifier
+from joblib import Parallel, delayed
 
 from dummyestimator import DummyEstimator
-from globalvars import ALPHA_RANGE
+from globalvars import ALPHA_RANGE, AA_TABLE
 import output
-from contacts import compute_couplings, get_interacting, normalize_contact_mtx
+from contacts import compute_couplings, get_interacting, interacting_idxs, \
+    normalize_contact_mtx
 from helpers import round_labels
+from matrix_io import save_matrix, run_or_submit, BackgroundWriter
+from batchsolver import fit_batch_msa_models, BatchColumnModel, \
+    as_design_matrix
 
 
 ##################################
@@ -136,7 +144,8 @@ def has_converged(labels, pre_labels, mode, tol=0.005):
 
 
 def calc_alt_llhs(num_mtx_a, bin_mtx_b, models_a, num_mtx_b, bin_mtx_a,
-                  models_b, out_dir, iters):
+                  models_b, out_dir, iters, alt_cache=None,
+                  output_format='npy', writer=None):
     """
     Given two multiple sequence alignments in numeric matrix and binary matrix
     form, calculate sequence pair alternative log-likelihoods.
@@ -156,28 +165,47 @@ def calc_alt_llhs(num_mtx_a, bin_mtx_b, models_a, num_mtx_b, bin_mtx_a,
                           (number of columns x number of allowed amino acids))
     models_a, models_b:   list, contains one fitted SGDClassifer object per MSA
                           column
+    alt_cache:            dict, per-column log-probabilities of previous
+                          calls with the same alignments, updated in place;
+                          see get_alt_model()
+    output_format:        str, file format of the dumped matrix; see
+                          matrix_io.save_matrix()
+    writer:               matrix_io.BackgroundWriter that writes the matrix;
+                          if None, it is written before returning
 
     Returns
     -------
     alt_llhs:             list, contains alternative sequence pair
                           log-likelihoods
     """
-    alt_mtx1 = get_alt_model(num_mtx_a, bin_mtx_b, models_a)
-    alt_mtx2 = get_alt_model(num_mtx_b, bin_mtx_a, models_b)
+    if alt_cache is None:
+        cache_a, cache_b = None, None
+    else:
+        cache_a = alt_cache.setdefault('a', {})
+        cache_b = alt_cache.setdefault('b', {})
+    alt_mtx1 = get_alt_model(num_mtx_a, bin_mtx_b, models_a, cache=cache_a)
+    alt_mtx2 = get_alt_model(num_mtx_b, bin_mtx_a, models_b, cache=cache_b)
     concat_mtx = np.concatenate((alt_mtx1, alt_mtx2), axis=1)
-    np.savetxt(os.path.join(out_dir, "".join(
-        ["alt_llhs_mtx_", str(iters), ".csv"])), concat_mtx, delimiter=',')
+    run_or_submit(writer, save_matrix, os.path.join(out_dir, "".join(
+        ["alt_llhs_mtx_", str(iters)])), concat_mtx, output_format)
     alt_llhs = np.sum(concat_mtx, axis=1)
     return alt_llhs
 
 
-def get_alt_model(num_mtx, bin_mtx, models, pc=np.log(1 / 210)):
+def get_alt_model(num_mtx, bin_mtx, models, pc=np.log(1 / 210), cache=None,
+                  chunk_bytes=64 * 2 ** 20):
     """
     Given a multiple sequence alignment in numeric matrix form, the other
     alignment in binary matrix form, and the fitted models, this function
     will find an appropiate value of lambda for each model and return the
     fitted probabilities according to the logistic models.
 
+    The coefficients of the SGDClassifier and BatchColumnModel models are
+    stacked into matrices of up to chunk_bytes, so that the scores of a whole
+    group of columns come from one matrix product per chunk of rows; each
+    model then turns its slice of the scores into log-probabilities. Other
+    models (e.g. DummyEstimator) are predicted one by one.
+
     Arguments
     ---------
     num_mtx: array-like. Contains a multiple sequence alignment as a numeric
@@ -189,154 +217,284 @@ def get_alt_model(num_mtx, bin_mtx, models, pc=np.log(1 / 210)):
     models:  list, contains one fitted model object per MSA column
     pc:      float, pseudocount for when a residue was not present in the
              training data, as its probability cannot be estimated properly
+    cache:   dict, maps column index to the fingerprint of its model and the
+             log-probabilities it gave, updated in place. Columns whose
+             model has not changed since the previous call (e.g. dummy
+             models) are not predicted again. Only reuse a cache with the
+             same num_mtx and bin_mtx.
+    chunk_bytes: int, approximate size in bytes of the stacked coefficients
+             of a group of models, and of a chunk of rows of bin_mtx
+             converted to floating point together with its scores. The
+             memory of the stacked products is a small multiple of it (or
+             of the size of the largest single model, if larger)
 
     Returns
     ---------
     alt_mtx: array-like. Contains the values of the log-probability of the data
              according to the logistic models, element-wise.
     """
-    alt_mtx = np.zeros_like(num_mtx,dtype='float64').T
+    num_mtx = np.asarray(num_mtx)
+    alt_mtx = np.zeros_like(num_mtx, dtype='float64').T
 
-    # Iterate over columns and their corresponding models
+    stacked = []
+    fingerprints = {}
     for i, col in enumerate(num_mtx.T):
         cur_model = models[i]
 
-        # Get model predictions
-        log_probs = cur_model.predict_log_proba(bin_mtx)
-
-        for j, res in enumerate(col):
-            if res in cur_model.classes_:
-                # Get index of residue type in self.classes_
-                res_idx = np.asscalar(np.where(cur_model.classes_ == res)[0])
-                log_prob = log_probs[:, res_idx][j]
-                # Check whether it has 0 probability
-                if log_prob != float('-inf'):
-                    alt_mtx[i][j] = log_prob  # Use predicted probability
-                else:  # If it is 0, use a pseudocount
-                    alt_mtx[i][j] = pc
-            # If the residue was not in the training data, use pseudocount
-            # (possible in hard EM)
-            else:
-                alt_mtx[i][j] = pc
+        if cache is not None:
+            fingerprints[i] = model_fingerprint(cur_model)
+            if i in cache and cache[i][0] == fingerprints[i]:
+                alt_mtx[i] = cache[i][1]
+                continue
+
+        if isinstance(cur_model, (SGDClassifier, BatchColumnModel)):
+            stacked.append(i)
+        else:
+            # Get model predictions and pick the one of the observed residue
+            log_probs = cur_model.predict_log_proba(bin_mtx)
+            alt_mtx[i] = gather_logprobs(col, log_probs, cur_model.classes_,
+                                         pc)
+            if cache is not None:
+                cache[i] = (fingerprints[i], alt_mtx[i].copy())
+
+    n_features = bin_mtx.shape[1]
+    for group in stacked_groups(models, stacked, n_features, chunk_bytes):
+        coefs = np.vstack([models[i].coef_ for i in group]).T
+        intercepts = np.concatenate([models[i].intercept_ for i in group])
+        offsets = np.cumsum([0] + [len(models[i].intercept_)
+                                   for i in group])
+        chunk_rows = max(1, chunk_bytes // (8 * (n_features +
+                                                 coefs.shape[1])))
+        for start in range(0, num_mtx.shape[0], chunk_rows):
+            stop = start + chunk_rows
+            # Scores of all the models of the group in a single product; the
+            # rows are converted to floating point one chunk at a time
+            scores = np.asarray(as_design_matrix(bin_mtx[start:stop]) @
+                                coefs) + intercepts
+            for j, i in enumerate(group):
+                log_probs = log_proba_from_scores(
+                    models[i], scores[:, offsets[j]:offsets[j + 1]])
+                alt_mtx[i, start:stop] = gather_logprobs(
+                    num_mtx[start:stop, i], log_probs, models[i].classes_, pc)
+
+    if stacked and cache is not None:
+        for i in stacked:
+            cache[i] = (fingerprints[i], alt_mtx[i].copy())
 
     # Return alternative model matrix
     return alt_mtx.T
 
 
-def select_interacting(num_mtx, bin_mtx, labels):
+def stacked_groups(models, idxs, n_features, chunk_bytes):
+    """
+    Auxiliary function for get_alt_model().
+    Split the models to stack into consecutive groups whose stacked
+    coefficients take up to chunk_bytes (at least one model per group).
+    """
+    groups = [[]]
+    group_bytes = 0
+    for i in idxs:
+        model_bytes = 8 * n_features * len(models[i].intercept_)
+        if groups[-1] and group_bytes + model_bytes > chunk_bytes:
+            groups.append([])
+            group_bytes = 0
+        groups[-1].append(i)
+        group_bytes += model_bytes
+    return [group for group in groups if group]
+
+
+def log_proba_from_scores(model, scores):
+    """
+    Auxiliary function for get_alt_model().
+    Log-probabilities of the classes of a model given its scores
+    (X @ coef_.T + intercept_), as predict_log_proba() would return them.
+
+    SGDClassifier probabilities are computed as in scikit-learn: the logistic
+    function of the scores, normalized over the classes (one-versus-rest)
+    when there are more than two.
+    """
+    if isinstance(model, BatchColumnModel):
+        return model.log_proba_from_scores(scores)
+    probs = expit(scores)
+    if probs.shape[1] == 1:
+        probs = np.hstack((1 - probs, probs))
+    else:
+        probs /= probs.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore'):
+        return np.log(probs)
+
+
+def model_fingerprint(model):
+    """
+    Hash the parameters that determine the predictions of a fitted model:
+    coefficients, intercepts and classes, plus the fixed probability of
+    DummyEstimator objects.
+
+    Arguments
+    ---------
+    model:  fitted SGDClassifier or DummyEstimator object
+
+    Returns
+    -------
+    fingerprint: str, hex digest identifying the fitted parameters
+    """
+    digest = hashlib.sha1(type(model).__name__.encode())
+    for attr in ('prob', 'classes_', 'coef_', 'intercept_'):
+        if hasattr(model, attr):
+            values = np.ascontiguousarray(getattr(model, attr))
+            digest.update(''.join([attr, str(values.dtype),
+                                   str(values.shape)]).encode())
+            digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def gather_logprobs(col, log_probs, classes, pc=np.log(1 / 210)):
+    """
+    Select, for each observation, the log-probability that a model assigns to
+    the residue that was actually observed.
+
+    Residues are mapped to indexes of classes through a lookup table over the
+    amino acid alphabet, so the selection is done with a single fancy
+    indexing operation instead of searching classes for every residue.
+
+    Arguments
+    ---------
+    col:        array-like, MSA column in numeric form
+    log_probs:  array-like, (n_observations x n_classes) log-probabilities as
+                returned by predict_log_proba()
+    classes:    array-like, classes_ attribute of the model
+    pc:         float, pseudocount for residues that were not present in the
+                training data or were predicted with 0 probability
+
+    Returns
+    -------
+    logprobs:   array, log-probability of each observed residue
+    """
+    col = np.asarray(col).astype(int)
+    classes = np.asarray(classes).astype(int)
+
+    # Map each residue to its index in classes; -1 if it was not in the
+    # training data (possible in hard EM)
+    lookup = np.full(len(AA_TABLE), -1, dtype=int)
+    lookup[classes] = np.arange(len(classes))
+    class_idxs = lookup[col]
+    seen = np.where(class_idxs >= 0)[0]
+
+    logprobs = np.full(col.shape[0], pc, dtype='float64')
+    logprobs[seen] = np.asarray(log_probs)[seen, class_idxs[seen]]
+    # Residues predicted with 0 probability also get the pseudocount
+    logprobs[np.isneginf(logprobs)] = pc
+
+    return logprobs
+
+
+def select_interacting(num_mtx, bin_mtx, labels, seqs_weight):
     """
     Auxiliary function for fit_msa_mdels.
     Used for fitting the models in hard EM; selects observations with a hidden
-    variable value of 1.
+    variable value of 1, and their sequence weights.
     """
     if labels is None:
         # This is the case when initializing the models
-        return num_mtx, bin_mtx, labels
+        return num_mtx, bin_mtx, labels, seqs_weight
     else:
         # This is the case inside the EM loop
         labels = np.asarray(labels)
+        if len(seqs_weight) != len(labels):
+            raise ValueError(f'Got {len(seqs_weight)} sequence weights for '
+                             f'{len(labels)} observations')
         idxs = np.where(np.asarray(labels) == 1)[0]
 
         int_num = np.take(num_mtx, idxs, axis=0)
-        int_bin = np.take(bin_mtx, idxs, axis=0)
+        # Row indexing works for both dense and sparse matrices
+        int_bin = bin_mtx[idxs]
         weights = np.take(labels, idxs)
+        int_seqs_weight = np.take(seqs_weight, idxs)
 
-        return int_num, int_bin, weights
+        return int_num, int_bin, weights, int_seqs_weight
 
 
 def fit_msa_models(num_mtx, bin_mtx, mode, seqs_weight, fixed_alphas=None, n_jobs=2,
                    sample_weights=None, l1_ratio=0.99, dfmax=100,
-                   random_state=42, sgd_tol=1e-3):
+                   random_state=42, sgd_tol=1e-3, prev_models=None,
+                   path_warm_start=False, solver='sgd'):
     """
     Given two MSAs, one in numeric matrix format and another in binary matrix
     format, fit logistic regressions for each column in the numeric matrix
     using the binary matrix as predictors.
 
+    Columns are independent of each other, so they are fitted concurrently in
+    a pool of n_jobs worker processes. The binary matrix is shared read-only
+    between the workers (joblib memory-maps large arrays) and the models are
+    returned in the same order as the columns of the numeric matrix.
+
     Arguments
     ---------
     num_mtx:            array-like, MSA in numeric matrix form
-    bin_mtx:            arrray-like, MSA in binary matrix form
+    bin_mtx:            arrray-like, MSA in binary matrix form; dense or
+                        scipy.sparse CSR
     mode:               string, whether we are performing 'soft' or 'hard' EM
     fixed_alphas:       list, values of alpha to use in model fitting
     n_jobs:             int, number of CPUs to use in model fitting
     seqs_weight:        list, weight of each observation when they are in one cluster
-    sample_weights:     list, weight for each observation
+    sample_weights:     list, weight for each observation; in hard EM, the
+                        observations with a value of 1 are selected, together
+                        with their seqs_weight (ValueError if the lengths
+                        differ)
     l1_ratio:           float, elastic net mixing parameter
     dfmax:              int, maximum number of degrees of freedom allowed in
                         the models
     random_state:       int, random state for stochastic gradient descent
     sgd_tol:            float, tolerance for stochastic gradient descent
+    prev_models:        list, models of the previous EM iteration, one per
+                        column; with fixed_alphas, each column's fit starts
+                        from the coefficients of its previous model
+    path_warm_start:    bool, when selecting alpha, whether to fit each
+                        value of ALPHA_RANGE starting from the solution for
+                        the previous, stronger one
+    solver:             str, 'sgd' to fit one SGDClassifier per column, or
+                        'batch' to fit multinomial models for all the columns
+                        jointly with batchsolver.fit_batch_msa_models() (which
+                        always warm-starts along ALPHA_RANGE)
 
     Returns
     -------
-    models:             list of fitted SGDClassifier objects
+    models:             list of fitted SGDClassifier objects (BatchColumnModel
+                        objects with solver='batch')
     alpha_per_col:      list, selected values of alpha; only returned if no
                         value was passed to fixed_alphas
     """
-    models = []
     n_obs = num_mtx.shape[0]
-    alpha_per_col = []
 
     # Select cases with a hidden variable value of 1 in hard EM
     if mode == 'hard':
-        num_mtx, bin_mtx,\
-            sample_weights = select_interacting(num_mtx, bin_mtx,
-                                                sample_weights)
+        num_mtx, bin_mtx, sample_weights,\
+            seqs_weight = select_interacting(num_mtx, bin_mtx, sample_weights,
+                                             seqs_weight)
+
+    if solver == 'batch':
+        return fit_batch_msa_models(num_mtx, bin_mtx, seqs_weight,
+                                    fixed_alphas=fixed_alphas,
+                                    sample_weights=sample_weights,
+                                    l1_ratio=l1_ratio, dfmax=dfmax,
+                                    n_obs=n_obs, prev_models=prev_models)
+    elif solver != 'sgd':
+        raise ValueError(f'Unknown solver: {solver}')
 
     # Fit models for each column of the MSA
-    for idx, col in enumerate(tqdm(num_mtx.T)):
-        if len(np.unique(col)) > 1:  # Column contains more than one class
-            col_models = []
-            col_dfs = []
-            col_bics = []
-            # Initialization: if no predefined values of the regularization
-            # strenght are given, train models on a range of them and select one
-            if fixed_alphas is None:
-                for alpha in ALPHA_RANGE:
-                    clf = SGDClassifier(loss='log', penalty='elasticnet',
-                                        alpha=alpha, l1_ratio=l1_ratio,
-                                        n_jobs=n_jobs, max_iter=100,
-                                        random_state=random_state, tol=sgd_tol)
-                    # now the sample weights is none
-                    clf.fit(bin_mtx, col, sample_weight=sample_weights)
-                    
-                    # Discard models with a number of degrees of freedom above
-                    # a certain threshold
-                    dfs = calc_degrees_freedom(clf)
-                    if dfs <= dfmax:
-                        col_models.append(clf)
-                        col_dfs.append(dfs)
-                    else: # Stop once models are overtly complex
-                        break
-
-                # Select regularization strenght by choosing the model with the
-                # minimum Bayesian Information Criterion
-                for j, model in enumerate(col_models):
-                    posterior_logprobs = get_posterior_logprobs(col,
-                                                                bin_mtx, model)
-                    bic = calc_bic(posterior_logprobs, col_dfs[j], n_obs)
-                    col_bics.append(bic)
-                best_idx = col_bics.index(min(col_bics))
-                models.append(col_models[best_idx])
-                alpha_per_col.append(ALPHA_RANGE[best_idx])
-
-            else:
-                # EM iterations after initialization: if predefined values of
-                # the regularization strength are given, use those to fit models
-                clf = SGDClassifier(loss='log', penalty='elasticnet',
-                                    alpha=fixed_alphas[idx], l1_ratio=l1_ratio,
-                                    n_jobs=n_jobs, max_iter=1000,
-                                    random_state=random_state, tol=sgd_tol)
-                clf.fit(bin_mtx, col, sample_weight=np.multiply(sample_weights, seqs_weight))
-                models.append(clf)
-        else:  # Column contains only one class; use a dummy model
-            # Can happen in hard EM
-            clf = DummyEstimator(prob=0.99 - (1 / 210))
-            clf.fit(bin_mtx, col)
-            models.append(clf)
-            if fixed_alphas is None:
-                # Commonly selected value, strong regularization
-                alpha_per_col.append(0.01)
+    fits = Parallel(n_jobs=n_jobs)(
+        delayed(fit_column_model)(col, bin_mtx, n_obs, seqs_weight,
+                                  fixed_alpha=None if fixed_alphas is None
+                                  else fixed_alphas[idx],
+                                  sample_weights=sample_weights,
+                                  l1_ratio=l1_ratio, dfmax=dfmax,
+                                  random_state=random_state, sgd_tol=sgd_tol,
+                                  prev_model=None if prev_models is None
+                                  else prev_models[idx],
+                                  path_warm_start=path_warm_start)
+        for idx, col in enumerate(tqdm(num_mtx.T)))
+    models = [clf for clf, _ in fits]
+    alpha_per_col = [alpha for _, alpha in fits]
 
     if fixed_alphas:
         return models, None
@@ -344,6 +502,104 @@ def fit_msa_models(num_mtx, bin_mtx, mode, seqs_weight, fixed_alphas=None, n_job
         return models, alpha_per_col
 
 
+def fit_column_model(col, bin_mtx, n_obs, seqs_weight, fixed_alpha=None,
+                     sample_weights=None, l1_ratio=0.99, dfmax=100,
+                     random_state=42, sgd_tol=1e-3, prev_model=None,
+                     path_warm_start=False):
+    """
+    Auxiliary function for fit_msa_models().
+    Fit the logistic model of a single MSA column. If no value of alpha is
+    given, models are trained over ALPHA_RANGE and the one with the minimum
+    Bayesian Information Criterion is selected. ALPHA_RANGE goes from the
+    strongest to the weakest regularization, so with path_warm_start every
+    fit starts from the sparser solution of the previous one.
+
+    Arguments
+    ---------
+    col:            array-like, MSA column in numeric form (response)
+    bin_mtx:        array-like, other MSA in binary matrix form (predictors)
+    n_obs:          int, number of observations used to compute the BIC
+    seqs_weight:    list, weight of each observation when they are in one
+                    cluster
+    fixed_alpha:    float, value of alpha to use in model fitting
+    prev_model:     fitted model of the previous EM iteration; with
+                    fixed_alpha, SGD starts from its coefficients if it was
+                    fitted on the same classes
+    path_warm_start: bool, whether to warm-start along ALPHA_RANGE
+
+    The remaining arguments are as in fit_msa_models().
+
+    Returns
+    -------
+    clf:            fitted SGDClassifier (or DummyEstimator) object
+    alpha:          float, selected value of alpha; None if fixed_alpha was
+                    given
+    """
+    if len(np.unique(col)) <= 1:
+        # Column contains only one class; use a dummy model
+        # Can happen in hard EM
+        clf = DummyEstimator(prob=0.99 - (1 / 210))
+        clf.fit(bin_mtx, col)
+        if fixed_alpha is None:
+            # Commonly selected value, strong regularization
+            return clf, 0.01
+        return clf, None
+
+    if fixed_alpha is not None:
+        # EM iterations after initialization: if predefined values of
+        # the regularization strength are given, use those to fit models
+        clf = SGDClassifier(loss='log', penalty='elasticnet',
+                            alpha=fixed_alpha, l1_ratio=l1_ratio,
+                            n_jobs=1, max_iter=1000,
+                            random_state=random_state, tol=sgd_tol)
+        if isinstance(prev_model, SGDClassifier) and \
+                np.array_equal(prev_model.classes_, np.unique(col)):
+            # Labels change little between EM iterations: start from the
+            # previous solution instead of from zero. SGD updates the initial
+            # coefficients in place, so pass copies
+            clf.fit(bin_mtx, col, coef_init=prev_model.coef_.copy(),
+                    intercept_init=prev_model.intercept_.copy(),
+                    sample_weight=np.multiply(sample_weights, seqs_weight))
+        else:
+            clf.fit(bin_mtx, col,
+                    sample_weight=np.multiply(sample_weights, seqs_weight))
+        return clf, None
+
+    # Initialization: if no predefined values of the regularization
+    # strenght are given, train models on a range of them and select one
+    col_models = []
+    col_dfs = []
+    col_bics = []
+    for alpha in ALPHA_RANGE:
+        clf = SGDClassifier(loss='log', penalty='elasticnet',
+                            alpha=alpha, l1_ratio=l1_ratio,
+                            n_jobs=1, max_iter=100,
+                            random_state=random_state, tol=sgd_tol)
+        # now the sample weights is none
+        if path_warm_start and col_models:
+            clf.fit(bin_mtx, col, coef_init=col_models[-1].coef_.copy(),
+                    intercept_init=col_models[-1].intercept_.copy(),
+                    sample_weight=sample_weights)
+        else:
+            clf.fit(bin_mtx, col, sample_weight=sample_weights)
+
+        # Discard models with a number of degrees of freedom above
+        # a certain threshold
+        dfs = calc_degrees_freedom(clf)
+        if dfs <= dfmax:
+            col_models.append(clf)
+            col_dfs.append(dfs)
+        else:  # Stop once models are overtly complex
+            break
+
+    # Select regularization strenght by choosing the model with the
+    # minimum Bayesian Information Criterion
+    for j, model in enumerate(col_models):
+        posterior_logprobs = get_posterior_logprobs(col, bin_mtx, model)
+        bic = calc_bic(posterior_logprobs, col_dfs[j], n_obs)
+        col_bics.append(bic)
+    best_idx = col_bics.index(min(col_bics))
+    return col_models[best_idx], ALPHA_RANGE[best_idx]
 
 
 def get_posterior_logprobs(col, bin_mtx, model, pc=np.log(1 / 210)):
@@ -351,23 +607,7 @@ def get_posterior_logprobs(col, bin_mtx, model, pc=np.log(1 / 210)):
     Given a model, calculate the log probability of the observations.
     """
     log_probs = model.predict_log_proba(bin_mtx)
-    posterior_logprobs = []
-    for idx, res in enumerate(col):
-        # Check if the residue was in the training data
-        if res in model.classes_:
-            # Get index of residue in self.classes_
-            res_idx = np.asscalar(np.where(model.classes_ == res)[0])
-            # Retrieve the log-probability
-            log_prob = log_probs[:, res_idx][idx]
-            # Check whether the probability equals 0
-            if log_prob != float('-inf'):
-                posterior_logprobs.append(log_prob)
-            else:  # If it, use a pseudocount
-                posterior_logprobs.append(pc)
-        else:  # If the residue was not in the training data, use a pseudocount
-            posterior_logprobs.append(pc)
-
-    return posterior_logprobs
+    return gather_logprobs(col, log_probs, model.classes_, pc)
 
 
 def calc_degrees_freedom(model):
@@ -413,7 +653,8 @@ def calc_bic(posterior_logprobs, dfs, n_obs):
 ##############
 
 
-def calc_null_llhs(a1, a2, mode, weights, out_path, iters, pc_null=1 / 2100):
+def calc_null_llhs(a1, a2, mode, weights, out_path, iters, pc_null=1 / 2100,
+                   output_format='npy', writer=None):
     """
     TODO: unit test
     Calculate the log-likelihood of each sequence pair in the MSAs
@@ -433,6 +674,10 @@ def calc_null_llhs(a1, a2, mode, weights, out_path, iters, pc_null=1 / 2100):
     iters:     int, number of iterations
     pc_null:   float, pseudocount for residues that did not appear in examples
                used to build the null model
+    output_format: str, file format of the dumped matrix; see
+               matrix_io.save_matrix()
+    writer:    matrix_io.BackgroundWriter that writes the matrix; if None, it
+               is written before returning
 
     Returns
     ---------
@@ -456,9 +701,8 @@ def calc_null_llhs(a1, a2, mode, weights, out_path, iters, pc_null=1 / 2100):
     null_mtx_2 = score_null(a2, null_2, pc_null)
 
     concat_mtx = np.concatenate((null_mtx_1, null_mtx_2), axis=1)
-    np.savetxt(os.path.join(out_path,
-                            ''.join(['null_llhs_mtx_', str(iters), '.csv'])),
-               concat_mtx, delimiter=',')
+    run_or_submit(writer, save_matrix, os.path.join(out_path, ''.join(
+        ['null_llhs_mtx_', str(iters)])), concat_mtx, output_format)
     null_llhs = np.sum(concat_mtx, axis=1)
 
     return null_llhs
@@ -469,7 +713,7 @@ def get_null_model(array, weights, pc_null):
     Given a multiple sequence alignment in numeric matrix format, calculates
     the log-probability (weighted according to the values of the hidden
     variables) of each residue in each column. It returns this information in a
-    position weight matrix-like format.
+    position weight matrix format.
     Only call from within calc_null_llhs().
 
     Arguments
@@ -482,35 +726,36 @@ def get_null_model(array, weights, pc_null):
 
     Returns
     ---------
-    null_model: list of dicts. Each dictionary contains the null model for each
-                column. Each key is an amino acid, as it appears in the numeric
-                matrix, and the value is it's weighted probability.
+    null_model: array, (number of MSA columns x size of the amino acid
+                alphabet). Element [i, j] is the weighted log-probability of
+                the residue with numeric code j in column i. Residues that do
+                not appear in a column are NaN.
                 Can be thought of as a position weight matrix.
     """
-
-    null_model = []
+    array = np.asarray(array).astype(int)
+    n_cols = array.shape[1]
+    n_aas = len(AA_TABLE)
     # Number of observations with z=1 when doing hard-EM,
     # just the sum of the weights when doing soft EM!
     total = np.sum(weights, dtype="longdouble")
 
-    for i, val in enumerate(array.T):
-        # Obtain unique column elements
-        items = np.unique(val)
-        col_dict = {}
-        for item in items:
-            # Get indexes where this element appears
-            idxs = np.where(val == item)[0]
-            # Calculate (weighted) element probability
-            prob = np.sum([weights[idx]
-                           for idx in idxs], dtype="longdouble") / total
-            # Check if probability is 0; use a pseudocount in that case
-            # This can happen in soft EM in the edge case that all cases that
-            # contain the residue have an associated hidden variable equal to 1
-            if prob == 0:
-                col_dict[str(item)] = np.log(pc_null)
-            else:
-                col_dict[str(item)] = np.log(prob)
-        null_model.append(col_dict)
+    # Weighted residue counts of all columns with a single bincount: every
+    # column gets its own block of n_aas bins
+    bins = (array + np.arange(n_cols) * n_aas).ravel()
+    weighted_counts = np.bincount(
+        bins, weights=np.repeat(np.asarray(weights, dtype='float64'), n_cols),
+        minlength=n_cols * n_aas).reshape(n_cols, n_aas)
+    present = np.bincount(bins, minlength=n_cols * n_aas).reshape(
+        n_cols, n_aas) > 0
+    probs = weighted_counts.astype("longdouble") / total
+
+    null_model = np.full((n_cols, n_aas), np.nan, dtype="longdouble")
+    # Check if probability is 0; use a pseudocount in that case
+    # This can happen in soft EM in the edge case that all cases that
+    # contain the residue have an associated hidden variable equal to 1
+    null_model[present] = np.log(pc_null)
+    nonzero = present & (probs > 0)
+    null_model[nonzero] = np.log(probs[nonzero])
 
     return null_model
 
@@ -523,10 +768,7 @@ def score_null(array, null_model, pc_null):
     Arguments
     ---------
     array:      array-like, multiple sequence alignment as numeric matrix
-    null_model: list of dicts. Each dictionary contains the null model for each
-                column. Each key is an amino acid, as it appears in the numeric
-                matrix, and the value is it's weighted probability.
-                Can be thought of as a position weight matrix.
+    null_model: array, position weight matrix as returned by get_null_model()
     pc_null:    float, pseudocount for residues that did not appear in examples
                 used to build the null model
     Returns
@@ -534,19 +776,14 @@ def score_null(array, null_model, pc_null):
     null_mtx:   array-like, contains residue log-probabilities according to the
                 null model for each position in each sequence
     """
-    null_mtx = np.zeros_like(array, dtype='float64').T
-
-    # Iterate over array columns and fill log-probability matrix
-    for idx, val in enumerate(array.T):
-        for j, item in enumerate(val):
-            try:
-                null_mtx[idx][j] = null_model[idx][str(item)]
-            except KeyError:
-                # Residue not present in examples used to build the null model;
-                # use a pseudocount
-                null_mtx[idx][j] = pc_null
+    array = np.asarray(array).astype(int)
+    null_mtx = np.take_along_axis(np.asarray(null_model, dtype='float64'),
+                                  array.T, axis=1).T
+    # Residue not present in examples used to build the null model;
+    # use a pseudocount
+    null_mtx[np.isnan(null_mtx)] = np.log(pc_null)
 
-    return null_mtx.T
+    return null_mtx
 
 
 def select_noninteracting(num_mtx_a, num_mtx_b, labels):
@@ -574,10 +811,10 @@ def select_noninteracting(num_mtx_a, num_mtx_b, labels):
         raise Exception("""Hidden variable values other than 0 or 1 in call to
             corrmut.select_noninteracting(). This function is only called in
             hard EM, where values should be rounded to 0 or 1.""")
-    idxs = np.where(np.asarray(labels) == 0)
-    nonint_num_a = np.squeeze(np.take(num_mtx_a, idxs, axis=0))
-    nonint_num_b = np.squeeze(np.take(num_mtx_b, idxs, axis=0))
-    nonint_labels = np.squeeze(np.take(labels, idxs, axis=0))
+    idxs = np.where(np.asarray(labels) == 0)[0]
+    nonint_num_a = np.take(num_mtx_a, idxs, axis=0)
+    nonint_num_b = np.take(num_mtx_b, idxs, axis=0)
+    nonint_labels = np.take(labels, idxs, axis=0)
     return nonint_num_a, nonint_num_b, nonint_labels
 
 
@@ -586,7 +823,7 @@ def select_noninteracting(num_mtx_a, num_mtx_b, labels):
 ######################
 
 def contact_prediction(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a,
-                       labels, seqs_weight, mode, n_jobs, dfmax):
+                       labels, seqs_weight, mode, n_jobs, dfmax, solver='sgd'):
     """
     Function for a final round of contact prediction
     """
@@ -595,6 +832,8 @@ def contact_prediction(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a,
 
     int_num_a, int_bin_b, int_num_b, int_bin_a, weights = get_interacting(
         num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, labels, mode)
+    # The sequence weights go along with the selected observations
+    seqs_weight = np.take(seqs_weight, interacting_idxs(labels, mode))
     # Remove constant columns that might have appeared; keep the indexes of the
     # constant columns
 
@@ -602,10 +841,10 @@ def contact_prediction(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a,
     # strengths again
     models_a, alphas_a = fit_msa_models(
         int_num_a, int_bin_b, mode, seqs_weight, sample_weights=weights, n_jobs=n_jobs,
-        dfmax=dfmax)
+        dfmax=dfmax, solver=solver)
     models_b, alphas_b = fit_msa_models(
         int_num_b, int_bin_a, mode, seqs_weight, sample_weights=weights, n_jobs=n_jobs,
-        dfmax=dfmax)
+        dfmax=dfmax, solver=solver)
 
     couplings, contact_mtx = compute_couplings(models_a, models_b)
 
@@ -617,7 +856,8 @@ def contact_prediction(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a,
 ##############################
 
 def init_model(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, seqs_weight, mode,
-               init, int_frac, out_dir, n_jobs, dfmax):
+               init, int_frac, out_dir, n_jobs, dfmax, path_warm_start=False,
+               output_format='npy', writer=None, resume=False, solver='sgd'):
     """
     Calculate initial values for the hidden variables before starting the
     EM loop, either randomly or by warm initialization.
@@ -636,11 +876,24 @@ def init_model(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, seqs_weight, mode,
     out_dir:    str, output path
     n_jobs:     int, number of CPUs to use to fit the models
     dfmax:      int, maximum number of degrees of freedom allowed
+    path_warm_start: bool, whether to warm-start along ALPHA_RANGE
+    output_format: str, file format of the dumped matrices; see
+                matrix_io.save_matrix()
+    writer:     matrix_io.BackgroundWriter for the dumped files, or None to
+                write them synchronously
+    resume:     bool, whether to return the result checkpointed in out_dir by
+                a previous call, if any
+    solver:     str, solver of the models; see fit_msa_models()
 
     Returns
     ---------
     init_labels: array-like, initial values for the hidden variables
     """
+    checkpoint_path = os.path.join(out_dir, 'init_checkpoint.pkl')
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None:
+        print('Resuming from the checkpointed initialization')
+        return checkpoint
 
     if init == 'random':
         init_labels = get_random_labels(num_mtx_a.shape[0], int_frac, mode)
@@ -655,42 +908,54 @@ def init_model(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, seqs_weight, mode,
         # do not pass sample weights
         print('Fitting models for MSA A...')
         models_a, alphas_a = fit_msa_models(num_mtx_a, bin_mtx_b, mode, seqs_weight, n_jobs=n_jobs,
-                                            dfmax=dfmax)
+                                            dfmax=dfmax,
+                                            path_warm_start=path_warm_start,
+                                            solver=solver)
         print('Fitting models for MSA B...')
         models_b, alphas_b = fit_msa_models(num_mtx_b, bin_mtx_a, mode, seqs_weight, n_jobs=n_jobs,
-                                            dfmax=dfmax)
+                                            dfmax=dfmax,
+                                            path_warm_start=path_warm_start,
+                                            solver=solver)
 
         couplings, contact_mtx = compute_couplings(models_a, models_b)
-        np.savetxt(os.path.join(out_dir, ''.join(
-            ['contact_mtx_', 'init', '.csv'])), contact_mtx, delimiter=',')
+        run_or_submit(writer, save_matrix, os.path.join(out_dir, ''.join(
+            ['contact_mtx_', 'init'])), contact_mtx, output_format)
         norm_contact_mtx = normalize_contact_mtx(contact_mtx)
-        np.savetxt(os.path.join(out_dir, ''.join(
-            ['norm_contact_mtx_', 'init', '.csv'])), contact_mtx, delimiter=',')
+        run_or_submit(writer, save_matrix, os.path.join(out_dir, ''.join(
+            ['norm_contact_mtx_', 'init'])), contact_mtx, output_format)
 
-        np.savetxt(os.path.join(out_dir, ''.join(
+        run_or_submit(writer, np.savetxt, os.path.join(out_dir, ''.join(
             ['fixed_alphas_a_iter_', str('init'), '.csv'])), alphas_a)
-        np.savetxt(os.path.join(out_dir, ''.join(
+        run_or_submit(writer, np.savetxt, os.path.join(out_dir, ''.join(
             ['fixed_alphas_b_iter_', str('init'), '.csv'])), alphas_b)
 
         alt_llhs = calc_alt_llhs(num_mtx_a, bin_mtx_b, models_a, num_mtx_b,
-                                 bin_mtx_a, models_b, out_dir, iters='init')
+                                 bin_mtx_a, models_b, out_dir, iters='init',
+                                 output_format=output_format, writer=writer)
 
         # Observation weights passed to this call is a list of 0s;
         # every sequence pair gets the maximum weight
         null_llhs = calc_null_llhs(num_mtx_a, num_mtx_b, mode,
                                    num_mtx_a.shape[0] * [0],
-                                   out_dir, 'init')
+                                   out_dir, 'init',
+                                   output_format=output_format, writer=writer)
 
         init_labels = update_labels(
             alt_llhs, null_llhs, int_frac, mode=mode)
 
-    return init_labels, alt_llhs, null_llhs, norm_contact_mtx, alphas_a, alphas_b
+    result = (init_labels, alt_llhs, null_llhs, norm_contact_mtx, alphas_a,
+              alphas_b)
+    save_checkpoint(checkpoint_path, result, writer)
+    return result
 
 
 def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
             int_frac, mode, out_dir, n_jobs,
             max_iters=20, tol=0.005,
-            true_labels=None, dfmax=100, fixed_alphas_a=None, fixed_alphas_b=None):
+            true_labels=None, dfmax=100, fixed_alphas_a=None, fixed_alphas_b=None,
+            race_dir=None, race_start=None, race_margin=None, race_min_iters=3,
+            warm_start=False, path_warm_start=False, output_format='npy',
+            writer=None, resume=False, solver='sgd'):
     """
     Main function for carrying out expectation-maximization.
 
@@ -715,6 +980,29 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
     max_iters:            int, maximum number of EM iterations
     tol:                  float, difference threshold for convergence check
     true_labels:          list, contains ground truth labels
+    race_dir:             str, directory where the random starts of
+                          em_wrapper() post their total log-likelihoods; if
+                          None, racing is disabled
+    race_start:           int, index of this random start
+    race_margin:          float, the loop stops once its total log-likelihood
+                          trails the best other start by more than this
+    race_min_iters:       int, number of iterations before a start can be
+                          stopped
+    warm_start:           bool, whether each column's model is refitted
+                          starting from its model of the previous iteration
+    path_warm_start:      bool, whether to warm-start along ALPHA_RANGE when
+                          selecting the values of alpha
+    output_format:        str, file format of the dumped matrices; see
+                          matrix_io.save_matrix()
+    writer:               matrix_io.BackgroundWriter for the dumped files, so
+                          that they are written while the next iteration
+                          runs; if None, they are written synchronously
+    resume:               bool, whether to continue from the checkpoint in
+                          out_dir, if any, instead of starting from labels.
+                          The state of the loop is checkpointed to out_dir
+                          after every iteration, and the values returned
+                          below are appended to a log next to it.
+    solver:               str, solver of the models; see fit_msa_models()
 
     Returns
     ---------
@@ -734,8 +1022,36 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
 
     iters = 0
     converged = False
-
-    while (iters < max_iters) and (converged is not True):
+    abandoned = False
+    models_a = None
+    models_b = None
+    # Log-probabilities of columns whose model did not change are reused
+    alt_cache = {}
+
+    checkpoint_path = os.path.join(out_dir, 'em_checkpoint.pkl')
+    history_path = os.path.join(out_dir, 'em_history.pkl')
+    # Size of the history log covered by the checkpoint
+    history_size = 0
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None:
+        print(f"Resuming EM loop after iteration {checkpoint['iters']}")
+        iters = checkpoint['iters']
+        converged = checkpoint['converged']
+        abandoned = checkpoint['abandoned']
+        labels = checkpoint['labels']
+        fixed_alphas_a = checkpoint['fixed_alphas_a']
+        fixed_alphas_b = checkpoint['fixed_alphas_b']
+        models_a = checkpoint['models_a']
+        models_b = checkpoint['models_b']
+        history_size = checkpoint['history_size']
+        for record in load_records(history_path, history_size):
+            labels_per_iter.append(record['labels'])
+            alt_llhs_per_iter.append(record['alt_llhs'])
+            null_llhs_per_iter.append(record['null_llhs'])
+            contacts_per_iter.append(record['contacts'])
+        np.random.set_state(checkpoint['random_state'])
+
+    while (iters < max_iters) and (converged is not True) and not abandoned:
 
         print(f'Starting EM iteration number {iters+1}')
 
@@ -757,19 +1073,23 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
                                                       seqs_weight,
                                                       sample_weights=labels,
                                                       n_jobs=n_jobs,
-                                                      dfmax=dfmax)
+                                                      dfmax=dfmax,
+                                                      path_warm_start=path_warm_start,
+                                                      solver=solver)
             print('Maximization step: fitting models for MSA B...')
             models_b, fixed_alphas_b = fit_msa_models(num_mtx_b, bin_mtx_a,
                                                       mode,
                                                       seqs_weight,
                                                       sample_weights=labels,
                                                       n_jobs=n_jobs,
-                                                      dfmax=dfmax)
+                                                      dfmax=dfmax,
+                                                      path_warm_start=path_warm_start,
+                                                      solver=solver)
 
             # Dump values of alpha
-            np.savetxt(os.path.join(out_dir, ''.join(
+            run_or_submit(writer, np.savetxt, os.path.join(out_dir, ''.join(
                 ['fixed_alphas_a_iter_', str(iters), '.csv'])), fixed_alphas_a)
-            np.savetxt(os.path.join(out_dir, ''.join(
+            run_or_submit(writer, np.savetxt, os.path.join(out_dir, ''.join(
                 ['fixed_alphas_b_iter_', str(iters), '.csv'])), fixed_alphas_b)
 
         else:
@@ -778,13 +1098,17 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
                                         seqs_weight,
                                          fixed_alphas=fixed_alphas_a,
                                          sample_weights=labels,
-                                         n_jobs=n_jobs, dfmax=dfmax)
+                                         n_jobs=n_jobs, dfmax=dfmax,
+                                         prev_models=models_a if warm_start
+                                         else None, solver=solver)
             print('Maximization step: fitting models for MSA B...')
             models_b, _ = fit_msa_models(num_mtx_b, bin_mtx_a, mode,
                                         seqs_weight,
                                          fixed_alphas=fixed_alphas_b,
                                          sample_weights=labels,
-                                         n_jobs=n_jobs, dfmax=dfmax)
+                                         n_jobs=n_jobs, dfmax=dfmax,
+                                         prev_models=models_b if warm_start
+                                         else None, solver=solver)
 
         # =====================================================================
         # Expectation step: update labels based on the new co-evolutionary and
@@ -796,9 +1120,12 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
 
         # Use these to update the alternative and null model
         alt_llhs = calc_alt_llhs(num_mtx_a, bin_mtx_b, models_a, num_mtx_b,
-                                 bin_mtx_a, models_b, out_dir, iters)
+                                 bin_mtx_a, models_b, out_dir, iters,
+                                 alt_cache=alt_cache,
+                                 output_format=output_format, writer=writer)
         null_llhs = calc_null_llhs(num_mtx_a, num_mtx_b, mode, labels, out_dir,
-                                   iters)
+                                   iters, output_format=output_format,
+                                   writer=writer)
 
         # Save previous labels for convergence calculations; update labels
         pre_labels = labels
@@ -807,12 +1134,11 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
 
         # Predict contacts and dump contact matrix
         couplings, contact_mtx = compute_couplings(models_a, models_b)
-        np.savetxt(os.path.join(out_dir, ''.join(
-            ['contact_mtx_', str(iters), '.csv'])), contact_mtx, delimiter=',')
+        run_or_submit(writer, save_matrix, os.path.join(out_dir, ''.join(
+            ['contact_mtx_', str(iters)])), contact_mtx, output_format)
         norm_contact_mtx = normalize_contact_mtx(contact_mtx)
-        np.savetxt(os.path.join(out_dir, ''.join(
-            ['norm_contact_mtx_', str(iters), '.csv'])),
-            norm_contact_mtx, delimiter=',')
+        run_or_submit(writer, save_matrix, os.path.join(out_dir, ''.join(
+            ['norm_contact_mtx_', str(iters)])), norm_contact_mtx, output_format)
 
         # Add new information to function output
         labels_per_iter.append(labels)
@@ -824,17 +1150,57 @@ def em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, labels, seqs_weight,
         converged = has_converged(labels, pre_labels, mode, tol)
         iters += 1
 
+        # Race against the other random starts
+        if race_dir is not None and race_margin is not None:
+            total_llh = np.dot(alt_llhs, labels) + \
+                np.dot(null_llhs, 1 - np.asarray(labels))
+            best_llh = max(read_race_llhs(race_dir, exclude=race_start),
+                           default=-np.inf)
+            abandoned = (not converged) and (iters < max_iters) and \
+                iters >= race_min_iters and total_llh < best_llh - race_margin
+            post_race_llh(race_dir, race_start, total_llh, abandoned)
+            if abandoned:
+                print(f'Abandoning random start {race_start}: total '
+                      f'log-likelihood {total_llh} trails the best start '
+                      f'({best_llh}) by more than {race_margin}')
+
+        # Append the results of this iteration to the history log and
+        # checkpoint the state of the loop; queued after the dumps of this
+        # iteration, so a checkpoint implies that they were written
+        history_size = append_record(history_path, {
+            'labels': labels, 'alt_llhs': alt_llhs, 'null_llhs': null_llhs,
+            'contacts': norm_contact_mtx}, history_size, writer)
+        save_checkpoint(checkpoint_path, {
+            'iters': iters, 'converged': converged, 'abandoned': abandoned,
+            'labels': labels, 'fixed_alphas_a': fixed_alphas_a,
+            'fixed_alphas_b': fixed_alphas_b,
+            # Models are only needed to warm-start the next fits
+            'models_a': models_a if warm_start else None,
+            'models_b': models_b if warm_start else None,
+            'history_size': history_size,
+            'random_state': np.random.get_state()}, writer)
+
     return labels_per_iter, alt_llhs_per_iter, null_llhs_per_iter, contacts_per_iter
 
 
 def em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, n_starts,
                int_frac, mode, seqs_weight, results_dir, n_jobs, dfmax, test,
-               em_args, true_labels=None):
+               em_args, true_labels=None, seed=42, resume=False):
     """
     Function for repeated calling of the expectation-maximization loop.
     This is used to carry out multiple random starts.
 
-    Writes files to disk.
+    The random starts run in parallel: up to n_jobs starts at a time, each
+    fitting its column models with the remaining share of the n_jobs CPUs.
+    Every start draws its initial labels from its own seed, derived from
+    seed, so results do not depend on n_jobs.
+
+    If em_args sets race_margin, the starts race: after race_min_iters
+    iterations, a start whose total log-likelihood trails the best one
+    posted by the other starts by more than race_margin is stopped early.
+
+    Writes files to disk, including a summary of the final total
+    log-likelihood of each start.
 
     Arguments
     ---------
@@ -850,27 +1216,92 @@ def em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, n_starts,
                           expectation-maximization
     results_dir:          str, path for input/output
     test:                 str, whether to activate test options or not
-    n_jobs:               int, number of CPUs to use to fit the models
+    n_jobs:               int, total number of CPUs to use
     em_args:              dict, contains keyword arguments for em_loop()
     true_labels:          list, contains ground truth labels
+    seed:                 int, seed from which the seeds of the starts are
+                          derived
+    resume:               bool, whether to skip the starts that finished in a
+                          previous run in results_dir and resume the others
+                          from their checkpoints
 
 
     Returns
     -------
     None
     """
-    for i in range(n_starts):
-        print('Now in random start: {}'.format(str(i)))
-        start_path = os.path.join(results_dir, ''.join(['n_start', str(i)]))
-        checks_path = os.path.join(start_path, 'checks')
-        os.mkdir(start_path)
-        os.mkdir(checks_path)
+    n_parallel = min(n_starts, n_jobs)
+    start_n_jobs = max(1, n_jobs // n_parallel)
+    start_seeds = [int(child.generate_state(1)[0]) for child in
+                   np.random.SeedSequence(seed).spawn(n_starts)]
+    if em_args.get('race_margin') is not None:
+        race_dir = os.path.join(results_dir, 'race')
+        os.makedirs(race_dir, exist_ok=resume)
+    else:
+        race_dir = None
+
+    final_llhs = Parallel(n_jobs=n_parallel)(
+        delayed(run_random_start)(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b,
+                                  i, start_seeds[i], int_frac, mode,
+                                  seqs_weight, results_dir, start_n_jobs,
+                                  dfmax, test, em_args, true_labels,
+                                  race_dir=race_dir, resume=resume)
+        for i in range(n_starts))
+
+    if race_dir is not None:
+        board = read_race_board(race_dir)
+        abandoned = [board[i][1] if i in board else False
+                     for i in range(n_starts)]
+    else:
+        abandoned = None
+    output.write_starts_summary(start_seeds, final_llhs, results_dir,
+                                abandoned)
+
+
+def run_random_start(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, start,
+                     start_seed, int_frac, mode, seqs_weight, results_dir,
+                     n_jobs, dfmax, test, em_args, true_labels=None,
+                     race_dir=None, resume=False):
+    """
+    Function to carry out a single random start of em_wrapper() in the
+    n_start{start} directory.
+
+    Writes files to disk.
+
+    Arguments
+    ---------
+    start:        int, index of the random start
+    start_seed:   int, seed for the initial labels of this start
+    n_jobs:       int, number of CPUs to use to fit the models
+    race_dir:     str, directory shared by racing starts, or None
+    resume:       bool, whether to resume the start from its checkpoints
 
-        print('Initializing model...')
-        init_labels, *_ = init_model(num_mtx_a, bin_mtx_b, num_mtx_b,
-                                     bin_mtx_a, seqs_weight, mode, 'random',
-                                     int_frac, checks_path, n_jobs, dfmax)
+    See em_wrapper() for the other arguments.
 
+    Returns
+    -------
+    final_llh: float, total log-likelihood of the data at the last iteration
+    """
+    print('Now in random start: {}'.format(str(start)))
+    np.random.seed(start_seed)
+    start_path = os.path.join(results_dir, ''.join(['n_start', str(start)]))
+    checks_path = os.path.join(start_path, 'output')
+    os.makedirs(checks_path, exist_ok=resume)
+
+    result_path = os.path.join(checks_path, 'start_result.pkl')
+    result = load_checkpoint(result_path) if resume else None
+    if result is not None:
+        print(f'Random start {start} already finished')
+        return result['final_llh']
+
+    print('Initializing model...')
+    init_labels, *_ = init_model(num_mtx_a, bin_mtx_b, num_mtx_b,
+                                 bin_mtx_a, seqs_weight, mode, 'random',
+                                 int_frac, checks_path, n_jobs, dfmax,
+                                 resume=resume)
+
+    # Dumps are written in the background while the EM loop goes on
+    with BackgroundWriter() as writer:
         print('Starting EM loop...')
         labels_per_iter, alt_llhs_per_iter, \
             null_llhs_per_iter, contacts_per_iter = em_loop(num_mtx_a, num_mtx_b,
@@ -879,11 +1310,16 @@ def em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, n_starts,
                                                             seqs_weight,
                                                             int_frac, mode,
                                                             checks_path, n_jobs,
+                                                            race_dir=race_dir,
+                                                            race_start=start,
+                                                            writer=writer,
+                                                            resume=resume,
                                                             **em_args)
         alt_int_per_iter, \
             null_nonint_per_iter = compute_llhs(labels_per_iter,
                                                 alt_llhs_per_iter,
                                                 null_llhs_per_iter)
+        final_llh = alt_int_per_iter[-1].sum() + null_nonint_per_iter[-1].sum()
         # Create output for the current iteration
         if test:
             alt_true_per_iter, \
@@ -895,12 +1331,162 @@ def em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, n_starts,
                                  null_llhs_per_iter, alt_int_per_iter,
                                  null_nonint_per_iter, mode, start_path, test,
                                  true_labels, alt_true_per_iter,
-                                 null_true_per_iter)
+                                 null_true_per_iter, writer=writer)
         else:
             labels_per_iter.insert(0, init_labels)
             output.create_output(labels_per_iter, alt_llhs_per_iter,
                                  null_llhs_per_iter, alt_int_per_iter,
-                                 null_nonint_per_iter, mode, start_path, test)
+                                 null_nonint_per_iter, mode, start_path, test,
+                                 writer=writer)
+    # Mark the start as finished once all of its output is written
+    save_checkpoint(result_path, {'final_llh': final_llh})
+    return final_llh
+
+
+def save_checkpoint(path, state, writer=None):
+    """
+    Pickle a checkpoint to disk, replacing the previous one atomically so
+    that an interrupted run always leaves a complete checkpoint.
+
+    Arguments
+    ---------
+    path:   str, path of the checkpoint file
+    state:  dict, state to save; it is serialized before returning, so it
+            can be modified afterwards even if the write is queued
+    writer: matrix_io.BackgroundWriter for the write, or None to write it
+            synchronously
+
+    Returns
+    -------
+    None
+    """
+    data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    run_or_submit(writer, write_atomic, path, data)
+
+
+def write_atomic(path, data):
+    """
+    Write bytes to a temporary file and move it over path.
+    """
+    tmp_path = ''.join([path, '.tmp'])
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint written by save_checkpoint(); None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def append_record(path, record, offset, writer=None):
+    """
+    Pickle a record at the end of a log, so that each iteration writes only
+    its own results. The log is cut at offset first, which drops whatever an
+    interrupted run wrote after its last checkpoint.
+
+    Arguments
+    ---------
+    path:   str, path of the log file
+    record: object to append; it is serialized before returning
+    offset: int, size of the log so far, as returned by the previous call
+            (0 to start a new log)
+    writer: matrix_io.BackgroundWriter for the write, or None to write it
+            synchronously
+
+    Returns
+    -------
+    offset: int, size of the log after the record
+    """
+    data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    run_or_submit(writer, write_at, path, data, offset)
+    return offset + len(data)
+
+
+def write_at(path, data, offset):
+    """
+    Write bytes at offset of a file, truncating whatever followed.
+    """
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_records(path, size):
+    """
+    Load the records in the first size bytes of a log written by
+    append_record().
+    """
+    records = []
+    if size == 0:
+        return records
+    with open(path, 'rb') as f:
+        while f.tell() < size:
+            records.append(pickle.load(f))
+    return records
+
+
+def post_race_llh(race_dir, start, total_llh, abandoned=False):
+    """
+    Post the current total log-likelihood of a random start, written
+    atomically so that other starts never read a partial file.
+
+    Arguments
+    ---------
+    race_dir:   str, directory shared by the random starts
+    start:      int, index of the random start
+    total_llh:  float, current total log-likelihood of the start
+    abandoned:  bool, whether the start has been stopped
+
+    Returns
+    -------
+    None
+    """
+    path = os.path.join(race_dir, ''.join(['n_start', str(start), '.txt']))
+    tmp_path = ''.join([path, '.tmp'])
+    with open(tmp_path, 'w') as f:
+        f.write(f'{total_llh!r},{int(abandoned)}\n')
+    os.replace(tmp_path, path)
+
+
+def read_race_board(race_dir):
+    """
+    Read the last posted state of every random start.
+
+    Arguments
+    ---------
+    race_dir:   str, directory shared by the random starts
+
+    Returns
+    -------
+    board: dict, maps start index to (total log-likelihood, abandoned)
+    """
+    board = {}
+    for name in os.listdir(race_dir):
+        if name.startswith('n_start') and name.endswith('.txt'):
+            with open(os.path.join(race_dir, name)) as f:
+                llh, abandoned = f.read().strip().split(',')
+            board[int(name[len('n_start'):-len('.txt')])] = \
+                (float(llh), bool(int(abandoned)))
+    return board
+
+
+def read_race_llhs(race_dir, exclude=None):
+    """
+    Total log-likelihoods posted by the random starts other than exclude.
+    """
+    return [llh for start, (llh, _) in read_race_board(race_dir).items()
+            if start != exclude]
 
 
 def compute_llhs(labels_per_iter, alt_llhs_per_iter, null_llhs_per_iter):
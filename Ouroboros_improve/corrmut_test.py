@@ -2,12 +2,16 @@
 Unit tests for corrmut module
 """
 import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
 from math import isclose
 from sklearn.linear_model import SGDClassifier
 import inspect
+from copy import copy
 import corrmut
+from dummyestimator import DummyEstimator
 import msa_fun
-from globalvars import AA_TABLE
+from globalvars import AA_TABLE, ALPHA_RANGE
 
 
 class TestLabelUpdate():
@@ -239,6 +243,194 @@ class TestGetPosteriorLogProbs():
         assert np.allclose(exp_logprobs, posterior_logprobs, rtol=1e-6)
 
 
+class TestGatherLogprobs():
+    """
+    Class to test the corrmut.gather_logprobs function
+    """
+
+    def test_gather(self):
+        col = np.array([3, 11, 11, 19, 3])
+        classes = np.array([3, 11])
+        log_probs = np.log(np.array([[0.7, 0.3], [0.4, 0.6], [1.0, 0.0],
+                                     [0.5, 0.5], [0.2, 0.8]]))
+        pc = np.log(1 / 210)
+        # Third residue has 0 probability and fourth was not in the
+        # training data; both get the pseudocount
+        expected = [np.log(0.7), np.log(0.6), pc, pc, np.log(0.2)]
+        with np.errstate(divide='ignore'):
+            logprobs = corrmut.gather_logprobs(col, log_probs, classes, pc)
+        assert np.allclose(logprobs, expected, rtol=1e-6)
+
+    def test_single_class(self):
+        # Models of constant columns only predict one class
+        col = np.array([5., 5., 7.])
+        log_probs = np.log(np.array([[0.9], [0.9], [0.9]]))
+        pc = np.log(1 / 210)
+        logprobs = corrmut.gather_logprobs(col, log_probs, [5.], pc)
+        assert np.allclose(logprobs, [np.log(0.9), np.log(0.9), pc])
+
+
+def toy_alignments():
+    """
+    Toy pair of alignments where the first column of A covaries with B, in
+    numeric and binary matrix form
+    """
+    num_mtx_a = np.array([[11, 3, 11, 3, 11, 3, 0, 3],
+                          [0, 0, 1, 1, 0, 0, 1, 1]]).T
+    num_mtx_b = np.array([[3, 11, 3, 11, 3, 11, 17, 1],
+                          [5, 5, 5, 5, 6, 6, 6, 6],
+                          [2, 2, 2, 2, 2, 2, 2, 2]]).T
+    bin_mtx_a = msa_fun.make_bin_mtx(num_mtx_a, AA_TABLE)
+    bin_mtx_b = msa_fun.make_bin_mtx(num_mtx_b, AA_TABLE)
+    return num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b
+
+
+class TestFitMsaModels():
+    """
+    Class to test the corrmut.fit_msa_models function
+    """
+
+    def make_data(self):
+        # Models of the columns of B, with A as predictors
+        _, num_mtx_b, bin_mtx_a, _ = toy_alignments()
+        return num_mtx_b, bin_mtx_a
+
+    def test_parallel_matches_serial(self):
+        num_mtx, bin_mtx = self.make_data()
+        seqs_weight = [1] * num_mtx.shape[0]
+        serial, alphas_serial = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, n_jobs=1)
+        parallel, alphas_parallel = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, n_jobs=2)
+
+        assert alphas_serial == alphas_parallel
+        assert len(parallel) == num_mtx.shape[1]
+        for model_s, model_p in zip(serial, parallel):
+            assert type(model_s) == type(model_p)
+            assert np.allclose(model_s.coef_, model_p.coef_)
+        # Constant column gets a dummy model
+        assert isinstance(parallel[2], DummyEstimator)
+
+    def test_warm_start(self):
+        num_mtx, bin_mtx = self.make_data()
+        seqs_weight = [1] * num_mtx.shape[0]
+        labels = np.full(num_mtx.shape[0], 0.9)
+        fixed_alphas = [0.01] * num_mtx.shape[1]
+        prev, _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, fixed_alphas=fixed_alphas,
+            sample_weights=labels, n_jobs=1)
+        # Drop a class from the first column: its model is fitted anew
+        num_mtx[6, 0] = 3
+        fresh, _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, fixed_alphas=fixed_alphas,
+            sample_weights=labels, n_jobs=1)
+        warm, _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, fixed_alphas=fixed_alphas,
+            sample_weights=labels, n_jobs=1, prev_models=prev)
+
+        assert np.array_equal(warm[0].coef_, fresh[0].coef_)
+        assert isinstance(warm[2], DummyEstimator)
+        # Same classes: the fit starts from the previous coefficients
+        assert not np.array_equal(warm[1].coef_, fresh[1].coef_)
+        assert np.array_equal(warm[1].classes_, prev[1].classes_)
+
+    def test_path_warm_start(self):
+        num_mtx, bin_mtx = self.make_data()
+        seqs_weight = [1] * num_mtx.shape[0]
+        models, alphas = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, n_jobs=1,
+            path_warm_start=True)
+        assert len(models) == num_mtx.shape[1]
+        assert all(alpha in ALPHA_RANGE for alpha in alphas[:2])
+        # Constant column gets a dummy model
+        assert isinstance(models[2], DummyEstimator)
+
+    def test_warm_start_keeps_previous(self):
+        # SGD trains the initial coefficients in place; the previous models
+        # must not be modified
+        num_mtx, bin_mtx = self.make_data()
+        seqs_weight = [1] * num_mtx.shape[0]
+        labels = np.full(num_mtx.shape[0], 0.9)
+        prev, _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, fixed_alphas=[0.01] * 3,
+            sample_weights=labels, n_jobs=1)
+        prev_coef = prev[0].coef_.copy()
+        _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'soft', seqs_weight, fixed_alphas=[0.001] * 3,
+            sample_weights=labels, n_jobs=1, prev_models=prev)
+        assert np.array_equal(prev[0].coef_, prev_coef)
+
+    def test_sparse(self):
+        # SGDClassifier decays the intercept updates with sparse input, so
+        # the fits are not identical to the dense ones; predictions of a
+        # given set of models are
+        num_mtx, bin_mtx = self.make_data()
+        seqs_weight = [1] * num_mtx.shape[0]
+        sparse_mtx = csr_matrix(bin_mtx, dtype=float)
+        models, alphas = corrmut.fit_msa_models(
+            num_mtx, sparse_mtx, 'soft', seqs_weight, n_jobs=1)
+
+        assert len(alphas) == num_mtx.shape[1]
+        assert isinstance(models[2], DummyEstimator)
+        alt_dense = corrmut.get_alt_model(num_mtx, bin_mtx, models)
+        alt_sparse = corrmut.get_alt_model(num_mtx, sparse_mtx, models)
+        assert np.allclose(alt_dense, alt_sparse)
+
+    def test_hard_fixed_alphas(self):
+        # Sequence weights must be selected along with the observations
+        num_mtx, bin_mtx = self.make_data()
+        labels = [1, 1, 1, 1, 1, 1, 0, 0]
+        seqs_weight = [0.5] * num_mtx.shape[0]
+        models, alphas = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'hard', seqs_weight, fixed_alphas=[0.1] * 3,
+            sample_weights=labels, n_jobs=2)
+        assert alphas is None
+        assert len(models) == num_mtx.shape[1]
+        assert set(models[0].classes_) == {3, 11}
+
+    def test_hard_selects_weights(self):
+        # Same fit as on the selected observations and their weights
+        num_mtx, bin_mtx = self.make_data()
+        labels = np.array([1, 0, 1, 1, 0, 1, 1, 1])
+        seqs_weight = np.linspace(0.2, 1, num_mtx.shape[0])
+        idxs = np.where(labels == 1)[0]
+        hard, _ = corrmut.fit_msa_models(
+            num_mtx, bin_mtx, 'hard', seqs_weight, fixed_alphas=[0.1] * 3,
+            sample_weights=labels, n_jobs=1)
+        subset, _ = corrmut.fit_msa_models(
+            num_mtx[idxs], bin_mtx[idxs], 'soft', seqs_weight[idxs],
+            fixed_alphas=[0.1] * 3, sample_weights=labels[idxs], n_jobs=1)
+        for model_h, model_s in zip(hard, subset):
+            assert np.array_equal(model_h.coef_, model_s.coef_)
+
+    def test_hard_weights_mismatch(self):
+        num_mtx, bin_mtx = self.make_data()
+        labels = [1, 1, 1, 1, 1, 1, 0, 0]
+        with pytest.raises(ValueError):
+            corrmut.fit_msa_models(
+                num_mtx, bin_mtx, 'hard', [1] * 6, fixed_alphas=[0.1] * 3,
+                sample_weights=labels, n_jobs=1)
+
+
+class TestContactPrediction():
+    """
+    Class to test the corrmut.contact_prediction function
+    """
+
+    @pytest.mark.parametrize('solver', ['sgd', 'batch'])
+    def test_hard(self, solver):
+        # get_interacting() selects the observations before the models are
+        # fitted; the sequence weights must follow them
+        num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b = toy_alignments()
+        labels = [1, 1, 1, 1, 1, 1, 0, 0]
+        seqs_weight = [0.5] * len(labels)
+        couplings, contact_mtx = corrmut.contact_prediction(
+            num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a, labels, seqs_weight,
+            'hard', 1, 100, solver=solver)
+        assert contact_mtx.shape == (2, 3)
+        assert np.all(np.isfinite(contact_mtx))
+
+
 ##############
 # Null model #
 ##############
@@ -256,16 +448,18 @@ class TestGetNullModel():
         weights = [0.1, 0.1, 0.9]
         pc_null = 1 / 210
 
-        expected = [{'1': np.log(0.18181818), '3': np.log(1 - 0.18181818)},
-                    {'2': np.log(0.90909090), '3': np.log(1 - 0.90909090)},
-                    {'3': np.log(0.18181818), '5': np.log(1 - 0.18181818)}]
+        expected = [{1: np.log(0.18181818), 3: np.log(1 - 0.18181818)},
+                    {2: np.log(0.90909090), 3: np.log(1 - 0.90909090)},
+                    {3: np.log(0.18181818), 5: np.log(1 - 0.18181818)}]
 
         null_model = corrmut.get_null_model(num_mtx, weights, pc_null)
+        assert null_model.shape == (3, len(AA_TABLE))
         # Check whether probabilities add up to one in all columns
         # Check that calculated probabilities match up with the expected values
         for idx, col in enumerate(null_model):
-            assert np.sum(np.exp(list(col.values()))) == 1
-            for k in col.keys():
+            assert np.isclose(np.nansum(np.exp(col)), 1)
+            assert set(np.where(~np.isnan(col))[0]) == set(expected[idx])
+            for k in expected[idx].keys():
                 assert isclose(col[k], expected[idx][k], rel_tol=1e-6)
 
     def test_null_pseudocount(self):
@@ -275,17 +469,18 @@ class TestGetNullModel():
         pc_null = 1 / 210
         weights = [0.1, 0.1, 0.9, 0.0]
 
-        expected = [{'1': np.log(0.18181818), '3': np.log(1 - 0.18181818),
-                     '18': np.log(pc_null)},
-                    {'2': np.log(0.90909090), '3': np.log(1 - 0.90909090),
-                     '19': np.log(pc_null)},
-                    {'3': np.log(0.18181818), '5': np.log(1 - 0.18181818),
-                     '20': np.log(pc_null)}]
+        expected = [{1: np.log(0.18181818), 3: np.log(1 - 0.18181818),
+                     18: np.log(pc_null)},
+                    {2: np.log(0.90909090), 3: np.log(1 - 0.90909090),
+                     19: np.log(pc_null)},
+                    {3: np.log(0.18181818), 5: np.log(1 - 0.18181818),
+                     20: np.log(pc_null)}]
 
         null_model = corrmut.get_null_model(num_mtx, weights, pc_null)
         # Check that calculated probabilities match up with the expected values
         for idx, col in enumerate(null_model):
-            for k in col.keys():
+            assert set(np.where(~np.isnan(col))[0]) == set(expected[idx])
+            for k in expected[idx].keys():
                 assert isclose(col[k], expected[idx][k], rel_tol=1e-6)
 
 
@@ -294,20 +489,27 @@ class TestScoreNull():
     Class to test the corrmut.score_null function
     """
 
+    def make_null_model(self, cols):
+        null_model = np.full((len(cols), len(AA_TABLE)), np.nan)
+        for idx, col in enumerate(cols):
+            for k, v in col.items():
+                null_model[idx, k] = v
+        return null_model
+
     def test_null_one(self):
         # Same example data as in test_null_model in TestGetNullModel
         num_mtx = np.array([[1, 2, 3],
                             [1, 3, 3],
                             [3, 2, 5]])
-        null_model = [{'1': np.log(0.18181818), '3': np.log(1 - 0.18181818)},
-                      {'2': np.log(0.90909090), '3': np.log(1 - 0.90909090)},
-                      {'3': np.log(0.18181818), '5': np.log(1 - 0.18181818)}]
+        cols = [{1: np.log(0.18181818), 3: np.log(1 - 0.18181818)},
+                {2: np.log(0.90909090), 3: np.log(1 - 0.90909090)},
+                {3: np.log(0.18181818), 5: np.log(1 - 0.18181818)}]
+        null_model = self.make_null_model(cols)
         pc_null = 1 / 210
 
-        exp_null_mtx = np.array([[null_model[0]['1'], null_model[1]['2'], null_model[2]['3']],
-                                 [null_model[0]['1'], null_model[
-                                     1]['3'], null_model[2]['3']],
-                                 [null_model[0]['3'], null_model[1]['2'], null_model[2]['5']]])
+        exp_null_mtx = np.array([[cols[0][1], cols[1][2], cols[2][3]],
+                                 [cols[0][1], cols[1][3], cols[2][3]],
+                                 [cols[0][3], cols[1][2], cols[2][5]]])
 
         null_mtx = corrmut.score_null(num_mtx, null_model, pc_null)
         assert np.allclose(null_mtx, exp_null_mtx, rtol=1e-6)
@@ -316,17 +518,31 @@ class TestScoreNull():
         # Same data as in test_null_pseudocount
         num_mtx = np.array([[1, 2, 3], [1, 3, 3], [3, 2, 5], [18, 19, 20]])
         pc_null = 1 / 210
-        null_model = [{'1': np.log(0.18181818), '3': np.log(1 - 0.18181818), '18': np.log(pc_null)},
-                      {'2': np.log(0.90909090), '3': np.log(
-                          1 - 0.90909090), '19': np.log(pc_null)},
-                      {'3': np.log(0.18181818), '5': np.log(1 - 0.18181818), '20': np.log(pc_null)}]
-
-        exp_null_mtx = np.array([[null_model[0]['1'], null_model[1]['2'], null_model[2]['3']],
-                                 [null_model[0]['1'], null_model[
-                                     1]['3'], null_model[2]['3']],
-                                 [null_model[0]['3'], null_model[
-                                     1]['2'], null_model[2]['5']],
-                                 [null_model[0]['18'], null_model[1]['19'], null_model[2]['20']]])
+        cols = [{1: np.log(0.18181818), 3: np.log(1 - 0.18181818),
+                 18: np.log(pc_null)},
+                {2: np.log(0.90909090), 3: np.log(1 - 0.90909090),
+                 19: np.log(pc_null)},
+                {3: np.log(0.18181818), 5: np.log(1 - 0.18181818),
+                 20: np.log(pc_null)}]
+        null_model = self.make_null_model(cols)
+
+        exp_null_mtx = np.array([[cols[0][1], cols[1][2], cols[2][3]],
+                                 [cols[0][1], cols[1][3], cols[2][3]],
+                                 [cols[0][3], cols[1][2], cols[2][5]],
+                                 [cols[0][18], cols[1][19], cols[2][20]]])
+
+        null_mtx = corrmut.score_null(num_mtx, null_model, pc_null)
+        assert np.allclose(null_mtx, exp_null_mtx, rtol=1e-6)
+
+    def test_null_unseen(self):
+        # Residues absent from the examples used to build the null model get
+        # the pseudocount
+        num_mtx = np.array([[1, 2], [4, 2]])
+        pc_null = 1 / 210
+        null_model = self.make_null_model([{1: np.log(0.5)}, {2: 0.0}])
+
+        exp_null_mtx = np.array([[np.log(0.5), 0.0],
+                                 [np.log(pc_null), 0.0]])
 
         null_mtx = corrmut.score_null(num_mtx, null_model, pc_null)
         assert np.allclose(null_mtx, exp_null_mtx, rtol=1e-6)
@@ -434,3 +650,211 @@ class TestComputeLlhs():
 
         assert np.allclose(w_alt, exp_w_alt, rtol=1e-6)
         assert np.allclose(w_null, exp_w_null, rtol=1e-6)
+
+
+def random_alignments(n_obs=12, n_cols_a=3, n_cols_b=2, seed=0):
+    """
+    Small random pair of alignments, in numeric and binary matrix form
+    """
+    rng = np.random.RandomState(seed)
+    num_mtx_a = rng.randint(0, 4, size=(n_obs, n_cols_a))
+    num_mtx_b = rng.randint(0, 4, size=(n_obs, n_cols_b))
+    bin_mtx_a = msa_fun.make_bin_mtx(num_mtx_a, AA_TABLE)
+    bin_mtx_b = msa_fun.make_bin_mtx(num_mtx_b, AA_TABLE)
+    return num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b
+
+
+class TestEmWrapper():
+    """
+    Class to test the corrmut.em_wrapper function
+    """
+
+    def run(self, out_dir, n_jobs, **em_args):
+        num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b = random_alignments()
+        out_dir.mkdir()
+        corrmut.em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b, 3, 0.5,
+                           'hard', [1] * 12, str(out_dir), n_jobs, 100, False,
+                           {'max_iters': 2, 'true_labels': None, **em_args})
+        return np.loadtxt(out_dir / 'random_starts_summary.csv',
+                          delimiter=',')
+
+    def test_parallel_matches_serial(self, tmp_path):
+        serial = self.run(tmp_path / 'serial', 1)
+        parallel = self.run(tmp_path / 'parallel', 2)
+        assert serial.shape == (3, 4)
+        # Starts have different seeds
+        assert len(set(serial[:, 1])) == 3
+        assert np.allclose(serial, parallel)
+        for i in range(3):
+            assert (tmp_path / 'parallel' / f'n_start{i}' / 'output' /
+                    'convergence.png').exists()
+
+    def test_race(self, tmp_path):
+        # With no margin every start trailing the best one is stopped as
+        # soon as allowed; the best start is never stopped
+        summary = self.run(tmp_path / 'race', 1, max_iters=5,
+                           race_margin=0, race_min_iters=1)
+        best = np.argmax(summary[:, 2])
+        assert summary[best, 3] == 0
+        assert summary[:, 3].sum() >= 1
+
+    def test_race_board(self, tmp_path):
+        corrmut.post_race_llh(str(tmp_path), 0, -10.5)
+        corrmut.post_race_llh(str(tmp_path), 1, -20.25, abandoned=True)
+        board = corrmut.read_race_board(str(tmp_path))
+        assert board == {0: (-10.5, False), 1: (-20.25, True)}
+        assert corrmut.read_race_llhs(str(tmp_path), exclude=0) == [-20.25]
+
+
+class TestAltCache():
+    """
+    Class to test the per-column cache of corrmut.get_alt_model
+    """
+
+    def test_cache(self):
+        _, num_mtx, bin_mtx, _ = toy_alignments()
+        seqs_weight = [1] * num_mtx.shape[0]
+        models, _ = corrmut.fit_msa_models(num_mtx, bin_mtx, 'soft',
+                                           seqs_weight, n_jobs=1)
+        expected = corrmut.get_alt_model(num_mtx, bin_mtx, models)
+        cache = {}
+        first = corrmut.get_alt_model(num_mtx, bin_mtx, models, cache=cache)
+        assert np.array_equal(first, expected)
+        assert sorted(cache) == [0, 1, 2]
+
+        # Unchanged models are not used for prediction again
+        def fail(X):
+            raise AssertionError('cached column predicted again')
+        models[2].predict_log_proba = fail
+        # A changed model is
+        models[0].coef_ = models[0].coef_ * 2
+        second = corrmut.get_alt_model(num_mtx, bin_mtx, models, cache=cache)
+        del models[2].predict_log_proba
+        assert np.array_equal(second[:, 1:], expected[:, 1:])
+        assert np.array_equal(
+            second, corrmut.get_alt_model(num_mtx, bin_mtx, models))
+
+    def test_fingerprint(self):
+        clf = DummyEstimator(prob=0.5).fit(np.eye(3), [1, 1, 1])
+        other = DummyEstimator(prob=0.6).fit(np.eye(3), [1, 1, 1])
+        assert corrmut.model_fingerprint(clf) == \
+            corrmut.model_fingerprint(copy(clf))
+        assert corrmut.model_fingerprint(clf) != \
+            corrmut.model_fingerprint(other)
+
+
+class TestStackedPrediction():
+    """
+    Class to test the stacked prediction of corrmut.get_alt_model
+    """
+
+    def reference(self, num_mtx, bin_mtx, models):
+        # One predict_log_proba call per column
+        return np.array([corrmut.gather_logprobs(col, model.predict_log_proba(
+            bin_mtx), model.classes_) for col, model in zip(num_mtx.T,
+                                                              models)]).T
+
+    def test_matches_per_column(self):
+        _, num_mtx, bin_mtx, _ = toy_alignments()
+        seqs_weight = [1] * num_mtx.shape[0]
+        for solver in ('sgd', 'batch'):
+            models, _ = corrmut.fit_msa_models(num_mtx, bin_mtx, 'soft',
+                                               seqs_weight, n_jobs=1,
+                                               solver=solver)
+            expected = self.reference(num_mtx, bin_mtx, models)
+            # Groups of one or a few models, predicted in chunks of rows
+            for chunk_bytes in (1, 8 * 3 * (bin_mtx.shape[1] + 2)):
+                alt_mtx = corrmut.get_alt_model(num_mtx, bin_mtx, models,
+                                                chunk_bytes=chunk_bytes)
+                assert np.allclose(alt_mtx, expected)
+            alt_mtx = corrmut.get_alt_model(num_mtx, csr_matrix(bin_mtx),
+                                            models)
+            assert np.allclose(alt_mtx, expected)
+
+    def test_groups(self):
+        models = [corrmut.BatchColumnModel(np.zeros((5, 21)), np.zeros(21),
+                                           classes, 0.1)
+                  for classes in ([1, 2], [1, 2, 3], [4, 5], [1, 2])]
+        # One row of coefficients for two classes, one per class otherwise
+        assert corrmut.stacked_groups(models, [0, 1, 2, 3], 5, 8 * 5 * 4) == \
+            [[0, 1], [2, 3]]
+        assert corrmut.stacked_groups(models, [1, 3], 5, 1) == [[1], [3]]
+        assert corrmut.stacked_groups(models, [], 5, 1) == []
+
+
+class TestResume():
+    """
+    Class to test checkpointing and resuming of corrmut.em_loop
+    """
+
+    def run(self, out_dir, max_iters, resume=False):
+        num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b = random_alignments()
+        labels = corrmut.get_random_labels(12, 0.5, 'soft')
+        return corrmut.em_loop(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b,
+                               labels, [1] * 12, 0.5, 'soft', str(out_dir), 1,
+                               max_iters=max_iters, tol=1e-12, resume=resume)
+
+    def test_resume_matches_uninterrupted(self, tmp_path):
+        (tmp_path / 'full').mkdir()
+        (tmp_path / 'resumed').mkdir()
+        np.random.seed(0)
+        full = self.run(tmp_path / 'full', 4)
+        # Interrupted after two iterations, then resumed
+        np.random.seed(0)
+        _ = self.run(tmp_path / 'resumed', 2)
+        resumed = self.run(tmp_path / 'resumed', 4, resume=True)
+
+        assert len(resumed[0]) == len(full[0]) == 4
+        for full_per_iter, resumed_per_iter in zip(full, resumed):
+            assert np.allclose(full_per_iter, resumed_per_iter)
+
+    def test_resume_after_partial_record(self, tmp_path):
+        (tmp_path / 'full').mkdir()
+        (tmp_path / 'resumed').mkdir()
+        np.random.seed(0)
+        full = self.run(tmp_path / 'full', 3)
+        np.random.seed(0)
+        _ = self.run(tmp_path / 'resumed', 2)
+        # Interrupted while appending to the history after the checkpoint
+        with open(tmp_path / 'resumed' / 'em_history.pkl', 'ab') as f:
+            f.write(b'partial')
+        resumed = self.run(tmp_path / 'resumed', 3, resume=True)
+
+        assert len(resumed[0]) == 3
+        for full_per_iter, resumed_per_iter in zip(full, resumed):
+            assert np.allclose(full_per_iter, resumed_per_iter)
+
+    def test_checkpoint_excludes_history(self, tmp_path):
+        np.random.seed(0)
+        labels_per_iter = self.run(tmp_path, 3)[0]
+        checkpoint = corrmut.load_checkpoint(
+            str(tmp_path / 'em_checkpoint.pkl'))
+        assert 'labels_per_iter' not in checkpoint
+        records = corrmut.load_records(str(tmp_path / 'em_history.pkl'),
+                                       checkpoint['history_size'])
+        assert len(records) == 3
+        assert np.allclose([record['labels'] for record in records],
+                           labels_per_iter)
+
+    def test_resume_finished(self, tmp_path):
+        np.random.seed(0)
+        first = self.run(tmp_path, 2)
+        # Nothing left to do: the checkpointed results are returned
+        second = self.run(tmp_path, 2, resume=True)
+        assert np.allclose(first[1], second[1])
+
+    def test_checkpoint_round_trip(self, tmp_path):
+        path = str(tmp_path / 'checkpoint.pkl')
+        assert corrmut.load_checkpoint(path) is None
+        corrmut.save_checkpoint(path, {'iters': 3})
+        assert corrmut.load_checkpoint(path) == {'iters': 3}
+
+    def test_record_round_trip(self, tmp_path):
+        path = str(tmp_path / 'history.pkl')
+        offset = corrmut.append_record(path, {'iter': 0}, 0)
+        size = corrmut.append_record(path, {'iter': 1}, offset)
+        assert corrmut.load_records(path, size) == [{'iter': 0}, {'iter': 1}]
+        assert corrmut.load_records(path, offset) == [{'iter': 0}]
+        # Starting again at offset 0 replaces the log
+        size = corrmut.append_record(path, {'iter': 2}, 0)
+        assert corrmut.load_records(path, size) == [{'iter': 2}]
@@ -37,7 +37,7 @@ class DummyEstimator(BaseEstimator, ClassifierMixin):
     def fit(self, X, y):
         """
         """
-        X, y = check_X_y(X, y)
+        X, y = check_X_y(X, y, accept_sparse='csr')
 
         self.coef_ = np.zeros(X.shape[1])
         self.classes_ = np.unique(y)
@@ -1,5 +1,6 @@
 import pytest
 import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.exceptions import NotFittedError
 import os
 import sys
@@ -38,6 +39,17 @@ class TestDummyEstimator():
         assert X.shape[1] == clf.coef_.shape[0]
         assert set(clf.classes_) == set(np.unique(y))
 
+    def test_fit_sparse(self):
+        X = csr_matrix(np.array([[0, 0, 0, 1], [1, 0, 0, 0], [0, 0, 1, 0]]))
+        y = np.array([1, 1, 1])
+
+        clf = DummyEstimator(0.999)
+        clf.fit(X, y)
+        prob = clf.predict_proba(X)
+
+        assert X.shape[1] == clf.coef_.shape[0]
+        assert prob.shape == (3, 1)
+
     def test_fit_constant(self):
         X = np.array([[0, 0, 0, 1], [1, 0, 0, 0], [0, 0, 1, 0]])
         y = np.array([1, 1, 1])
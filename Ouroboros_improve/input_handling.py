@@ -6,6 +6,8 @@ import warnings
 import json
 import numpy as np
 
+from matrix_io import OUTPUT_FORMATS
+
 
 def validate_alignments(num_mtx_a, num_mtx_b):
     """
@@ -24,11 +26,19 @@ def validate_contact_mtx(msa_a, msa_b, contact_mtx):
     """
     Perform sanity check on input contact matrix
     """
+    validate_contact_dims(msa_a.shape[1], msa_b.shape[1], contact_mtx)
+
+
+def validate_contact_dims(n_cols_a, n_cols_b, contact_mtx):
+    """
+    Perform sanity check on input contact matrix, given the number of columns
+    of the input alignments
+    """
 
     # Verify that the input contact matrix has the expected dimensions
-    assert contact_mtx.shape == (msa_a.shape[1], msa_b.shape[1]), f"""Contact
+    assert contact_mtx.shape == (n_cols_a, n_cols_b), f"""Contact
     matrix is expected to have dimensions
-    {msa_a.shape[1]} x {msa_b.shape[1]} (MSA A columns x MSA B columns);
+    {n_cols_a} x {n_cols_b} (MSA A columns x MSA B columns);
     found {contact_mtx.shape} instead"""
     # Values in the contact matrix must be either 1 or 0
     assert set(np.unique(contact_mtx)) == {0, 1}, """ AAA """
@@ -68,10 +78,14 @@ def digest_args(args):
     predict_contacts = digest_pred_contacts(args)
     
     method, cut_height = digest_method_height(args)
+    sparse = digest_sparse(args)
+    distance_memmap = digest_distance_memmap(args)
+    write_tree = digest_write_tree(args)
 
     return io_path, msa_a_path, msa_b_path, gap_threshold, int_frac, init, \
         mode, test, int_limit, contact_mtx, n_jobs, n_starts, dfmax, max_init_iters,\
-        max_reg_iters, predict_contacts, method, cut_height
+        max_reg_iters, predict_contacts, method, cut_height, sparse, \
+        distance_memmap, write_tree
 
 
 def digest_msa_paths(args):
@@ -101,7 +115,7 @@ def digest_method_height(args):
         else:
             raise KeyError('Missing mandatory parameter for reweighting: cut height')
     else:
-        if 'cut_height' in agrs.keys():
+        if 'cut_height' in args.keys():
             raise KeyError('Missing mandatory parameter for reweighting: method')
         else:
             cut_height = None
@@ -271,6 +285,56 @@ def digest_pred_contacts(args, default=False):
         predict_contacts = default
     return predict_contacts
 
+def digest_sparse(args, default=False):
+    if 'sparse' in args.keys():
+        if type(args['sparse']) == bool:
+            sparse = args['sparse']
+        else:
+            raise ValueError(f"""Invalid, non-boolean value for sparse
+                parameter: {args['sparse']}""")
+    else:
+        sparse = default
+    return sparse
+
+
+def digest_distance_memmap(args, default=False):
+    if 'distance_memmap' in args.keys():
+        if type(args['distance_memmap']) == bool:
+            distance_memmap = args['distance_memmap']
+        else:
+            raise ValueError(f"""Invalid, non-boolean value for
+                distance_memmap parameter: {args['distance_memmap']}""")
+    else:
+        distance_memmap = default
+    return distance_memmap
+
+
+def digest_write_tree(args, default=False):
+    if 'write_tree' in args.keys():
+        if type(args['write_tree']) == bool:
+            write_tree = args['write_tree']
+        else:
+            raise ValueError(f"""Invalid, non-boolean value for write_tree
+                parameter: {args['write_tree']}""")
+    else:
+        write_tree = default
+    return write_tree
+
+def digest_cache_dir(args, default=os.path.join(os.path.expanduser('~'),
+                                                 '.cache', 'ouroboros')):
+    # false disables the preprocessing cache
+    if 'cache_dir' in args.keys():
+        if args['cache_dir'] is False:
+            cache_dir = None
+        elif type(args['cache_dir']) == str:
+            cache_dir = args['cache_dir']
+        else:
+            raise ValueError(f"""Invalid value for cache_dir parameter:
+                {args['cache_dir']} (expected a path or false)""")
+    else:
+        cache_dir = default
+    return cache_dir
+
 ########################
 # EM keyword arguments #
 ########################
@@ -286,6 +350,12 @@ def pack_em_kwargs(args, true_labels):
     em_kwargs['max_iters'] = digest_max_iters(args)
     em_kwargs['dfmax'] = digest_dfmax(args)
     em_kwargs['true_labels'] = true_labels
+    em_kwargs['race_margin'] = digest_race_margin(args)
+    em_kwargs['race_min_iters'] = digest_race_min_iters(args)
+    em_kwargs['warm_start'] = digest_warm_start(args)
+    em_kwargs['path_warm_start'] = digest_path_warm_start(args)
+    em_kwargs['output_format'] = digest_output_format(args)
+    em_kwargs['solver'] = digest_solver(args)
 
     return em_kwargs
 
@@ -313,6 +383,76 @@ def digest_max_iters(args, default=20):
     return max_iters
 
 
+def digest_race_margin(args, default=None):
+    if 'race_margin' in args.keys():
+        race_margin = args['race_margin']
+        if type(race_margin) not in [int, float] or \
+                not np.isfinite(race_margin) or race_margin < 0:
+            raise ValueError(f"""Invalid race_margin value: {race_margin}
+                (expected a finite, non-negative number)""")
+    else:
+        race_margin = default
+    return race_margin
+
+
+def digest_race_min_iters(args, default=3):
+    if 'race_min_iters' in args.keys():
+        race_min_iters = args['race_min_iters']
+        if type(race_min_iters) != int or race_min_iters < 1:
+            raise ValueError(f"""Invalid race_min_iters value:
+                {race_min_iters} (expected a positive integer)""")
+    else:
+        race_min_iters = default
+    return race_min_iters
+
+
+def digest_warm_start(args, default=False):
+    if 'warm_start' in args.keys():
+        if type(args['warm_start']) == bool:
+            warm_start = args['warm_start']
+        else:
+            raise ValueError(f"""Invalid, non-boolean value for warm_start
+                parameter: {args['warm_start']}""")
+    else:
+        warm_start = default
+    return warm_start
+
+
+def digest_path_warm_start(args, default=False):
+    if 'path_warm_start' in args.keys():
+        if type(args['path_warm_start']) == bool:
+            path_warm_start = args['path_warm_start']
+        else:
+            raise ValueError(f"""Invalid, non-boolean value for
+                path_warm_start parameter: {args['path_warm_start']}""")
+    else:
+        path_warm_start = default
+    return path_warm_start
+
+
+def digest_output_format(args, default='npy'):
+    if 'output_format' in args.keys():
+        output_format = args['output_format']
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"""Invalid output_format value: {output_format};
+                choose one of {OUTPUT_FORMATS}""")
+    else:
+        output_format = default
+    return output_format
+
+
+def digest_solver(args, default='sgd'):
+    if 'solver' in args.keys():
+        if args['solver'] in ['sgd', 'batch']:
+            solver = args['solver']
+        else:
+            raise ValueError(f"""Invalid solver: {args['solver']}; must be
+                'sgd' or 'batch'""")
+    else:
+        solver = default
+    return solver
+
+
 def digest_dfmax(args, default=100):
     if 'dfmax' in args.keys():
         dfmax = args['dfmax']
@@ -395,6 +395,70 @@ class TestDigestTol():
         assert tol == sig.parameters['default'].default
 
 
+class TestDigestRace():
+
+    def test_ok(self):
+        args = {'race_margin': 50.0, 'race_min_iters': 2}
+        assert input_handling.digest_race_margin(args) == 50.0
+        assert input_handling.digest_race_min_iters(args) == 2
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_race_margin({'race_margin': -1})
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_race_min_iters({'race_min_iters': 0})
+
+    def test_wrong_type(self):
+        for race_margin in ['50', True, float('nan'), float('inf'), None]:
+            with pytest.raises(ValueError):
+                _ = input_handling.digest_race_margin(
+                    {'race_margin': race_margin})
+        for race_min_iters in ['2', 2.5, 2.0, True, None]:
+            with pytest.raises(ValueError):
+                _ = input_handling.digest_race_min_iters(
+                    {'race_min_iters': race_min_iters})
+        # Integer margins are accepted
+        assert input_handling.digest_race_margin({'race_margin': 0}) == 0
+
+    def test_default(self):
+        # Racing is off unless a margin is given
+        assert input_handling.digest_race_margin({}) is None
+        min_iters = input_handling.digest_race_min_iters({})
+        sig = inspect.signature(input_handling.digest_race_min_iters)
+        assert min_iters == sig.parameters['default'].default
+
+
+class TestDigestWarmStart():
+
+    def test_default(self):
+        assert input_handling.digest_warm_start({}) is False
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_warm_start({'warm_start': 1})
+
+
+class TestDigestPathWarmStart():
+
+    def test_default(self):
+        assert input_handling.digest_path_warm_start({}) is False
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_path_warm_start({'path_warm_start': 0})
+
+
+class TestDigestOutputFormat():
+
+    def test_ok(self):
+        for i in ['npy', 'npz', 'csv']:
+            assert input_handling.digest_output_format({'output_format': i}) == i
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_output_format({'output_format': 'txt'})
+
+
 class TestDigestMaxIters():
 
     def test_ok(self):
@@ -431,3 +495,74 @@ class TestDigestDfmax():
         dfmax = input_handling.digest_dfmax(args)
         sig = inspect.signature(input_handling.digest_dfmax)
         assert dfmax == sig.parameters['default'].default
+
+
+class TestDigestSparse():
+
+    def test_ok(self):
+        for i in [True, False]:
+            args = {'sparse': i}
+            sparse = input_handling.digest_sparse(args)
+            assert sparse == i
+
+    def test_default(self):
+        args = {'mode': 'soft'}
+        sparse = input_handling.digest_sparse(args)
+        sig = inspect.signature(input_handling.digest_sparse)
+        assert sparse == sig.parameters['default'].default
+
+    def test_wrong(self):
+        for i in ['True', 1, None]:
+            args = {'sparse': i}
+            with pytest.raises(ValueError):
+                _ = input_handling.digest_sparse(args)
+
+
+class TestDigestDistanceMemmap():
+
+    def test_ok(self):
+        for i in [True, False]:
+            args = {'distance_memmap': i}
+            distance_memmap = input_handling.digest_distance_memmap(args)
+            assert distance_memmap == i
+
+    def test_wrong(self):
+        for i in ['True', 1]:
+            args = {'distance_memmap': i}
+            with pytest.raises(ValueError):
+                _ = input_handling.digest_distance_memmap(args)
+
+
+class TestDigestWriteTree():
+
+    def test_default(self):
+        assert input_handling.digest_write_tree({}) is False
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_write_tree({'write_tree': 'yes'})
+
+
+class TestDigestCacheDir():
+
+    def test_ok(self):
+        assert input_handling.digest_cache_dir({'cache_dir': '/tmp/c'}) == \
+            '/tmp/c'
+        assert input_handling.digest_cache_dir({'cache_dir': False}) is None
+        assert input_handling.digest_cache_dir({}) is not None
+
+    def test_wrong(self):
+        for i in [True, 1]:
+            with pytest.raises(ValueError):
+                _ = input_handling.digest_cache_dir({'cache_dir': i})
+
+
+class TestDigestSolver():
+
+    def test_ok(self):
+        assert input_handling.digest_solver({}) == 'sgd'
+        assert input_handling.digest_solver({'solver': 'batch'}) == 'batch'
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = input_handling.digest_solver({'solver': 'fista'})
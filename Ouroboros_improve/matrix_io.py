@@ -0,0 +1,175 @@
+#!/usr/bin/python
+"""
+Reading and writing of the matrices dumped during the analysis.
+
+Matrices are written as binary .npy files by default, which is much faster
+and smaller than formatting every float as text; CSV remains available as an
+opt-in export. Sparse matrices are always written in scipy's .npz format.
+
+Writes can be handed to a BackgroundWriter so that they overlap with the
+computation of the next EM iteration.
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+from scipy.sparse import issparse, save_npz, load_npz
+
+global OUTPUT_FORMATS
+OUTPUT_FORMATS = ('npy', 'npz', 'csv')
+
+
+def save_matrix(path_stem, mtx, output_format='npy'):
+    """
+    Write a matrix to disk, adding the extension of the format to path_stem.
+
+    Arguments
+    ---------
+    path_stem:      str, path of the file without extension
+    mtx:            array-like or scipy.sparse matrix
+    output_format:  str, 'npy' (binary), 'npz' (compressed binary) or 'csv'
+                    (text); ignored for sparse matrices, which are always
+                    written as .npz
+
+    Returns
+    -------
+    path:   str, path of the written file
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format: {output_format}')
+    if issparse(mtx):
+        path = ''.join([path_stem, '.npz'])
+        save_npz(path, mtx)
+    elif output_format == 'npy':
+        path = ''.join([path_stem, '.npy'])
+        np.save(path, np.asarray(mtx))
+    elif output_format == 'npz':
+        path = ''.join([path_stem, '.npz'])
+        np.savez_compressed(path, mtx=np.asarray(mtx))
+    else:
+        path = ''.join([path_stem, '.csv'])
+        np.savetxt(path, mtx, delimiter=',')
+    return path
+
+
+def load_matrix(path):
+    """
+    Read a matrix written by save_matrix() (or by np.savetxt, as older
+    versions of the analysis did).
+
+    Arguments
+    ---------
+    path:   str, path of the file; if it has no extension, the first existing
+            file among path.npy, path.npz and path.csv is read
+
+    Returns
+    -------
+    mtx:    array, or scipy.sparse matrix if one was written
+    """
+    if not os.path.splitext(path)[1]:
+        candidates = [''.join([path, '.', ext]) for ext in OUTPUT_FORMATS]
+        existing = [candidate for candidate in candidates
+                    if os.path.exists(candidate)]
+        if not existing:
+            raise FileNotFoundError(
+                f'No matrix found for {path} (tried {", ".join(candidates)})')
+        path = existing[0]
+
+    if path.endswith('.npy'):
+        return np.load(path)
+    elif path.endswith('.npz'):
+        with np.load(path) as npz:
+            if 'mtx' in npz.files:
+                return npz['mtx']
+        return load_npz(path)
+    else:
+        return np.loadtxt(path, delimiter=',')
+
+
+class BackgroundWriter():
+    """
+    Thread that runs write calls (e.g. save_matrix or np.savetxt) in the
+    order they were submitted, while the caller goes on computing.
+
+    The queue is bounded, so a caller producing data faster than it can be
+    written eventually waits instead of piling up arrays in memory. The
+    writer takes ownership of the arguments it is given: they must not be
+    modified after submission.
+
+    Errors raised by a write are re-raised in the caller by the next call to
+    submit() or by close(). Use as a context manager, or call close() at the
+    end of the run to wait for all pending writes.
+
+    Parameters
+    ----------
+    max_pending: int, maximum number of writes waiting in the queue
+    """
+
+    def __init__(self, max_pending=8):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            func, args, kwargs = task
+            # Drop the remaining writes after an error; it is raised in the
+            # caller
+            if self._error is None:
+                try:
+                    func(*args, **kwargs)
+                except BaseException as error:
+                    self._error = error
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue the call func(*args, **kwargs); blocks while the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError('BackgroundWriter is closed')
+        self._raise_error()
+        self._queue.put((func, args, kwargs))
+
+    def close(self):
+        """
+        Wait for all pending writes and stop the thread; re-raises the first
+        error of a write, if any.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not hide the original exception behind a write error
+            try:
+                self.close()
+            except BaseException:
+                pass
+
+
+def run_or_submit(writer, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) now, or queue it in writer if one is given.
+    """
+    if writer is None:
+        func(*args, **kwargs)
+    else:
+        writer.submit(func, *args, **kwargs)
@@ -0,0 +1,67 @@
+"""
+Unit tests for the matrix_io module
+"""
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, issparse
+
+from matrix_io import save_matrix, load_matrix, OUTPUT_FORMATS, \
+    BackgroundWriter, run_or_submit
+
+
+class TestSaveLoadMatrix():
+
+    def make_mtx(self):
+        return np.random.RandomState(0).normal(size=(5, 4))
+
+    def test_round_trip(self, tmp_path):
+        mtx = self.make_mtx()
+        for output_format in OUTPUT_FORMATS:
+            path = save_matrix(str(tmp_path / output_format), mtx,
+                               output_format)
+            assert path.endswith(output_format)
+            assert np.array_equal(load_matrix(path), mtx)
+
+    def test_stem(self, tmp_path):
+        mtx = self.make_mtx()
+        save_matrix(str(tmp_path / 'mtx'), mtx, 'csv')
+        assert np.array_equal(load_matrix(str(tmp_path / 'mtx')), mtx)
+        with pytest.raises(FileNotFoundError):
+            _ = load_matrix(str(tmp_path / 'missing'))
+
+    def test_sparse(self, tmp_path):
+        mtx = csr_matrix(np.eye(4))
+        path = save_matrix(str(tmp_path / 'bin_mtx'), mtx, 'csv')
+        assert path.endswith('.npz')
+        loaded = load_matrix(path)
+        assert issparse(loaded)
+        assert np.array_equal(loaded.toarray(), np.eye(4))
+
+    def test_wrong_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            _ = save_matrix(str(tmp_path / 'mtx'), self.make_mtx(), 'hdf5')
+
+
+class TestBackgroundWriter():
+
+    def test_writes(self, tmp_path):
+        mtx = np.arange(6.).reshape(2, 3)
+        with BackgroundWriter(max_pending=1) as writer:
+            for i in range(5):
+                writer.submit(save_matrix, str(tmp_path / f'mtx_{i}'), mtx)
+        for i in range(5):
+            assert np.array_equal(load_matrix(str(tmp_path / f'mtx_{i}.npy')),
+                                  mtx)
+
+    def test_error(self, tmp_path):
+        writer = BackgroundWriter()
+        writer.submit(save_matrix, str(tmp_path / 'missing' / 'mtx'),
+                      np.eye(2))
+        with pytest.raises(FileNotFoundError):
+            writer.close()
+        with pytest.raises(RuntimeError):
+            writer.submit(save_matrix, str(tmp_path / 'mtx'), np.eye(2))
+
+    def test_synchronous(self, tmp_path):
+        run_or_submit(None, save_matrix, str(tmp_path / 'mtx'), np.eye(2))
+        assert (tmp_path / 'mtx.npy').exists()
@@ -5,52 +5,51 @@ Set of functions to manipulate multiple sequence alignments (MSAs).
 """
 
 import numpy as np
+from scipy.sparse import csr_matrix
 from skbio import TabularMSA, Protein
 
 
-def del_gappy_cols(msa, gap_threshold):
+def del_gappy_cols(msa, gap_threshold, gap='-'):
     """
     Remove columns from a MSA where the frequency of gap occurrence is above a
     certain threshold
 
 .   Arguments
     ----------
-    msa: TabularMSA
-        The MSA to be filtered
+    msa: TabularMSA or array-like
+        The MSA to be filtered, either as a TabularMSA or in numeric matrix
+        format
     gap_threshold: float
         Gap frequency threshold: columns that have a gap frequency equal or
         greater than this value will be removed.
+    gap: str or int
+        Gap symbol; for a numeric matrix, the numeric factor of the gap
+        (e.g. aa_table['-'])
 
     Returns
     -------
-    msa: TabularMSA object
+    msa: TabularMSA object or array-like (same type as the input)
         Filtered MSA
     idxs: list of indexes of gappy columns
     """
-    cols = msa.shape[1]
-    msa = [str(seq) for seq in iter(msa)
-           ]  # TabularMSA format is not flexible enough yet
-    # Transpose MSA for easier iteration
-    msa = list(zip(*msa))
-
-    # Collect indices of rows (columns in the original MSA) that have a gap
-    # frequency equal or above to the treshold
-    idxs = []
-    for idx, row in enumerate(msa):
-        if row.count('-') / len(row) >= gap_threshold:
-            idxs.append(idx)
-    if len(idxs) == cols:
+    if isinstance(msa, TabularMSA):
+        # Filter the character codes and rebuild the sequences from the
+        # remaining ones
+        chars = msa_to_chars(msa)
+        chars, idxs = del_gappy_cols(chars, gap_threshold, gap=ord(gap))
+        msa = TabularMSA([Protein(row.tobytes().decode('ascii'))
+                          for row in chars])
+        return msa, idxs
+
+    msa = np.asarray(msa)
+    # Gap frequency of each column
+    gap_freqs = np.count_nonzero(msa == gap, axis=0) / msa.shape[0]
+    gappy = gap_freqs >= gap_threshold
+    if np.all(gappy):
         raise Exception(f"""All columns have a gap frequency equal to or above
             the provided gap threshold {gap_threshold}.""")
-    # Remove gappy columns; always remove the one with the highest index!
-    for idx in sorted(idxs, reverse=True):
-        del msa[idx]
-    # Return MSA to original orientation and in TabularMSA format for further
-    # processing
-    msa = list(zip(*msa))
-
-    msa = TabularMSA([Protein(''.join(seq)) for seq in msa])
-    return msa, idxs
+    idxs = np.flatnonzero(gappy).tolist()
+    return msa[:, ~gappy], idxs
 
 
 def del_constant_cols(msa):
@@ -67,23 +66,31 @@ def del_constant_cols(msa):
          Filtered MSA
     idxs: list of indexes of constant columns
     """
-    msa = list(zip(*msa))
-    cols = len(msa)
-
-    # Collect indices of columns that stay constant
-    idxs = []
-    for idx, row in enumerate(msa):
-        if len(set(row)) == 1:
-            idxs.append(idx)
-    if len(idxs) == cols:
+    msa = np.asarray(msa)
+    # A column is constant if all its values are equal to the first one
+    constant = np.all(msa == msa[:1], axis=0)
+    if np.all(constant):
         raise Exception(f"""All MSA columns are constant.""")
-    # Delete constant columns
-    for idx in sorted(idxs, reverse=True):
-        del msa[idx]
-    msa = list(zip(*msa))
-    msa = np.array([list(item) for item in msa])
+    idxs = np.flatnonzero(constant).tolist()
+
+    return msa[:, ~constant], idxs
 
-    return msa, idxs
+
+def msa_to_chars(msa):
+    """
+    Convert a multiple sequence alignment to a matrix of character codes.
+
+    Arguments
+    ----------
+    msa: scikit-bio TabularMSA object
+
+    Returns
+    -------
+    chars: array-like, the ASCII code of each position (uint8)
+    """
+    msa_bytes = ''.join(str(seq) for seq in iter(msa)).encode('ascii')
+    return np.frombuffer(msa_bytes, dtype=np.uint8).reshape(msa.shape[0],
+                                                            msa.shape[1])
 
 
 def make_num_mtx(msa, aa_table):
@@ -101,27 +108,28 @@ def make_num_mtx(msa, aa_table):
 
     Returns
     -------
-    num_mtx: array-like, the numeric matrix
+    num_mtx: array-like, the numeric matrix (uint8)
 
     """
-    # Create an empty matrix
-    seq_len = msa.shape[0]
-    seq_cols = msa.shape[1]
-    num_mtx = np.zeros((seq_len, seq_cols))
+    # Byte translation table; characters outside the alphabet are flagged
+    # with a value that cannot be a valid numeric factor
+    table = np.full(256, 255, dtype=np.uint8)
+    for aa, factor in aa_table.items():
+        table[ord(aa)] = factor
 
-    i = 0
+    # Convert the whole alignment at once
+    chars = msa_to_chars(msa)
+    num_mtx = table[chars]
 
-    # Fill the matrix by iterating over the alignment and mapping the values
-    for seq in iter(msa):
-        for pos in range(seq_cols):
-            aa = str(seq)[pos]
-            num_mtx[i, pos] = aa_table[aa]
-        i += 1
+    if np.any(num_mtx == 255):
+        unknown = np.unique(chars[num_mtx == 255])
+        raise KeyError(f"""Characters not in the amino acid table:
+            {[chr(char) for char in unknown]}""")
 
     return num_mtx
 
 
-def make_bin_mtx(num_mtx, aa_table):
+def make_bin_mtx(num_mtx, aa_table, sparse=False):
     """
     Convert a numeric matrix into a binary matrix.
     Each column of the alignment occupies a submatrix that has as many columns
@@ -136,9 +144,16 @@ def make_bin_mtx(num_mtx, aa_table):
     an extra column in the binary matrix, as they can be predicted linearly
     from the other columns, and thus introduce collinearity.
 
+    At most one column per submatrix is non-zero, so the binary matrix is
+    mostly zeros; with sparse=True it is returned in CSR format, which
+    SGDClassifier accepts directly. Note that SGDClassifier decays intercept
+    updates for sparse input, so models fitted on it differ slightly from
+    those fitted on the dense matrix.
+
     Arguments
     ----------
     num_mtx: array-like, the numeric matrix
+    sparse:  bool, whether to return a scipy.sparse CSR matrix
 
     Returns
     -------
@@ -149,19 +164,22 @@ def make_bin_mtx(num_mtx, aa_table):
     # Gaps will be represented by a vector of zeros; doing otherwise introduces
     # collinearity
     no_aas = len(aa_table.keys()) - 1
+    num_mtx = np.asarray(num_mtx).astype(int)
     mtx_rows = num_mtx.shape[0]
     mtx_cols = num_mtx.shape[1] * no_aas
-    bin_mtx = np.zeros((mtx_rows, mtx_cols), dtype=np.int)
-
-    # Fill the binary matrix
-    offset = 0  # To keep track of which submatrix to fill
-    for pos in range(num_mtx.shape[1]):
-        num_col = num_mtx[:, pos]
-        for row in range(len(num_col)):
-            # Gaps are ignored, revise this if we use reduced alphabets
-            if num_col[row] != 20:
-                col = num_col[row] + offset
-                bin_mtx[row, int(col)] = 1
-        offset += no_aas
+
+    # The residue of column pos goes to submatrix pos. Gaps are ignored,
+    # revise this if we use reduced alphabets
+    rows, pos = np.nonzero(num_mtx != aa_table['-'])
+    cols = pos * no_aas + num_mtx[rows, pos]
+
+    if sparse:
+        # Stored as float64 so that the models do not convert it on every fit
+        bin_mtx = csr_matrix((np.ones(len(rows)), (rows, cols)),
+                             shape=(mtx_rows, mtx_cols))
+    else:
+        # Fill the binary matrix with a single indexed assignment
+        bin_mtx = np.zeros((mtx_rows, mtx_cols), dtype=int)
+        bin_mtx[rows, cols] = 1
 
     return bin_mtx
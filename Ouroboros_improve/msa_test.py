@@ -3,6 +3,7 @@ Unit tests for the msa_fun module
 """
 import pytest
 import numpy as np
+from scipy.sparse import issparse
 from skbio import TabularMSA, Protein
 
 import os
@@ -33,6 +34,12 @@ class TestMakeNumMtx():
         assert np.array_equal(num_mtx, expected_mtx) is True
 
 
+    def test_unknown_char(self):
+        aln = TabularMSA([Protein('AX'), Protein('VL')])
+        with pytest.raises(KeyError):
+            _ = msa_fun.make_num_mtx(aln, AA_TABLE)
+
+
 class TestMakeBinMtx():
 
     def test_ok(self):
@@ -48,6 +55,14 @@ class TestMakeBinMtx():
         bin_mtx = msa_fun.make_bin_mtx(num_mtx, AA_TABLE)
         assert np.array_equal(bin_mtx, expected_mtx) is True
 
+    def test_sparse(self):
+        num_mtx = np.array([[0, 20], [19, 20], [20, 19], [3, 4]])
+        dense = msa_fun.make_bin_mtx(num_mtx, AA_TABLE)
+        sparse = msa_fun.make_bin_mtx(num_mtx, AA_TABLE, sparse=True)
+        assert issparse(sparse)
+        assert sparse.format == 'csr'
+        assert np.array_equal(sparse.toarray(), dense)
+
 
 class TestDelGappyCols():
 
@@ -82,6 +97,25 @@ class TestDelGappyCols():
         with pytest.raises(Exception):
             _ = msa_fun.del_gappy_cols(aln, gap_threshold=0.5)
 
+    def test_num_mtx(self):
+        aln = TabularMSA([Protein('EL--'), Protein('AV-L'),
+                          Protein('A-RL'), Protein('ELRL')])
+        num_mtx = msa_fun.make_num_mtx(aln, AA_TABLE)
+        out_mtx, gappy_idxs = msa_fun.del_gappy_cols(num_mtx, 0.5,
+                                                     gap=AA_TABLE['-'])
+        out_aln, exp_idxs = msa_fun.del_gappy_cols(aln, 0.5)
+        assert gappy_idxs == exp_idxs == [2]
+        assert out_mtx.dtype == np.uint8
+        assert np.array_equal(out_mtx, msa_fun.make_num_mtx(out_aln,
+                                                            AA_TABLE))
+
+    def test_threshold(self):
+        # A gap frequency equal to the threshold is removed
+        aln = TabularMSA([Protein('E-L'), Protein('A-V'),
+                          Protein('AL-'), Protein('ELR')])
+        _, gappy_idxs = msa_fun.del_gappy_cols(aln, gap_threshold=0.25)
+        assert gappy_idxs == [1, 2]
+
 
 class TestDelConstantCols():
 
@@ -107,3 +141,10 @@ class TestDelConstantCols():
                             [1, 2, 3, 4], [1, 2, 3, 4]])
         with pytest.raises(Exception):
             _ = msa_fun.del_constant_cols(num_mtx)
+
+    def test_num_mtx(self):
+        num_mtx = np.array([[1, 2, 3], [1, 4, 3], [1, 2, 3]], dtype=np.uint8)
+        out_aln, constant_idxs = msa_fun.del_constant_cols(num_mtx)
+        assert constant_idxs == [0, 2]
+        assert out_aln.dtype == np.uint8
+        assert np.array_equal(out_aln, [[2], [4], [2]])
@@ -12,6 +12,7 @@ import numpy as np
 from sklearn.metrics import matthews_corrcoef, log_loss
 
 from helpers import round_labels
+from matrix_io import run_or_submit
 import plots
 
 
@@ -46,16 +47,19 @@ def write_llh_warning(out_path):
 def create_output(labels_per_iter, alt_llhs_per_iter, null_llhs_per_iter,
                   alt_int_per_iter, null_nonint_per_iter, mode, out_path, test,
                   true_labels=None, alt_true_per_iter=None,
-                  null_true_per_iter=None):
+                  null_true_per_iter=None, writer=None):
     """
     Create output concerning PPI prediction
+
+    The text files are written by writer (a matrix_io.BackgroundWriter) if
+    one is given; plots are always drawn before returning.
     """
     checks_dir = os.path.join(out_path, 'output')
 
     # Create file explaining output files
     write_readme(out_path)
     # Evolution of labels accros iterations
-    write_evolution_zs(labels_per_iter, out_path)
+    write_evolution_zs(labels_per_iter, out_path, writer)
     # Compute sums of log-likelihoods
     sum_alt_per_iter = [x.sum() for x in np.array(alt_llhs_per_iter)]
     sum_null_per_iter = [x.sum() for x in np.array(null_llhs_per_iter)]
@@ -93,11 +97,11 @@ def create_output(labels_per_iter, alt_llhs_per_iter, null_llhs_per_iter,
         write_llhs(sum_alt_per_iter, sum_null_per_iter,
                    sum_alt_int_per_iter, sum_null_nonint_per_iter,
                    total_llh_per_iter, out_path, test, all_true_int,
-                   all_true_nonint, all_true)
+                   all_true_nonint, all_true, writer=writer)
     else:
         write_llhs(sum_alt_per_iter, sum_null_per_iter,
                    sum_alt_int_per_iter, sum_null_nonint_per_iter,
-                   total_llh_per_iter, out_path, test)
+                   total_llh_per_iter, out_path, test, writer=writer)
 
     if test:
         pred_labels = labels_per_iter[-1]
@@ -109,7 +113,7 @@ def create_output(labels_per_iter, alt_llhs_per_iter, null_llhs_per_iter,
                                         mode, checks_dir)
 
 
-def write_evolution_zs(labels_per_iter, results_dir):
+def write_evolution_zs(labels_per_iter, results_dir, writer=None):
     """
     Write to disk files concerning the evolution of the hidden variables.
 
@@ -118,6 +122,7 @@ def write_evolution_zs(labels_per_iter, results_dir):
     labels_per_iter: array-like, contains the values of the hidden variables in
                      each iteration
     results_dir:     str, base directory
+    writer:          matrix_io.BackgroundWriter for the text file, or None
 
     Returns
     -------
@@ -127,14 +132,45 @@ def write_evolution_zs(labels_per_iter, results_dir):
 
     labels_per_iter = np.asarray(labels_per_iter).T
     labels_path = os.path.join(results_dir, "labels_per_iter.csv")
-    np.savetxt(labels_path, labels_per_iter)
+    run_or_submit(writer, np.savetxt, labels_path, labels_per_iter)
     plots.draw_label_heatmap(np.asarray(labels_per_iter), os.path.join(
         results_dir, 'output', "z_over_iters.pdf"))
 
 
+def write_starts_summary(start_seeds, final_llhs, results_dir,
+                         abandoned=None):
+    """
+    Write the seed and final total log-likelihood of every random start to
+    disk, and report the best start.
+
+    Arguments
+    ---------
+    start_seeds:    list, seed of each random start
+    final_llhs:     list, total log-likelihood of each random start at its
+                    last EM iteration
+    results_dir:    str, output path
+    abandoned:      list, whether each start was stopped early by racing
+
+    Returns
+    -------
+    None
+    """
+    if abandoned is None:
+        abandoned = [False] * len(final_llhs)
+    summary = np.column_stack((np.arange(len(final_llhs)), start_seeds,
+                               final_llhs, abandoned))
+    np.savetxt(os.path.join(results_dir, "random_starts_summary.csv"),
+               summary, delimiter=',', fmt=['%d', '%d', '%.18e', '%d'],
+               header='start,seed,final_total_llh,abandoned')
+    best = int(np.argmax(final_llhs))
+    print(f'Best random start: n_start{best} (total log-likelihood '
+          f'{final_llhs[best]})')
+
+
 def write_llhs(alt_llhs_per_iter, null_llhs_per_iter, alt_int_per_iter,
                null_nonint_per_iter, total_llhs_per_iter, results_dir, test,
-               all_true_int=None, all_true_nonint=None, all_true=None):
+               all_true_int=None, all_true_nonint=None, all_true=None,
+               writer=None):
     """
     Write the different log-likelihoods to disk.
 
@@ -150,29 +186,30 @@ def write_llhs(alt_llhs_per_iter, null_llhs_per_iter, alt_int_per_iter,
     all_true_int:
     all_true_nonint:
     all_true:
+    writer:     matrix_io.BackgroundWriter for the files, or None
 
     Returns
     -------
     None
     """
     alt_llhs_path = os.path.join(results_dir, "all_alt_llhs.csv")
-    np.savetxt(alt_llhs_path, alt_llhs_per_iter)
+    run_or_submit(writer, np.savetxt, alt_llhs_path, alt_llhs_per_iter)
     null_llhs_path = os.path.join(results_dir, "all_null_llhs.csv")
-    np.savetxt(null_llhs_path, null_llhs_per_iter)
+    run_or_submit(writer, np.savetxt, null_llhs_path, null_llhs_per_iter)
     int_llhs_path = os.path.join(results_dir, "all_int_llhs.csv")
-    np.savetxt(int_llhs_path, alt_int_per_iter)
+    run_or_submit(writer, np.savetxt, int_llhs_path, alt_int_per_iter)
     nonint_llhs_path = os.path.join(results_dir, "all_nonint_llhs.csv")
-    np.savetxt(nonint_llhs_path, null_nonint_per_iter)
+    run_or_submit(writer, np.savetxt, nonint_llhs_path, null_nonint_per_iter)
     total_llhs_path = os.path.join(results_dir, "all_total_llhs.csv")
-    np.savetxt(total_llhs_path, total_llhs_per_iter)
+    run_or_submit(writer, np.savetxt, total_llhs_path, total_llhs_per_iter)
 
     if test:
         true_int_path = os.path.join(results_dir, "true_alt_llhs.csv")
-        np.savetxt(true_int_path, all_true_int)
+        run_or_submit(writer, np.savetxt, true_int_path, all_true_int)
         true_nonint_path = os.path.join(results_dir, "true_alt_llhs.csv")
-        np.savetxt(true_nonint_path, all_true_nonint)
+        run_or_submit(writer, np.savetxt, true_nonint_path, all_true_nonint)
         true_total_path = os.path.join(results_dir, "true_total_llhs.csv")
-        np.savetxt(true_total_path, all_true)
+        run_or_submit(writer, np.savetxt, true_total_path, all_true)
 
 
 def draw_confusion_matrices(true_labels, pred_labels, mode, checks_dir):
@@ -258,18 +295,23 @@ def write_readme(out_path):
     * all_alt_llhs.csv contains the log-likelihood of the data according to the coevolutionary model over EM iterations
     * all_null_llhs.csv contains the log-likelihood of the data according to the the independent evolution model over EM iterations
     * all_total_llhs.csv contains the total log-likelihood of the data over EM iterations
-    * num_mtx_*.csv contains the alignments as numeric matrices
-    * bin_mtx_*.csv contains the one-hot encoded alignments (binary matrices in the paper)
+    * tree.nwk (if you have set write_tree) contains the sequence clustering tree of MSA A used for reweighting, in Newick format
+    * random_starts_summary.csv (with random initialization) contains the seed and the final total log-likelihood of each random start, and whether it was abandoned early by racing (race_margin); the output of each start is in its n_start* directory
+    * num_mtx_*.npy contains the alignments as numeric matrices
+    * bin_mtx_*.npy contains the one-hot encoded alignments (binary matrices in the paper); bin_mtx_*.npz (scipy.sparse format) if the sparse option was used
     * processed_contact_matrix.csv (if you have passed a contact matrix) contains the ground truth contact matrix once it has been processed like the input alignments (i.e. removal of constant and gappy columns).
-    * output/alt_llhs_mtx_*.csv contains the log probability of each individual residue at the concatenated alignments at a particular iteration according to the coevolutionary model
-    * output/null_llhs_mtx_*.csv contains the log probability of each individual residue at the concatenated alignments at a particular iteration according to the null model
+    * output/alt_llhs_mtx_*.npy contains the log probability of each individual residue at the concatenated alignments at a particular iteration according to the coevolutionary model
+    * output/null_llhs_mtx_*.npy contains the log probability of each individual residue at the concatenated alignments at a particular iteration according to the null model
     * output/fixed_alphas_*_iter_init.csv contains the selected regularization strengths for each column for MSA A and B.
     * output/dfs_*_iter_init.csv contains the degrees of freedom of the models selected during initialization
+    * output/init_checkpoint.pkl and output/em_checkpoint.pkl contain the state of the initialization and of the EM loop after its last completed iteration, and output/em_history.pkl the labels, log-likelihoods and contact matrices of the completed iterations; run again with `python run_analysis.py $PARAMETER_FILE_PATH --resume` to continue an interrupted analysis from them
 
     If you choose to perform contact prediction, you will obtain some additional output:
     * output/final_contact_mtx.csv is a matrix (of dimensions msa1 x msa2, once they have been processed) containing coevolutionary strengths between all pairs of residues between your two MSAs
     * output/norm_final_contact_mtx.csv is the same matrix, normalized using the Average Product Correction of Dunn *et al.* (2008)
 
+    Matrices (num_mtx_*, bin_mtx_* and the per-iteration output/*_mtx_* files) are written in NumPy's binary .npy format by default; set output_format to "csv" for text files or "npz" for compressed ones. matrix_io.load_matrix() reads any of them.
+
     Other undocumented output is present for development and testing reasons, and might be removed in the future.
     """
     readme_path = os.path.join(out_path, "README.md")
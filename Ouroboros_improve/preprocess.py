@@ -6,25 +6,46 @@ mutations analysis.
 @author: Miguel Correa
 """
 import os
+import shutil
+import hashlib
+import tempfile
 
 import numpy as np
+from skbio import TabularMSA, Protein
 
 import msa_fun
 import globalvars
+import reweight_sequences
+from matrix_io import save_matrix, load_matrix
 
-def process(aln, gap_threshold, aa_table):
+global CACHE_VERSION
+# Increase when the preprocessing changes, to invalidate existing caches
+CACHE_VERSION = 1
+
+
+def process(aln, gap_threshold, aa_table, sparse=False):
     """
     Auxiliary function for main()
     """
-    aln, gappy_idxs = msa_fun.del_gappy_cols(aln, gap_threshold=gap_threshold)
-
+    # Both filters work on the numeric matrix
     num_mtx = msa_fun.make_num_mtx(aln, aa_table)
+    num_mtx, gappy_idxs = msa_fun.del_gappy_cols(
+        num_mtx, gap_threshold=gap_threshold, gap=aa_table['-'])
     num_mtx, constant_idxs = msa_fun.del_constant_cols(num_mtx)
-    bin_mtx = msa_fun.make_bin_mtx(num_mtx, aa_table)
+    bin_mtx = msa_fun.make_bin_mtx(num_mtx, aa_table, sparse=sparse)
 
     return num_mtx, bin_mtx, gappy_idxs, constant_idxs
 
 
+def count_input_cols(processed):
+    """
+    Number of columns of an alignment before filtering, from the output of
+    process()
+    """
+    num_mtx, _, gappy_idxs, constant_idxs = processed
+    return num_mtx.shape[1] + len(gappy_idxs) + len(constant_idxs)
+
+
 def process_contact_mtx(contact_mtx, gappy_idxs_a, constant_idxs_a,
                         gappy_idxs_b, constant_idxs_b):
     """
@@ -41,7 +62,7 @@ def process_contact_mtx(contact_mtx, gappy_idxs_a, constant_idxs_a,
 
 
 def main(msa_a, msa_b, results_dir, gap_threshold=0.5, contact_mtx=None,
-         aa_table=globalvars.AA_TABLE):
+         aa_table=globalvars.AA_TABLE, sparse=False, output_format='npy'):
     """
     Convenience function to preprocess multiple sequence alignments
     and write them to disk.
@@ -57,6 +78,10 @@ def main(msa_a, msa_b, results_dir, gap_threshold=0.5, contact_mtx=None,
     aa_table:      aa_table: dictionary
                        Contains the mapping to convert amino acids into numeric
                        factors
+    sparse:        bool, whether to build the binary matrices as scipy.sparse
+                       CSR matrices
+    output_format: str, file format of the numeric and binary matrices; see
+                       matrix_io.save_matrix()
 
     Returns
     ---------
@@ -65,21 +90,45 @@ def main(msa_a, msa_b, results_dir, gap_threshold=0.5, contact_mtx=None,
     num_mtx_b: array-like, MSA in numeric matrix form
     bin_mtx_b: array-like, MSA in binary matrix form
     """
-    num_mtx_a, bin_mtx_a, gappy_idxs_a, constant_idxs_a = process(
-        msa_a, gap_threshold, aa_table)
+    processed_a = process(msa_a, gap_threshold, aa_table, sparse=sparse)
+    processed_b = process(msa_b, gap_threshold, aa_table, sparse=sparse)
 
-    num_mtx_b, bin_mtx_b, gappy_idxs_b, constant_idxs_b = process(
-        msa_b, gap_threshold, aa_table)
+    return write_processed(processed_a, processed_b, results_dir,
+                           contact_mtx=contact_mtx,
+                           output_format=output_format)
 
-    num_a_path = os.path.join(results_dir, "num_mtx_a.csv")
-    np.savetxt(num_a_path, num_mtx_a, delimiter=",")
-    bin_a_path = os.path.join(results_dir, "bin_mtx_a.csv")
-    np.savetxt(bin_a_path, bin_mtx_a, delimiter=",")
 
-    num_b_path = os.path.join(results_dir, "num_mtx_b.csv")
-    np.savetxt(num_b_path, num_mtx_b, delimiter=",")
-    bin_b_path = os.path.join(results_dir, "bin_mtx_b.csv")
-    np.savetxt(bin_b_path, bin_mtx_b, delimiter=",")
+def write_processed(processed_a, processed_b, results_dir, contact_mtx=None,
+                    output_format='npy'):
+    """
+    Write the output of process() for both alignments to disk, and process
+    the contact matrix, if given, accordingly.
+
+    Arguments
+    ---------
+    processed_a:   tuple, output of process() for MSA A
+    processed_b:   tuple, output of process() for MSA B
+    results_dir:   str, path to where files will be stored
+    contact_mtx:   array-like, ground truth contact matrix (optional)
+    output_format: str, file format of the numeric and binary matrices; see
+                       matrix_io.save_matrix()
+
+    Returns
+    ---------
+    See main()
+    """
+    num_mtx_a, bin_mtx_a, gappy_idxs_a, constant_idxs_a = processed_a
+    num_mtx_b, bin_mtx_b, gappy_idxs_b, constant_idxs_b = processed_b
+
+    save_matrix(os.path.join(results_dir, "num_mtx_a"), num_mtx_a,
+                output_format)
+    save_matrix(os.path.join(results_dir, "bin_mtx_a"), bin_mtx_a,
+                output_format)
+
+    save_matrix(os.path.join(results_dir, "num_mtx_b"), num_mtx_b,
+                output_format)
+    save_matrix(os.path.join(results_dir, "bin_mtx_b"), bin_mtx_b,
+                output_format)
 
     if contact_mtx is not None:
         processed_contact_mtx = process_contact_mtx(contact_mtx, gappy_idxs_a,
@@ -93,3 +142,192 @@ def main(msa_a, msa_b, results_dir, gap_threshold=0.5, contact_mtx=None,
         return num_mtx_a, bin_mtx_a, num_mtx_b, bin_mtx_b, processed_contact_mtx
     else:
         return num_mtx_a, bin_mtx_a, num_mtx_b, bin_mtx_b
+
+
+####################################
+# Cache of preprocessed alignments #
+####################################
+
+def cache_key(msa_a_path, msa_b_path, gap_threshold, method, cut_height,
+              sparse=False, aa_table=globalvars.AA_TABLE):
+    """
+    Key of the preprocessing cache: hash of the contents of both alignments
+    and of the parameters the preprocessing and the sequence weights depend
+    on.
+
+    Arguments
+    ---------
+    msa_a_path:    str, path to MSA A
+    msa_b_path:    str, path to MSA B
+    gap_threshold: float, see main()
+    method:        str, clustering method of
+                       reweight_sequences.calc_seqs_weight()
+    cut_height:    float, cut height of reweight_sequences.calc_seqs_weight()
+    sparse:        bool, see main()
+    aa_table:      dictionary, see main()
+
+    Returns
+    -------
+    key: str, hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    for path in (msa_a_path, msa_b_path):
+        # Prefix each file with its size, so that contents cannot shift from
+        # one alignment to the other
+        digest.update(str(os.path.getsize(path)).encode())
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(1 << 20), b''):
+                digest.update(chunk)
+    params = (CACHE_VERSION, float(gap_threshold), method,
+              None if cut_height is None else float(cut_height), bool(sparse),
+              sorted(aa_table.items()))
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+def load_cached(cache_dir, key):
+    """
+    Read an entry of the preprocessing cache.
+
+    Arguments
+    ---------
+    cache_dir: str, path to the cache directory
+    key:       str, output of cache_key()
+
+    Returns
+    -------
+    processed_a: tuple, output of process() for MSA A
+    processed_b: tuple, output of process() for MSA B
+    seqs_weight: list, sequence weights
+    tree_path:   str, path to the cached Newick tree, or None if the entry
+                     has none
+
+    or None if there is no such entry
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    processed = []
+    with np.load(os.path.join(entry_dir, 'removed_idxs.npz')) as removed:
+        for msa in ('a', 'b'):
+            processed.append((
+                load_matrix(os.path.join(entry_dir, f'num_mtx_{msa}.npy')),
+                load_matrix(os.path.join(entry_dir, f'bin_mtx_{msa}')),
+                removed[f'gappy_idxs_{msa}'].tolist(),
+                removed[f'constant_idxs_{msa}'].tolist()))
+    seqs_weight = np.load(os.path.join(entry_dir, 'seqs_weight.npy')).tolist()
+    tree_path = os.path.join(entry_dir, 'tree.nwk')
+    if not os.path.isfile(tree_path):
+        tree_path = None
+    return processed[0], processed[1], seqs_weight, tree_path
+
+
+def save_cached(cache_dir, key, processed_a, processed_b, seqs_weight,
+                tree_path=None):
+    """
+    Add an entry to the preprocessing cache. The entry is written to a
+    temporary directory and then renamed, so that concurrent runs never read
+    a partial entry. An existing entry is only replaced if it has no tree and
+    tree_path is given.
+
+    Arguments
+    ---------
+    cache_dir:   str, path to the cache directory
+    key:         str, output of cache_key()
+    processed_a: tuple, output of process() for MSA A
+    processed_b: tuple, output of process() for MSA B
+    seqs_weight: list, sequence weights
+    tree_path:   str, path to a Newick tree of MSA A to store with the entry
+                     (optional)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+    try:
+        removed = {}
+        for msa, processed in (('a', processed_a), ('b', processed_b)):
+            num_mtx, bin_mtx, gappy_idxs, constant_idxs = processed
+            save_matrix(os.path.join(tmp_dir, f'num_mtx_{msa}'), num_mtx)
+            save_matrix(os.path.join(tmp_dir, f'bin_mtx_{msa}'), bin_mtx)
+            removed[f'gappy_idxs_{msa}'] = np.array(gappy_idxs, dtype=int)
+            removed[f'constant_idxs_{msa}'] = np.array(constant_idxs,
+                                                       dtype=int)
+        np.savez(os.path.join(tmp_dir, 'removed_idxs.npz'), **removed)
+        np.save(os.path.join(tmp_dir, 'seqs_weight.npy'),
+                np.asarray(seqs_weight, dtype=float))
+        if tree_path is not None:
+            shutil.copyfile(tree_path, os.path.join(tmp_dir, 'tree.nwk'))
+            # Replace an entry without tree by one with it
+            entry_dir = os.path.join(cache_dir, key)
+            if os.path.isdir(entry_dir) and \
+                    not os.path.isfile(os.path.join(entry_dir, 'tree.nwk')):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, os.path.join(cache_dir, key))
+    except OSError:
+        # Another run stored the same entry first
+        if not os.path.isdir(os.path.join(cache_dir, key)):
+            raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+def load_inputs(msa_a_path, msa_b_path, gap_threshold, method, cut_height,
+                aa_table=globalvars.AA_TABLE, sparse=False, cache_dir=None,
+                memmap_dir=None, n_jobs=1, newick_path=None):
+    """
+    Read and preprocess both alignments and compute the sequence weights,
+    reusing the results of a previous run on the same alignments and
+    parameters if cache_dir is given.
+
+    Arguments
+    ---------
+    msa_a_path:    str, path to MSA A
+    msa_b_path:    str, path to MSA B
+    gap_threshold: float, see main()
+    method:        str, see reweight_sequences.calc_seqs_weight()
+    cut_height:    float, see reweight_sequences.calc_seqs_weight()
+    aa_table:      dictionary, see main()
+    sparse:        bool, see main()
+    cache_dir:     str, path to the preprocessing cache, or None to disable
+                       it
+    memmap_dir:    str, see reweight_sequences.calc_seqs_weight()
+    n_jobs:        int, see reweight_sequences.calc_seqs_weight()
+    newick_path:   str, file to write the clustering tree of MSA A to
+                       (optional)
+
+    Returns
+    -------
+    processed_a: tuple, output of process() for MSA A
+    processed_b: tuple, output of process() for MSA B
+    seqs_weight: list, sequence weights
+    """
+    if cache_dir is not None:
+        key = cache_key(msa_a_path, msa_b_path, gap_threshold, method,
+                        cut_height, sparse=sparse, aa_table=aa_table)
+        cached = load_cached(cache_dir, key)
+        if cached is not None:
+            processed_a, processed_b, seqs_weight, tree_path = cached
+            if newick_path is None:
+                return processed_a, processed_b, seqs_weight
+            elif tree_path is not None:
+                shutil.copyfile(tree_path, newick_path)
+                return processed_a, processed_b, seqs_weight
+            # Otherwise the tree has to be built again
+
+    msa_a = TabularMSA.read(msa_a_path, constructor=Protein)
+    msa_b = TabularMSA.read(msa_b_path, constructor=Protein)
+    processed_a = process(msa_a, gap_threshold, aa_table, sparse=sparse)
+    processed_b = process(msa_b, gap_threshold, aa_table, sparse=sparse)
+    seqs_weight = reweight_sequences.calc_seqs_weight(
+        msa_a_path, method, cut_height, memmap_dir=memmap_dir, n_jobs=n_jobs,
+        newick_path=newick_path)
+
+    if cache_dir is not None:
+        if newick_path is not None and os.path.isfile(newick_path):
+            tree_path = newick_path
+        else:
+            tree_path = None
+        save_cached(cache_dir, key, processed_a, processed_b, seqs_weight,
+                    tree_path=tree_path)
+    return processed_a, processed_b, seqs_weight
@@ -49,6 +49,12 @@ class TestProcess():
         assert gappy_idxs == [1]
         assert constant_idxs == [1]
 
+    def test_count_input_cols(self):
+        aln = TabularMSA([Protein('A-LK'), Protein('V-LR'), Protein('MALK')])
+        processed = preprocess.process(aln, 0.5, AA_TABLE)
+        assert processed[0].shape[1] == 2
+        assert preprocess.count_input_cols(processed) == 4
+
 
 class TestProcessContactMtx():
     """
@@ -72,3 +78,74 @@ class TestProcessContactMtx():
         print(proc_contact_mtx)
         print(exp_contact_mtx)
         assert np.array_equal(proc_contact_mtx, exp_contact_mtx)
+
+
+class TestLoadInputs():
+    """
+    Class to test the preprocessing cache of preprocess.load_inputs
+    """
+
+    def write_msas(self, tmp_path):
+        msa_a_path = tmp_path / 'msa_a.fasta'
+        msa_b_path = tmp_path / 'msa_b.fasta'
+        msa_a_path.write_text('>s0\nAL-C\n>s1\nVL-C\n>s2\nMLAD\n>s3\nALAD\n')
+        msa_b_path.write_text('>s0\nKT-W\n>s1\nDT-W\n>s2\nKTAY\n>s3\nDTAW\n')
+        return str(msa_a_path), str(msa_b_path)
+
+    def test_cached_matches_uncached(self, tmp_path, monkeypatch):
+        msa_a_path, msa_b_path = self.write_msas(tmp_path)
+        cache_dir = str(tmp_path / 'cache')
+        expected = preprocess.load_inputs(msa_a_path, msa_b_path, 0.5,
+                                          'average', 0.3)
+        first = preprocess.load_inputs(msa_a_path, msa_b_path, 0.5,
+                                       'average', 0.3, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        # A hit does not read the alignments again
+        def fail(*args, **kwargs):
+            raise AssertionError('Alignment read despite cache hit')
+        monkeypatch.setattr(preprocess.TabularMSA, 'read', fail)
+        second = preprocess.load_inputs(msa_a_path, msa_b_path, 0.5,
+                                        'average', 0.3, cache_dir=cache_dir)
+
+        for result in (first, second):
+            for processed, exp_processed in zip(result[:2], expected[:2]):
+                assert np.array_equal(processed[0], exp_processed[0])
+                assert np.array_equal(processed[1], exp_processed[1])
+                assert processed[2] == exp_processed[2]
+                assert processed[3] == exp_processed[3]
+            assert np.allclose(result[2], expected[2])
+
+    def test_key(self, tmp_path):
+        msa_a_path, msa_b_path = self.write_msas(tmp_path)
+        key = preprocess.cache_key(msa_a_path, msa_b_path, 0.5, 'average',
+                                   0.3)
+        assert key == preprocess.cache_key(msa_a_path, msa_b_path, 0.5,
+                                           'average', 0.3)
+        assert key != preprocess.cache_key(msa_a_path, msa_b_path, 0.4,
+                                           'average', 0.3)
+        assert key != preprocess.cache_key(msa_a_path, msa_b_path, 0.5,
+                                           'identity', 0.3)
+        assert key != preprocess.cache_key(msa_b_path, msa_a_path, 0.5,
+                                           'average', 0.3)
+        with open(msa_a_path, 'a') as target:
+            target.write('>s4\nALAD\n')
+        assert key != preprocess.cache_key(msa_a_path, msa_b_path, 0.5,
+                                           'average', 0.3)
+
+    def test_tree(self, tmp_path):
+        msa_a_path, msa_b_path = self.write_msas(tmp_path)
+        cache_dir = str(tmp_path / 'cache')
+        preprocess.load_inputs(msa_a_path, msa_b_path, 0.5, 'average', 0.3,
+                               cache_dir=cache_dir)
+        # The first entry has no tree: it is built and stored
+        first_tree = tmp_path / 'first.nwk'
+        preprocess.load_inputs(msa_a_path, msa_b_path, 0.5, 'average', 0.3,
+                               cache_dir=cache_dir,
+                               newick_path=str(first_tree))
+        second_tree = tmp_path / 'second.nwk'
+        preprocess.load_inputs(msa_a_path, msa_b_path, 0.5, 'average', 0.3,
+                               cache_dir=cache_dir,
+                               newick_path=str(second_tree))
+        assert first_tree.read_text() == second_tree.read_text()
+        assert len(os.listdir(cache_dir)) == 1
@@ -11,6 +11,9 @@ MSA_file: MSA.fasta file when it is a input file
 from scipy.spatial.distance import squareform
 from scipy.cluster.hierarchy import linkage, to_tree, cut_tree
 import numpy as np
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from sys import argv
 
 def parse_fasta_file(filename):
@@ -54,38 +57,224 @@ def calculate_similarity(seq_1, seq_2):
     similarity = numerator / denominator
     return similarity
 
+def encode_sequences(seqs_lst, gap='_'):
+    """function to encode aligned sequences for the vectorized similarity
+
+    :param seqs_lst: list of str, aligned sequences
+    :param gap: str, symbol ignored by calculate_similarity
+    :return: codes: array (sequences x positions) of uint8 character codes
+    symbols: array of the distinct non-gap character codes
+    """
+    lengths = set(len(seq) for seq in seqs_lst)
+    if len(lengths) > 1:
+        raise ValueError('Sequences are not aligned: found lengths '
+                         f'{sorted(lengths)}')
+    codes = np.frombuffer(''.join(seqs_lst).encode('ascii'), dtype=np.uint8)
+    codes = codes.reshape(len(seqs_lst), -1)
+    symbols = np.setdiff1d(np.unique(codes), [ord(gap)])
+    return codes, symbols
+
+def one_hot(codes, symbols):
+    """function to one-hot encode character codes; gaps are all-zero rows
+
+    :return: array (sequences x (positions x symbols)) of float32
+    """
+    return (codes[:, :, None] == symbols).reshape(len(codes), -1).astype(
+        np.float32)
+
+def iter_similarity_tiles(codes, symbols, block_size=1024, gap='_'):
+    """function to compute the similarity of calculate_similarity for the
+    upper triangle of the all-against-all comparison, one tile at a time
+
+    The number of identical positions of two sequences is the product of
+    their one-hot encodings, and the number of compared positions the product
+    of their non-gap masks, so each tile takes two matrix products. Tiles are
+    encoded on the fly, so memory use depends on block_size only and not on
+    the number of sequences.
+
+    :param codes, symbols: output of encode_sequences
+    :param block_size: int, number of sequences per side of a tile
+    :return: generator of (row_start, row_stop, col_start, col_stop, tile),
+    where tile holds the similarities of sequences row_start:row_stop against
+    sequences col_start:col_stop, with col_start >= row_start
+    """
+    all_valid = not np.any(codes == ord(gap))
+    for row_start in range(0, len(codes), block_size):
+        yield from iter_row_tiles(codes, symbols, row_start, block_size, gap,
+                                  all_valid)
+
+def iter_row_counts(codes, symbols, row_start, block_size=1024, gap='_',
+                    all_valid=False):
+    """function to count, tile by tile, the identical and the compared
+    positions of the row block starting at row_start against itself and the
+    following sequences, so that row blocks can be processed independently
+
+    The counts come from float32 matrix products of 0/1 values, so they are
+    exact integers.
+
+    :param all_valid: bool, True if codes holds no gap, which saves the
+    product of the non-gap masks
+    :return: generator of (row_start, row_stop, col_start, col_stop,
+    numerator, denominator), where numerator is the tile of identical
+    positions and denominator the tile of compared positions (an int if
+    all_valid)
+    """
+    n = len(codes)
+    row_stop = min(row_start + block_size, n)
+    rows_onehot = one_hot(codes[row_start:row_stop], symbols)
+    rows_valid = (codes[row_start:row_stop] != ord(gap)).astype(np.float32)
+    for col_start in range(row_start, n, block_size):
+        col_stop = min(col_start + block_size, n)
+        numerator = rows_onehot @ one_hot(codes[col_start:col_stop],
+                                          symbols).T
+        if all_valid:  # Every position is compared
+            denominator = codes.shape[1]
+        else:
+            denominator = rows_valid @ (
+                codes[col_start:col_stop] != ord(gap)).astype(np.float32).T
+        yield row_start, row_stop, col_start, col_stop, numerator, denominator
+
+def iter_row_tiles(codes, symbols, row_start, block_size=1024, gap='_',
+                   all_valid=False):
+    """function to compute the tiles of iter_similarity_tiles for the row
+    block starting at row_start only, so that row blocks can be processed
+    independently
+
+    The ratio of the counts of iter_row_counts is taken in float64, as in
+    calculate_similarity: float32 ratios differ from it in the last digits,
+    which is enough to move pairs across a cut height.
+
+    :param all_valid: bool, True if codes holds no gap, which saves the
+    product of the non-gap masks
+    """
+    for row_start, row_stop, col_start, col_stop, numerator, denominator in \
+            iter_row_counts(codes, symbols, row_start, block_size, gap,
+                            all_valid):
+        yield row_start, row_stop, col_start, col_stop, \
+            numerator.astype(np.float64) / denominator
+
 def buildSimilarityMatrix(seqs_lst):
+    codes, symbols = encode_sequences(seqs_lst)
     numofSamples = len(seqs_lst)
     matrix = np.zeros(shape=(numofSamples, numofSamples))
-    for i in range(len(matrix)):
-        for j in range(len(matrix)):
-            similarity = calculate_similarity(seqs_lst[i], seqs_lst[j])
-            matrix[i, j] = similarity
+    for row_start, row_stop, col_start, col_stop, tile in \
+            iter_similarity_tiles(codes, symbols):
+        matrix[row_start:row_stop, col_start:col_stop] = tile
+        matrix[col_start:col_stop, row_start:row_stop] = tile.T
     return matrix
 
 def buildDistanceMatrix(matrix):
-    numofSamples = len(matrix)
-    distance_matrix = np.zeros(shape=(numofSamples, numofSamples))
-    for i in range(len(matrix)):
-        for j in range(len(matrix)):
-            distance = 1 - matrix[i, j]
-            distance_matrix[i, j] = distance
-    return distance_matrix
+    return 1 - matrix
+
+def buildCondensedDistance(seqs_lst, block_size=1024, memmap_path=None):
+    """function to build the condensed distance vector (1 - similarity) that
+    scipy's linkage takes, without building the square matrices
+
+    With memmap_path, the vector is written to a memory-mapped file instead
+    of being held in memory. It is stored in float64 like the in-memory
+    vector, so that both give the same clusters. Note that some linkage
+    methods still make their own copy of it.
+
+    :param seqs_lst: list of str, aligned sequences
+    :param block_size: int, number of sequences per side of a tile
+    :param memmap_path: str, file to write the condensed vector to
+    :return: condensed: array of the n * (n - 1) / 2 pairwise distances
+    """
+    codes, symbols = encode_sequences(seqs_lst)
+    n = len(seqs_lst)
+    if memmap_path is None:
+        condensed = np.empty(n * (n - 1) // 2)
+    else:
+        condensed = np.memmap(memmap_path, dtype=np.float64, mode='w+',
+                              shape=(n * (n - 1) // 2,))
+    for row_start, row_stop, col_start, col_stop, tile in \
+            iter_similarity_tiles(codes, symbols, block_size):
+        for i in range(row_start, min(row_stop, col_stop - 1)):
+            # Pairs (i, j > i) are contiguous in the condensed vector
+            first = max(col_start, i + 1)
+            offset = n * i - i * (i + 1) // 2 + first - i - 1
+            condensed[offset:offset + col_stop - first] = \
+                1 - tile[i - row_start, first - col_start:]
+    if memmap_path is not None:
+        condensed.flush()
+    return condensed
+
+def countNeighbours(seqs_lst, cut_height, block_size=1024, n_jobs=1):
+    """function to count, for every sequence, the sequences (itself included)
+    within a distance of cut_height, i.e. with a similarity of at least
+    1 - cut_height
+
+    Only one tile of the comparison per thread is held in memory at a time,
+    so this scales to alignments whose distance matrix does not fit in
+    memory. Row blocks are spread over n_jobs threads; the matrix products
+    release the GIL, so the threads run in parallel.
+
+    :param seqs_lst: list of str, aligned sequences
+    :param cut_height: float, distance threshold
+    :param block_size: int, number of sequences per side of a tile
+    :param n_jobs: int, number of threads
+    :return: counts: array with the number of neighbours of each sequence
+    """
+    codes, symbols = encode_sequences(seqs_lst)
+    n = len(seqs_lst)
+    all_valid = not np.any(codes == ord('_'))
+    min_identity = 1 - cut_height
+
+    def count_row_block(row_start):
+        # Counts contributed by one row block, as (row_counts, col_counts)
+        row_counts = np.zeros(min(block_size, n - row_start), dtype=np.int64)
+        col_counts = np.zeros(n, dtype=np.int64)
+        for _, _, col_start, col_stop, numerator, denominator in \
+                iter_row_counts(codes, symbols, row_start, block_size,
+                                all_valid=all_valid):
+            # Compare the integer counts, so that pairs exactly at the
+            # threshold are counted; the tolerance absorbs the rounding of
+            # the threshold
+            close = numerator >= min_identity * denominator - 1e-6
+            row_counts += close.sum(axis=1)
+            if col_start != row_start:
+                # Off-diagonal tiles also count for the lower triangle
+                col_counts[col_start:col_stop] += close.sum(axis=0)
+        return row_counts, col_counts
+
+    counts = np.zeros(n, dtype=np.int64)
+    row_starts = range(0, n, block_size)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for row_start, (row_counts, col_counts) in zip(
+                row_starts, executor.map(count_row_block, row_starts)):
+            counts[row_start:row_start + len(row_counts)] += row_counts
+            counts += col_counts
+    return counts
 
 def buildHierarchicalCluster(distance_matrix, md):
-    linkage_matrix = linkage(squareform(distance_matrix), method=md)
+    # Accept both square and condensed distance matrices
+    if np.ndim(distance_matrix) == 2:
+        distance_matrix = squareform(distance_matrix)
+    linkage_matrix = linkage(distance_matrix, method=md)
     return linkage_matrix
 
 def cutHierarchicalCluster(linkage_matrix, ht):
     cuttree = cut_tree(linkage_matrix, height=ht)
-    list_same = []
-    for i in cuttree:
-        seq_index = [x for x in range(len(cuttree)) if cuttree[x] == i]
-        list_same.append([i[0], seq_index])
+    labels = cuttree[:, 0]
+    # Group the sequence indices by cluster with one stable sort
+    order = np.argsort(labels, kind='stable')
+    clusters, starts = np.unique(labels[order], return_index=True)
     # key is the index of clusters, values is the index of sequences
-    dict_seq = dict(list_same)
+    dict_seq = {cluster: seq_index.tolist() for cluster, seq_index in
+                zip(clusters.tolist(), np.split(order, starts[1:]))}
     return cuttree, dict_seq
 
+def cluster_weights(labels):
+    """function to weight each sequence by the inverse of the size of its
+    cluster, the same weights as assign_weight in linear time
+
+    :param labels: array with the cluster index of each sequence
+    :return: weights: array with the weight of each sequence
+    """
+    _, inverse, counts = np.unique(labels, return_inverse=True,
+                                   return_counts=True)
+    return 1 / counts[inverse]
+
 def to_newick(linkage_matrix: np.ndarray, labels) -> str:
     """
     Outputs linkage matrix as Newick style string
@@ -99,41 +288,35 @@ def to_newick(linkage_matrix: np.ndarray, labels) -> str:
     -------
     newick : str
         linkage matrix in newick format tree
+    The tree is walked with an explicit stack and the pieces are joined once
+    at the end, so deep trees neither hit the recursion limit nor pay for
+    repeated string concatenation.
     Source:
     https://stackoverflow.com/questions/28222179/save-dendrogram-to-newick-format
     """
     tree = to_tree(linkage_matrix, rd=False)
-
-    def get_newick(node, newick, parentdist, leaf_names):
+    pieces = []
+    # Stack of literal strings and (node, distance of the parent) pairs
+    stack = [(tree, tree.dist)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+            continue
+        node, parentdist = item
         if node.is_leaf():
-            return "%s:%.2f%s" % (
-                leaf_names[node.id],
-                parentdist - node.dist,
-                newick
-            )
+            pieces.append("%s:%.2f" % (labels[node.id],
+                                       parentdist - node.dist))
         else:
-            if len(newick) > 0:
-                newick = "):%.2f%s" % (parentdist - node.dist, newick)
+            if node is tree:
+                closing = ");"
             else:
-                newick = ");"
-            newick = get_newick(
-                node.get_left(),
-                newick,
-                node.dist,
-                leaf_names
-            )
-            newick = get_newick(
-                node.get_right(),
-                ",%s" % (newick),
-                node.dist,
-                leaf_names
-            )
-            newick = "(%s" % (newick)
-            return newick
-
-    newick = get_newick(tree, "", tree.dist, labels)
-
-    return newick
+                closing = "):%.2f" % (parentdist - node.dist)
+            # Right child first, as in the original recursive version
+            pieces.append("(")
+            stack.extend([closing, (node.get_left(), node.dist), ",",
+                          (node.get_right(), node.dist)])
+    return "".join(pieces)
 
 def assign_weight(cluster_dictionary):
     # generate a weight dictionary {index of seq: weight}
@@ -148,21 +331,47 @@ def assign_weight(cluster_dictionary):
 
 
 
-def calc_seqs_weight(msa_a_path, method, cut_height):
+def write_newick(linkage_matrix, labels, newick_path):
+    newick = to_newick(linkage_matrix, labels)
+    with open(newick_path, 'w') as f:
+        f.write(newick + '\n')
+
+def calc_seqs_weight(msa_a_path, method, cut_height, memmap_dir=None,
+                     n_jobs=1, newick_path=None):
     # they use index to correspond each other
+    # memmap_dir: directory for a temporary float64 memory-mapped file
+    # holding the condensed distances, for alignments that do not fit in RAM
+    # method 'identity': weight 1/number of sequences within cut_height,
+    # without clustering; n_jobs threads compare the sequences
+    # newick_path: file to export the clustering tree to (not written for
+    # the 'identity' method, which builds no tree)
     names_list, sequences_list = parse_fasta_file(msa_a_path)
     if (method == None) or (cut_height == None):
         seqs_weight = [1] * len(names_list)
+    elif method == 'identity':
+        counts = countNeighbours(sequences_list, cut_height, n_jobs=n_jobs)
+        seqs_weight = (1 / counts).tolist()
     else:
-        similarity_matrix = buildSimilarityMatrix(sequences_list)
-        distance_matrix = buildDistanceMatrix(similarity_matrix)
-        linkage_matrix = buildHierarchicalCluster(distance_matrix, method)
-        labels = names_list
-        newick = to_newick(linkage_matrix, labels)
-        cuttree, dict_seq = cutHierarchicalCluster(linkage_matrix, cut_height)
-        weight_dictionary = assign_weight(dict_seq)
-        seqs_weight = []
-        for i in range(len(weight_dictionary)):
-            seqs_weight.append(weight_dictionary[i])
+        if memmap_dir is None:
+            condensed_distance = buildCondensedDistance(sequences_list)
+            linkage_matrix = buildHierarchicalCluster(condensed_distance,
+                                                      method)
+        else:
+            # Unique file name, so that runs sharing memmap_dir do not collide
+            fd, memmap_path = tempfile.mkstemp(
+                prefix='condensed_distance_', suffix='.f64', dir=memmap_dir)
+            os.close(fd)
+            try:
+                condensed_distance = buildCondensedDistance(
+                    sequences_list, memmap_path=memmap_path)
+                linkage_matrix = buildHierarchicalCluster(condensed_distance,
+                                                          method)
+                del condensed_distance
+            finally:
+                os.remove(memmap_path)
+        if newick_path is not None:
+            write_newick(linkage_matrix, names_list, newick_path)
+        cuttree = cut_tree(linkage_matrix, height=cut_height)
+        seqs_weight = cluster_weights(cuttree[:, 0]).tolist()
     return seqs_weight
 
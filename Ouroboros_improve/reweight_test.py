@@ -0,0 +1,243 @@
+"""
+Unit tests for the reweight_sequences module
+"""
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import to_tree, linkage, cut_tree
+from scipy.spatial.distance import squareform
+
+import reweight_sequences
+
+
+def pairwise_reference(seqs):
+    """
+    All-against-all similarities with the per-pair function
+    """
+    return np.array([[reweight_sequences.calculate_similarity(seq_1, seq_2)
+                      for seq_2 in seqs] for seq_1 in seqs])
+
+
+def boundary_msa(tmp_path, length=300, identity=0.9):
+    """
+    Two sequences exactly identity identical and an unrelated one, written to
+    tmp_path/msa.fasta
+    """
+    rng = np.random.RandomState(0)
+    first = rng.choice(list('ACDEFGHIKL'), length)
+    second = first.copy()
+    changed = rng.choice(length, int(round(length * (1 - identity))),
+                         replace=False)
+    second[changed] = np.where(first[changed] == 'M', 'N', 'M')
+    third = rng.choice(list('PQRSTVWY'), length)
+    seqs = [''.join(seq) for seq in (first, second, third)]
+    path = tmp_path / 'msa.fasta'
+    path.write_text(''.join(f'>s{i}\n{seq}\n' for i, seq in enumerate(seqs)))
+    return str(path), seqs
+
+
+def reference_weights(seqs, method, cut_height):
+    """
+    Sequence weights from the distances of the per-pair function
+    """
+    distances = squareform(1 - pairwise_reference(seqs), checks=False)
+    labels = cut_tree(linkage(distances, method=method),
+                      height=cut_height)[:, 0]
+    return reweight_sequences.cluster_weights(labels)
+
+
+class TestSimilarityMatrix():
+
+    def test_matches_pairwise(self):
+        rng = np.random.RandomState(0)
+        seqs = [''.join(rng.choice(list('ACDE-_'), 25)) for _ in range(30)]
+        matrix = reweight_sequences.buildSimilarityMatrix(seqs)
+        assert np.allclose(matrix, pairwise_reference(seqs))
+
+    def test_ignored_symbol(self):
+        seqs = ['AC_D', 'AC-E', '_CDD']
+        matrix = reweight_sequences.buildSimilarityMatrix(seqs)
+        assert np.isclose(matrix[0, 1], 2 / 3)
+        assert np.isclose(matrix[0, 2], 2 / 2)
+        assert np.allclose(np.diag(matrix), 1)
+
+
+class TestCondensedDistance():
+
+    def test_matches_pairwise(self):
+        rng = np.random.RandomState(1)
+        seqs = [''.join(rng.choice(list('ARNDC-'), 40)) for _ in range(23)]
+        expected = squareform(1 - pairwise_reference(seqs), checks=False)
+        # Blocks smaller than the number of sequences
+        condensed = reweight_sequences.buildCondensedDistance(seqs,
+                                                              block_size=5)
+        assert np.allclose(condensed, expected)
+
+    def test_memmap(self, tmp_path):
+        rng = np.random.RandomState(2)
+        seqs = [''.join(rng.choice(list('ARNDC-_'), 30)) for _ in range(19)]
+        expected = squareform(1 - pairwise_reference(seqs), checks=False)
+        condensed = reweight_sequences.buildCondensedDistance(
+            seqs, block_size=4, memmap_path=str(tmp_path / 'dist.f32'))
+        # Same precision as the in-memory vector
+        assert condensed.dtype == np.float64
+        assert np.array_equal(condensed,
+                              reweight_sequences.buildCondensedDistance(seqs))
+        assert np.allclose(condensed, expected)
+
+
+class TestCountNeighbours():
+
+    def test_matches_pairwise(self):
+        rng = np.random.RandomState(3)
+        # Few symbols so that there are close sequences
+        seqs = [''.join(rng.choice(list('AC'), 12)) for _ in range(27)]
+        cut_height = 0.3
+        expected = np.sum(1 - pairwise_reference(seqs) <= cut_height, axis=1)
+        counts = reweight_sequences.countNeighbours(seqs, cut_height,
+                                                    block_size=5)
+        assert np.array_equal(counts, expected)
+
+    def test_threads(self):
+        rng = np.random.RandomState(4)
+        seqs = [''.join(rng.choice(list('AC-'), 12)) for _ in range(31)]
+        serial = reweight_sequences.countNeighbours(seqs, 0.4, block_size=4)
+        threaded = reweight_sequences.countNeighbours(seqs, 0.4, block_size=4,
+                                                      n_jobs=3)
+        assert np.array_equal(serial, threaded)
+
+
+class TestClusterWeights():
+
+    def test_matches_assign_weight(self):
+        rng = np.random.RandomState(5)
+        seqs = [''.join(rng.choice(list('ACD'), 15)) for _ in range(40)]
+        condensed = reweight_sequences.buildCondensedDistance(seqs)
+        linkage_matrix = reweight_sequences.buildHierarchicalCluster(
+            condensed, 'average')
+        cuttree, dict_seq = reweight_sequences.cutHierarchicalCluster(
+            linkage_matrix, 0.5)
+        weight_dictionary = reweight_sequences.assign_weight(dict_seq)
+        expected = [weight_dictionary[i] for i in range(len(seqs))]
+        weights = reweight_sequences.cluster_weights(cuttree[:, 0])
+        assert np.allclose(weights, expected)
+
+    def test_cluster_dictionary(self):
+        cuttree, dict_seq = reweight_sequences.cutHierarchicalCluster(
+            np.array([[0, 1, 0.1, 2], [2, 3, 0.9, 3]]), 0.5)
+        assert dict_seq == {0: [0, 1], 1: [2]}
+
+
+def newick_reference(linkage_matrix, labels):
+    """
+    Newick string built recursively, as to_newick used to
+    """
+    def get_newick(node, newick, parentdist):
+        if node.is_leaf():
+            return "%s:%.2f%s" % (labels[node.id], parentdist - node.dist,
+                                  newick)
+        if len(newick) > 0:
+            newick = "):%.2f%s" % (parentdist - node.dist, newick)
+        else:
+            newick = ");"
+        newick = get_newick(node.get_left(), newick, node.dist)
+        newick = get_newick(node.get_right(), ",%s" % newick, node.dist)
+        return "(%s" % newick
+
+    tree = to_tree(linkage_matrix, rd=False)
+    return get_newick(tree, "", tree.dist)
+
+
+class TestToNewick():
+
+    def test_matches_recursive(self):
+        rng = np.random.RandomState(6)
+        seqs = [''.join(rng.choice(list('ACDE'), 20)) for _ in range(25)]
+        linkage_matrix = reweight_sequences.buildHierarchicalCluster(
+            reweight_sequences.buildCondensedDistance(seqs), 'average')
+        labels = [f'seq{i}' for i in range(len(seqs))]
+        assert reweight_sequences.to_newick(linkage_matrix, labels) == \
+            newick_reference(linkage_matrix, labels)
+
+    def test_deep_tree(self):
+        # Caterpillar tree deeper than the recursion limit
+        n = 5000
+        linkage_matrix = np.array([[0 if i == 0 else n + i - 1, i + 1, i + 1,
+                                    i + 2] for i in range(n - 1)], dtype=float)
+        newick = reweight_sequences.to_newick(linkage_matrix,
+                                              [str(i) for i in range(n)])
+        assert newick.count('(') == n - 1
+        assert newick.endswith(');')
+
+
+class TestCalcSeqsWeight():
+
+    def test_identity(self, tmp_path):
+        seqs = ['ACDE', 'ACDF', 'GHIK', 'ACDE']
+        path = tmp_path / 'msa.fasta'
+        path.write_text(''.join(f'>s{i}\n{seq}\n'
+                                for i, seq in enumerate(seqs)))
+        weights = reweight_sequences.calc_seqs_weight(str(path), 'identity',
+                                                      0.3)
+        assert np.allclose(weights, [1 / 3, 1 / 3, 1, 1 / 3])
+
+    def test_boundary_tie(self, tmp_path):
+        # A pair exactly at the cut height clusters as with
+        # calculate_similarity
+        path, seqs = boundary_msa(tmp_path)
+        expected = reference_weights(seqs, 'average', 0.1)
+        assert np.array_equal(expected, [0.5, 0.5, 1])
+        weights = reweight_sequences.calc_seqs_weight(path, 'average', 0.1)
+        assert np.array_equal(weights, expected)
+
+    def test_identity_threshold(self, tmp_path):
+        # Sequences exactly 1 - cut_height identical are neighbours, also
+        # where 1 - similarity rounds above cut_height
+        for identity, cut_height in ((0.9, 0.1), (0.7, 0.3)):
+            path, seqs = boundary_msa(tmp_path, identity=identity)
+            assert reweight_sequences.calculate_similarity(*seqs[:2]) == \
+                identity
+            weights = reweight_sequences.calc_seqs_weight(path, 'identity',
+                                                          cut_height)
+            assert np.array_equal(weights, [0.5, 0.5, 1])
+
+    def test_memmap_same_weights(self, tmp_path):
+        memmap_dir = tmp_path / 'memmap'
+        memmap_dir.mkdir()
+        for identity, cut_height in ((0.9, 0.1), (0.7, 0.3), (0.6, 0.4)):
+            path, _ = boundary_msa(tmp_path, identity=identity)
+            for method in ('average', 'single', 'complete'):
+                assert np.array_equal(
+                    reweight_sequences.calc_seqs_weight(
+                        path, method, cut_height, memmap_dir=str(memmap_dir)),
+                    reweight_sequences.calc_seqs_weight(path, method,
+                                                        cut_height))
+
+    def test_newick_opt_in(self, tmp_path):
+        seqs = ['ACDE', 'ACDF', 'GHIK']
+        path = tmp_path / 'msa.fasta'
+        path.write_text(''.join(f'>s{i}\n{seq}\n'
+                                for i, seq in enumerate(seqs)))
+        newick_path = tmp_path / 'tree.nwk'
+        reweight_sequences.calc_seqs_weight(str(path), 'average', 0.3)
+        assert not newick_path.exists()
+        reweight_sequences.calc_seqs_weight(str(path), 'average', 0.3,
+                                            newick_path=str(newick_path))
+        assert newick_path.read_text() == '((s1:0.25,s0:0.25):0.75,s2:1.00);\n'
+
+    def test_memmap_removed(self, tmp_path):
+        seqs = ['ACDE', 'ACDF', 'GHIK', 'ACDE']
+        path = tmp_path / 'msa.fasta'
+        path.write_text(''.join(f'>s{i}\n{seq}\n'
+                                for i, seq in enumerate(seqs)))
+        memmap_dir = tmp_path / 'memmap'
+        memmap_dir.mkdir()
+        weights = reweight_sequences.calc_seqs_weight(
+            str(path), 'average', 0.3, memmap_dir=str(memmap_dir))
+        assert np.allclose(weights, reweight_sequences.calc_seqs_weight(
+            str(path), 'average', 0.3))
+        assert not any(memmap_dir.iterdir())
+        # The file is also removed when the clustering fails
+        with pytest.raises(ValueError):
+            reweight_sequences.calc_seqs_weight(
+                str(path), 'unknown', 0.3, memmap_dir=str(memmap_dir))
+        assert not any(memmap_dir.iterdir())
@@ -3,7 +3,7 @@
 Main script for running combined expectation maximization - correlated mutations
 algorithm.
 
-Usage: python run_analysis.py $PARAMETER_FILE_PATH
+Usage: python run_analysis.py $PARAMETER_FILE_PATH [--resume]
 
 __author__ = "Miguel Correa Marrero"
 __credits__ = ["Miguel Correa Marrero","Richard G.H Immink","Dick de Ridder",
@@ -25,14 +25,12 @@ import warnings
 import numpy as np
 
 import input_handling
+import matrix_io
 import output
 import globalvars
 import preprocess
 import corrmut
 import contacts
-import reweight_sequences
-
-from skbio import TabularMSA, Protein
 
 
 def generate_true_labels(int_limit, n_obs):
@@ -51,49 +49,72 @@ def generate_true_labels(int_limit, n_obs):
     return true_labels
 
 
-if __name__ == "__main__":
-
-    print(globalvars.LOGO)
-
-    #########
-    # Setup #
-    #########
+def run(args, resume=False, inputs=None, init_result=None):
+    """
+    Run the analysis described by a set of parameters.
+
+    Arguments
+    ---------
+    args:        dict, analysis parameters, as read by
+                 input_handling.read_args()
+    resume:      bool, whether to continue an interrupted run from its
+                 checkpoints
+    inputs:      tuple, output of preprocess.load_inputs() for these
+                 parameters, if already available
+    init_result: tuple, output of corrmut.init_model() for these parameters
+                 (warm initialization only), if already available
+    """
+    # TODO: allow use of max_init_iters and max_reg_iters parameters!
     seed(42)
     np.random.seed(42)
 
-    # Read and process parameters from JSON file
-    # TODO: allow use of max_init_iters and max_reg_iters parameters!
-    args = input_handling.read_args(argv[1])
-    print("step1")
     io_path, msa_a_path, msa_b_path, gap_threshold, int_frac, init, mode, \
         test, int_limit, contact_mtx, n_jobs, n_starts, dfmax, max_init_iters, \
-        max_reg_iters, predict_contacts, method, cut_height = input_handling.digest_args(args)
+        max_reg_iters, predict_contacts, method, cut_height, sparse, \
+        distance_memmap, write_tree = input_handling.digest_args(args)
     print("digest_over")
 
     # Create directory tree
     results_dir = os.path.join(io_path)
-    os.mkdir(results_dir)
     checks_dir = os.path.join(results_dir, "output")
-    os.mkdir(checks_dir)
+    if resume:
+        os.makedirs(checks_dir, exist_ok=True)
+    else:
+        os.mkdir(results_dir)
+        os.mkdir(checks_dir)
 
     #######################################
     # Load, preprocess and validate input #
     #######################################
 
     print("Reading and processing input...")
-    msa_a = TabularMSA.read(msa_a_path, constructor=Protein)
-    msa_b = TabularMSA.read(msa_b_path, constructor=Protein)
-    seqs_weight = reweight_sequences.calc_seqs_weight(msa_a_path, method, cut_height)
+    output_format = input_handling.digest_output_format(args)
+    # Preprocessed alignments and sequence weights are reused from previous
+    # runs on the same alignments
+    cache_dir = input_handling.digest_cache_dir(args)
+    if inputs is None:
+        inputs = preprocess.load_inputs(
+            msa_a_path, msa_b_path, gap_threshold, method, cut_height,
+            sparse=sparse, cache_dir=cache_dir,
+            memmap_dir=checks_dir if distance_memmap else None, n_jobs=n_jobs,
+            newick_path=os.path.join(results_dir, 'tree.nwk') if write_tree
+            else None)
+    processed_a, processed_b, seqs_weight = inputs
     if contact_mtx:
         true_contact_mtx = np.loadtxt(contact_mtx, delimiter=',')
+        # The alignments are not read again: their number of columns is
+        # known from the preprocessing
+        input_handling.validate_contact_dims(
+            preprocess.count_input_cols(processed_a),
+            preprocess.count_input_cols(processed_b), true_contact_mtx)
         num_mtx_a, bin_mtx_a, num_mtx_b, bin_mtx_b,\
-            true_contact_mtx = preprocess.main(msa_a, msa_b, results_dir,
-                                               contact_mtx=true_contact_mtx,
-                                               gap_threshold=gap_threshold)
-        input_handling.validate_contact_mtx(msa_a, msa_b, contact_mtx)
+            true_contact_mtx = preprocess.write_processed(
+                processed_a, processed_b, results_dir,
+                contact_mtx=true_contact_mtx, output_format=output_format)
     else:
-        num_mtx_a, bin_mtx_a, num_mtx_b, bin_mtx_b = preprocess.main(
-            msa_a, msa_b, results_dir, gap_threshold=gap_threshold)
+        num_mtx_a, bin_mtx_a, num_mtx_b, bin_mtx_b = preprocess.write_processed(
+            processed_a, processed_b, results_dir,
+            output_format=output_format)
     input_handling.validate_alignments(num_mtx_a, num_mtx_b)
 
     if test:
@@ -108,82 +129,103 @@ if __name__ == "__main__":
     ###########################################################
 
     if init == 'warm':
-        print("Initialize model...")
-        init_labels, init_alt_llhs,\
-            init_null_llhs, init_contacts, alphas_a, alphas_b = corrmut.init_model(num_mtx_a, bin_mtx_b,
-                                                                                   num_mtx_b, bin_mtx_a,
-                                                                                   seqs_weight,
-                                                                                   mode, init, int_frac,
-                                                                                   checks_dir, n_jobs,
-                                                                                   dfmax)
-
-        print('Start EM loop...')
-        labels_per_iter, alt_llhs_per_iter, \
-            null_llhs_per_iter, contacts_per_iter = corrmut.em_loop(num_mtx_a, num_mtx_b,
-                                                                    bin_mtx_a, bin_mtx_b,
-                                                                    init_labels,
-                                                                    seqs_weight,
-                                                                    int_frac, mode,
-                                                                    checks_dir, n_jobs,
-                                                                    **em_args,
-                                                                    fixed_alphas_a=alphas_a,
-                                                                    fixed_alphas_b=alphas_b)
-
-        if predict_contacts:
-            print(
-                'Predicting contacts with final protein-protein interaction predictions...')
-            final_couplings,\
-                final_contact_mtx = corrmut.contact_prediction(num_mtx_a, bin_mtx_b,
-                                                               num_mtx_b, bin_mtx_a,
-                                                               labels_per_iter[
-                                                                   -1], seqs_weight, mode,
-                                                               n_jobs, dfmax)
-            np.savetxt(os.path.join(checks_dir, ''.join(
-                ['final_contact_mtx', '.csv'])), final_contact_mtx, delimiter=',')
-
-            norm_final_contact_mtx = contacts.normalize_contact_mtx(
-                final_contact_mtx)
-            np.savetxt(os.path.join(checks_dir, ''.join(
-                ['norm_final_contact_mtx', '.csv'])), norm_final_contact_mtx,
-                delimiter=',')
-            # Add final contact predictions
-            contacts_per_iter.append(norm_final_contact_mtx)
-
-        # Insert labels and log-likelihoods from the initial step
-        labels_per_iter.insert(0, init_labels)
-        alt_llhs_per_iter.insert(0, init_alt_llhs)
-        null_llhs_per_iter.insert(0, init_null_llhs)
-        contacts_per_iter.insert(0, init_contacts)
-
-        # Compute weighted likelihoods and create output
-        alt_int_per_iter, null_nonint_per_iter = corrmut.compute_llhs(labels_per_iter,
-                                                                      alt_llhs_per_iter,
-                                                                      null_llhs_per_iter)
-        if test:
-            # Use information about the true solution
-            alt_true_per_iter, \
-                null_true_per_iter = corrmut.compute_llhs(
-                    [true_labels] * len(labels_per_iter), alt_llhs_per_iter,
-                    null_llhs_per_iter)
-
-            output.create_output(labels_per_iter, alt_llhs_per_iter,
-                                 null_llhs_per_iter, alt_int_per_iter,
-                                 null_nonint_per_iter, mode, results_dir, test,
-                                 true_labels, alt_true_per_iter,
-                                 null_true_per_iter)
-        else:
-            output.create_output(labels_per_iter, alt_llhs_per_iter,
-                                 null_llhs_per_iter, alt_int_per_iter,
-                                 null_nonint_per_iter, mode, results_dir, test)
+        # Dumps are written in the background while the analysis goes on
+        with matrix_io.BackgroundWriter() as writer:
+            if init_result is None:
+                print("Initialize model...")
+                init_result = corrmut.init_model(num_mtx_a, bin_mtx_b, num_mtx_b,
+                                                 bin_mtx_a, seqs_weight, mode,
+                                                 init, int_frac, checks_dir,
+                                                 n_jobs, dfmax,
+                                                 em_args['path_warm_start'],
+                                                 output_format, writer, resume,
+                                                 em_args['solver'])
+            init_labels, init_alt_llhs, init_null_llhs, init_contacts, \
+                alphas_a, alphas_b = init_result
+
+            print('Start EM loop...')
+            labels_per_iter, alt_llhs_per_iter, \
+                null_llhs_per_iter, contacts_per_iter = corrmut.em_loop(num_mtx_a, num_mtx_b,
+                                                                        bin_mtx_a, bin_mtx_b,
+                                                                        init_labels,
+                                                                        seqs_weight,
+                                                                        int_frac, mode,
+                                                                        checks_dir, n_jobs,
+                                                                        **em_args,
+                                                                        fixed_alphas_a=alphas_a,
+                                                                        fixed_alphas_b=alphas_b,
+                                                                        writer=writer,
+                                                                        resume=resume)
+
+            if predict_contacts:
+                print(
+                    'Predicting contacts with final protein-protein interaction predictions...')
+                final_couplings,\
+                    final_contact_mtx = corrmut.contact_prediction(num_mtx_a, bin_mtx_b,
+                                                                   num_mtx_b, bin_mtx_a,
+                                                                   labels_per_iter[
+                                                                       -1], seqs_weight, mode,
+                                                                   n_jobs, dfmax,
+                                                                   em_args['solver'])
+                np.savetxt(os.path.join(checks_dir, ''.join(
+                    ['final_contact_mtx', '.csv'])), final_contact_mtx, delimiter=',')
+
+                norm_final_contact_mtx = contacts.normalize_contact_mtx(
+                    final_contact_mtx)
+                np.savetxt(os.path.join(checks_dir, ''.join(
+                    ['norm_final_contact_mtx', '.csv'])), norm_final_contact_mtx,
+                    delimiter=',')
+                # Add final contact predictions
+                contacts_per_iter.append(norm_final_contact_mtx)
+
+            # Insert labels and log-likelihoods from the initial step
+            labels_per_iter.insert(0, init_labels)
+            alt_llhs_per_iter.insert(0, init_alt_llhs)
+            null_llhs_per_iter.insert(0, init_null_llhs)
+            contacts_per_iter.insert(0, init_contacts)
+
+            # Compute weighted likelihoods and create output
+            alt_int_per_iter, null_nonint_per_iter = corrmut.compute_llhs(labels_per_iter,
+                                                                          alt_llhs_per_iter,
+                                                                          null_llhs_per_iter)
+            if test:
+                # Use information about the true solution
+                alt_true_per_iter, \
+                    null_true_per_iter = corrmut.compute_llhs(
+                        [true_labels] * len(labels_per_iter), alt_llhs_per_iter,
+                        null_llhs_per_iter)
+
+                output.create_output(labels_per_iter, alt_llhs_per_iter,
+                                     null_llhs_per_iter, alt_int_per_iter,
+                                     null_nonint_per_iter, mode, results_dir, test,
+                                     true_labels, alt_true_per_iter,
+                                     null_true_per_iter, writer=writer)
+            else:
+                output.create_output(labels_per_iter, alt_llhs_per_iter,
+                                     null_llhs_per_iter, alt_int_per_iter,
+                                     null_nonint_per_iter, mode, results_dir, test,
+                                     writer=writer)
 
     elif init == 'random':
         if test:
             corrmut.em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b,
                                n_starts, int_frac, mode, seqs_weight,
-                               results_dir, n_jobs, dfmax, test, em_args, true_labels)
+                               results_dir, n_jobs, dfmax, test, em_args, true_labels,
+                               resume=resume)
         else:
             corrmut.em_wrapper(num_mtx_a, num_mtx_b, bin_mtx_a, bin_mtx_b,
                                n_starts, int_frac, mode, seqs_weight,
-                               results_dir, n_jobs, dfmax, test, em_args)
+                               results_dir, n_jobs, dfmax, test, em_args,
+                               resume=resume)
+
+
+
+if __name__ == "__main__":
+
+    print(globalvars.LOGO)
+
+    # Read parameters from JSON file
+    # With --resume, an interrupted run continues from its checkpoints
+    run(input_handling.read_args(argv[1]), resume='--resume' in argv[2:])
 
     print(globalvars.END)
@@ -0,0 +1,404 @@
+#!/usr/bin/python
+"""
+Script for running the analysis over a grid of parameter sets, sharing the
+work the parameter sets have in common.
+
+Usage: python run_sweep.py $SWEEP_FILE_PATH
+
+The sweep file is a JSON file with the following keys:
+* base: parameters shared by all the analyses, as in the parameter file of
+  run_analysis.py. Its "io" entry is the directory of the sweep: the
+  analysis of each parameter set is written to io/config_$N
+* grid (optional): dictionary of parameter: list of values; the sweep runs
+  every combination of the values
+* configs (optional): list of dictionaries of parameters, each combined
+  with every point of the grid
+* n_workers (optional): number of analyses run in parallel, by default 1
+
+The analyses form a dependency graph: the alignments are preprocessed once
+per MSA pair, gap_threshold and sparse value, the sequence weights are
+computed once per MSA A, method and cut_height, and the models of the warm
+initialization are fitted once for every group of parameter sets with the
+same inputs, mode, dfmax, path_warm_start, output_format and solver (only the
+initial labels depend on int_frac). Each level of the graph runs in parallel
+on a pool of n_workers processes.
+
+Preprocessed alignments and sequence weights are read from and added to the
+same cache as run_analysis.py uses (see the cache_dir parameter), so that
+only the inputs missing from the cache are computed. The clustering tree is
+only built for the sequence weights of parameter sets with write_tree.
+
+The shared results are written to io/shared; io/sweep_summary.csv lists the
+parameters of each parameter set.
+"""
+import os
+import csv
+import json
+import shutil
+import itertools
+from sys import argv
+from random import seed
+
+import numpy as np
+from joblib import Parallel, delayed
+
+import input_handling
+import globalvars
+import preprocess
+import corrmut
+import reweight_sequences
+import run_analysis
+
+from skbio import TabularMSA, Protein
+
+
+def expand_sweep(sweep):
+    """
+    Build the list of parameter sets of a sweep.
+
+    Arguments
+    ---------
+    sweep:  dict, contents of the sweep file
+
+    Returns
+    -------
+    configs:    list of tuples (overrides, args): the parameters that differ
+                from the base ones, and the full parameters of the analysis
+    """
+    if 'base' not in sweep.keys():
+        raise ValueError('The sweep file has no base parameters')
+    base = sweep['base']
+    grid = sweep.get('grid', {})
+    explicit = sweep.get('configs', [{}])
+    if not explicit:
+        raise ValueError('Empty list of configs in the sweep file')
+
+    names = sorted(grid.keys())
+    configs = []
+    for config in explicit:
+        for values in itertools.product(*[grid[name] for name in names]):
+            overrides = dict(config)
+            overrides.update(zip(names, values))
+            if 'io' in overrides.keys():
+                raise ValueError('The io parameter cannot be swept')
+            args = dict(base)
+            args.update(overrides)
+            args['io'] = os.path.join(base['io'], f'config_{len(configs)}')
+            configs.append((overrides, args))
+    return configs
+
+
+def digest_n_workers(sweep, default=1):
+    if 'n_workers' in sweep.keys():
+        n_workers = sweep['n_workers']
+        if type(n_workers) != int or n_workers < 1:
+            raise ValueError(f"Invalid n_workers value: {n_workers}")
+    else:
+        n_workers = default
+    return n_workers
+
+
+def preprocess_key(args):
+    msa_a_path, msa_b_path = input_handling.digest_msa_paths(args)
+    return (msa_a_path, msa_b_path, input_handling.digest_gap_threshold(args),
+            input_handling.digest_sparse(args))
+
+
+def weights_key(args):
+    # distance_memmap only changes where the distances are stored: both
+    # ways give the same sequence weights
+    msa_a_path, _ = input_handling.digest_msa_paths(args)
+    method, cut_height = input_handling.digest_method_height(args)
+    return (msa_a_path, method, cut_height)
+
+
+def inputs_key(args):
+    """
+    Parameters of the preprocessing cache entry of a parameter set
+    """
+    return (preprocess_key(args), weights_key(args),
+            input_handling.digest_cache_dir(args))
+
+
+def init_key(args):
+    """
+    Parameters the models of the warm initialization depend on, or None if
+    the analysis does not use warm initialization
+    """
+    if input_handling.digest_init(args) != 'warm':
+        return None
+    return (preprocess_key(args), weights_key(args),
+            input_handling.digest_mode(args), input_handling.digest_dfmax(args),
+            input_handling.digest_path_warm_start(args),
+            input_handling.digest_output_format(args),
+            input_handling.digest_solver(args))
+
+
+def build_graph(configs, cached=()):
+    """
+    Group the parameter sets of a sweep by the intermediate results they
+    share.
+
+    Arguments
+    ---------
+    configs:    list, output of expand_sweep()
+    cached:     collection of the inputs_key() of the parameter sets whose
+                preprocessing and sequence weights are already available;
+                they get no preprocessing or reweighting step
+
+    Returns
+    -------
+    preprocess_nodes:   dict of key: index of the first parameter set with
+                        that preprocessing
+    weights_nodes:      dict of key: index of the first parameter set with
+                        those sequence weights
+    init_nodes:         dict of key: index of the first parameter set with
+                        that warm initialization
+    """
+    preprocess_nodes = {}
+    weights_nodes = {}
+    init_nodes = {}
+    for idx, (_, args) in enumerate(configs):
+        if inputs_key(args) not in cached:
+            preprocess_nodes.setdefault(preprocess_key(args), idx)
+            weights_nodes.setdefault(weights_key(args), idx)
+        key = init_key(args)
+        if key is not None:
+            init_nodes.setdefault(key, idx)
+    return preprocess_nodes, weights_nodes, init_nodes
+
+
+def entry_key(args):
+    """
+    Key of the preprocessing cache entry of a parameter set; see
+    preprocess.cache_key()
+    """
+    msa_a_path, msa_b_path = input_handling.digest_msa_paths(args)
+    method, cut_height = input_handling.digest_method_height(args)
+    return preprocess.cache_key(
+        msa_a_path, msa_b_path, input_handling.digest_gap_threshold(args),
+        method, cut_height, sparse=input_handling.digest_sparse(args))
+
+
+def load_cached_inputs(configs):
+    """
+    Look up the preprocessing and sequence weights of the parameter sets of a
+    sweep in the preprocessing cache, as preprocess.load_inputs() does.
+
+    Arguments
+    ---------
+    configs:    list, output of expand_sweep()
+
+    Returns
+    -------
+    cached:     dict of inputs_key(): (processed_a, processed_b, seqs_weight,
+                tree_path) for the parameter sets found in the cache. An
+                entry without tree is not used if any parameter set that
+                shares it needs the tree
+    """
+    needs_tree = {}
+    for _, args in configs:
+        key = inputs_key(args)
+        needs_tree[key] = needs_tree.get(key, False) or \
+            input_handling.digest_write_tree(args)
+
+    cached = {}
+    for key in needs_tree.keys():
+        cache_dir = key[2]
+        if cache_dir is None:
+            continue
+        args = next(args for _, args in configs if inputs_key(args) == key)
+        entry = preprocess.load_cached(cache_dir, entry_key(args))
+        if entry is not None and (entry[3] is not None or
+                                  not needs_tree[key]):
+            cached[key] = entry
+    return cached
+
+
+def run_preprocess(args):
+    """
+    Preprocess the alignments of a parameter set.
+    """
+    msa_a_path, msa_b_path = input_handling.digest_msa_paths(args)
+    gap_threshold = input_handling.digest_gap_threshold(args)
+    sparse = input_handling.digest_sparse(args)
+    msa_a = TabularMSA.read(msa_a_path, constructor=Protein)
+    msa_b = TabularMSA.read(msa_b_path, constructor=Protein)
+    processed_a = preprocess.process(msa_a, gap_threshold, globalvars.AA_TABLE,
+                                     sparse=sparse)
+    processed_b = preprocess.process(msa_b, gap_threshold, globalvars.AA_TABLE,
+                                     sparse=sparse)
+    return processed_a, processed_b
+
+
+def run_weights(args, out_dir, write_tree=False):
+    """
+    Compute the sequence weights of a parameter set; with write_tree, the
+    clustering tree is written to out_dir/tree.nwk.
+    """
+    msa_a_path, _ = input_handling.digest_msa_paths(args)
+    method, cut_height = input_handling.digest_method_height(args)
+    os.makedirs(out_dir)
+    return reweight_sequences.calc_seqs_weight(
+        msa_a_path, method, cut_height,
+        memmap_dir=out_dir if input_handling.digest_distance_memmap(args)
+        else None, n_jobs=input_handling.digest_n_jobs(args),
+        newick_path=os.path.join(out_dir, 'tree.nwk') if write_tree
+        else None)
+
+
+def run_init(args, inputs, out_dir):
+    """
+    Warm initialization of a parameter set, written to out_dir.
+    """
+    seed(42)
+    np.random.seed(42)
+    processed_a, processed_b, seqs_weight = inputs
+    num_mtx_a, bin_mtx_a = processed_a[:2]
+    num_mtx_b, bin_mtx_b = processed_b[:2]
+    os.makedirs(out_dir)
+    return corrmut.init_model(num_mtx_a, bin_mtx_b, num_mtx_b, bin_mtx_a,
+                              seqs_weight, input_handling.digest_mode(args),
+                              'warm', input_handling.digest_int_frac(args),
+                              out_dir, input_handling.digest_n_jobs(args),
+                              input_handling.digest_dfmax(args),
+                              input_handling.digest_path_warm_start(args),
+                              input_handling.digest_output_format(args),
+                              solver=input_handling.digest_solver(args))
+
+
+def run_config(args, inputs, init_result=None, init_dir=None, tree_path=None):
+    """
+    Run the analysis of a parameter set from the shared intermediate
+    results.
+    """
+    if init_result is not None:
+        # The initial labels are the only part of the initialization that
+        # depends on int_frac
+        alt_llhs, null_llhs = init_result[1:3]
+        init_labels = corrmut.update_labels(
+            alt_llhs, null_llhs, input_handling.digest_int_frac(args),
+            mode=input_handling.digest_mode(args))
+        init_result = (init_labels,) + tuple(init_result[1:])
+    run_analysis.run(args, inputs=inputs, init_result=init_result)
+
+    # Add the files written by the shared steps to the output
+    if init_dir is not None:
+        checks_dir = os.path.join(args['io'], 'output')
+        for name in os.listdir(init_dir):
+            if name != 'init_checkpoint.pkl':
+                shutil.copy(os.path.join(init_dir, name), checks_dir)
+    if input_handling.digest_write_tree(args) and tree_path is not None \
+            and os.path.isfile(tree_path):
+        shutil.copy(tree_path, os.path.join(args['io'], 'tree.nwk'))
+
+
+def write_sweep_summary(configs, sweep_dir):
+    """
+    Write the swept parameters of each parameter set to
+    sweep_dir/sweep_summary.csv
+    """
+    with open(os.path.join(sweep_dir, 'sweep_summary.csv'), 'w',
+              newline='') as target:
+        summary = csv.writer(target)
+        summary.writerow(['config', 'io', 'parameters'])
+        for idx, (overrides, args) in enumerate(configs):
+            summary.writerow([idx, args['io'],
+                              json.dumps(overrides, sort_keys=True)])
+
+
+def run_sweep(sweep):
+    """
+    Run all the analyses of a sweep.
+
+    Arguments
+    ---------
+    sweep:  dict, contents of the sweep file
+    """
+    configs = expand_sweep(sweep)
+    n_workers = digest_n_workers(sweep)
+    for _, args in configs:
+        input_handling.digest_args(args)
+
+    sweep_dir = sweep['base']['io']
+    shared_dir = os.path.join(sweep_dir, 'shared')
+    os.makedirs(shared_dir)
+    write_sweep_summary(configs, sweep_dir)
+
+    cached = load_cached_inputs(configs)
+    preprocess_nodes, weights_nodes, init_nodes = build_graph(configs, cached)
+    print(f'{len(configs)} parameter sets: {len(preprocess_nodes)} '
+          f'preprocessing, {len(weights_nodes)} reweighting and '
+          f'{len(init_nodes)} warm initialization steps')
+
+    # Preprocessing and reweighting do not depend on each other
+    preprocess_keys = list(preprocess_nodes.keys())
+    weights_keys = list(weights_nodes.keys())
+    weights_dirs = {key: os.path.join(shared_dir, f'weights_{i}')
+                    for i, key in enumerate(weights_keys)}
+    # The tree is only built if a parameter set computing these weights
+    # writes it
+    write_tree = {weights_key(args) for _, args in configs
+                  if input_handling.digest_write_tree(args) and
+                  inputs_key(args) not in cached}
+    results = Parallel(n_jobs=n_workers)(
+        [delayed(run_preprocess)(configs[preprocess_nodes[key]][1])
+         for key in preprocess_keys] +
+        [delayed(run_weights)(configs[weights_nodes[key]][1],
+                              weights_dirs[key], key in write_tree)
+         for key in weights_keys])
+    processed = dict(zip(preprocess_keys, results[:len(preprocess_keys)]))
+    weights = dict(zip(weights_keys, results[len(preprocess_keys):]))
+
+    def get_inputs(args):
+        key = inputs_key(args)
+        if key in cached:
+            return cached[key][:3]
+        processed_a, processed_b = processed[preprocess_key(args)]
+        return processed_a, processed_b, weights[weights_key(args)]
+
+    def get_tree_path(args):
+        key = inputs_key(args)
+        if key in cached:
+            return cached[key][3]
+        return os.path.join(weights_dirs[weights_key(args)], 'tree.nwk')
+
+    # Add the new inputs to the cache, for later sweeps and single runs
+    for key in {inputs_key(args) for _, args in configs} - set(cached):
+        if key[2] is not None:
+            args = next(args for _, args in configs if inputs_key(args) == key)
+            tree_path = get_tree_path(args)
+            preprocess.save_cached(
+                key[2], entry_key(args), *get_inputs(args),
+                tree_path=tree_path if os.path.isfile(tree_path) else None)
+
+    init_keys = list(init_nodes.keys())
+    init_dirs = {key: os.path.join(shared_dir, f'init_{i}')
+                 for i, key in enumerate(init_keys)}
+    init_results = dict(zip(init_keys, Parallel(n_jobs=n_workers)(
+        delayed(run_init)(configs[init_nodes[key]][1],
+                          get_inputs(configs[init_nodes[key]][1]),
+                          init_dirs[key])
+        for key in init_keys)))
+
+    def get_init(args):
+        key = init_key(args)
+        if key is None:
+            return None, None
+        return init_results[key], init_dirs[key]
+
+    Parallel(n_jobs=n_workers)(
+        delayed(run_config)(args, get_inputs(args), *get_init(args),
+                            get_tree_path(args))
+        for _, args in configs)
+
+
+if __name__ == "__main__":
+
+    print(globalvars.LOGO)
+
+    with open(argv[1], 'r') as source:
+        sweep = json.load(source)
+    run_sweep(sweep)
+
+    print(globalvars.END)
@@ -0,0 +1,129 @@
+"""
+Unit tests for the run_sweep module
+"""
+import os
+
+import pytest
+
+import preprocess
+import run_sweep
+
+
+BASE = {'msa1': 'msa_a.fasta', 'msa2': 'msa_b.fasta', 'io': 'sweep',
+        'int_frac': 0.5, 'mode': 'soft', 'init': 'warm', 'method': 'average',
+        'cut_height': 0.8}
+
+
+def write_msas(tmp_path, base):
+    base = dict(base)
+    seqs = {'msa1': ['ACDE', 'ACDF', 'GHIK'], 'msa2': ['LMNP', 'LMNQ', 'RSTV']}
+    for msa in ('msa1', 'msa2'):
+        (tmp_path / base[msa]).write_text(
+            ''.join(f'>s{i}\n{seq}\n' for i, seq in enumerate(seqs[msa])))
+        base[msa] = str(tmp_path / base[msa])
+    return base
+
+
+class TestExpandSweep():
+
+    def test_grid(self):
+        sweep = {'base': BASE, 'grid': {'int_frac': [0.3, 0.5],
+                                        'mode': ['soft', 'hard']}}
+        configs = run_sweep.expand_sweep(sweep)
+        assert len(configs) == 4
+        assert [args['io'] for _, args in configs] == \
+            [f'sweep/config_{i}' for i in range(4)]
+        assert {(args['int_frac'], args['mode']) for _, args in configs} == \
+            {(0.3, 'soft'), (0.3, 'hard'), (0.5, 'soft'), (0.5, 'hard')}
+        # The base parameters are not modified
+        assert BASE['io'] == 'sweep'
+
+    def test_configs(self):
+        sweep = {'base': BASE, 'grid': {'int_frac': [0.3, 0.5]},
+                 'configs': [{}, {'init': 'random'}]}
+        configs = run_sweep.expand_sweep(sweep)
+        assert [overrides for overrides, _ in configs] == \
+            [{'int_frac': 0.3}, {'int_frac': 0.5},
+             {'init': 'random', 'int_frac': 0.3},
+             {'init': 'random', 'int_frac': 0.5}]
+
+    def test_wrong(self):
+        with pytest.raises(ValueError):
+            _ = run_sweep.expand_sweep({'grid': {'int_frac': [0.3]}})
+        with pytest.raises(ValueError):
+            _ = run_sweep.expand_sweep({'base': BASE, 'grid': {'io': ['a']}})
+
+
+class TestBuildGraph():
+
+    def test_shared_steps(self, tmp_path):
+        base = write_msas(tmp_path, BASE)
+        sweep = {'base': base,
+                 'grid': {'int_frac': [0.3, 0.5], 'cut_height': [0.5, 0.8]},
+                 'configs': [{}, {'init': 'random'}, {'mode': 'hard'}]}
+        configs = run_sweep.expand_sweep(sweep)
+        preprocess_nodes, weights_nodes, init_nodes = run_sweep.build_graph(
+            configs)
+        assert len(preprocess_nodes) == 1
+        assert len(weights_nodes) == 2
+        # One per cut_height and mode; int_frac does not matter and random
+        # starts have no warm initialization
+        assert len(init_nodes) == 4
+
+    def test_cached(self, tmp_path):
+        base = write_msas(tmp_path, BASE)
+        sweep = {'base': base, 'grid': {'cut_height': [0.5, 0.8]}}
+        configs = run_sweep.expand_sweep(sweep)
+        # The inputs of the first parameter set are already available
+        preprocess_nodes, weights_nodes, init_nodes = run_sweep.build_graph(
+            configs, cached={run_sweep.inputs_key(configs[0][1])})
+        assert list(preprocess_nodes.values()) == [1]
+        assert list(weights_nodes.values()) == [1]
+        assert len(init_nodes) == 2
+
+
+class TestLoadCachedInputs():
+
+    def test_cache(self, tmp_path):
+        base = write_msas(tmp_path, dict(BASE, cache_dir=str(tmp_path / 'c')))
+        configs = run_sweep.expand_sweep({'base': base})
+        args = configs[0][1]
+        assert run_sweep.load_cached_inputs(configs) == {}
+
+        preprocess.load_inputs(args['msa1'], args['msa2'], 0.5, 'average', 0.8,
+                               cache_dir=args['cache_dir'])
+        cached = run_sweep.load_cached_inputs(configs)
+        assert list(cached.keys()) == [run_sweep.inputs_key(args)]
+        assert cached[run_sweep.inputs_key(args)][3] is None
+
+        # The entry has no tree, which a parameter set with write_tree needs
+        configs = run_sweep.expand_sweep({'base': base, 'configs': [
+            {}, {'write_tree': True}]})
+        assert run_sweep.load_cached_inputs(configs) == {}
+
+    def test_no_cache(self, tmp_path):
+        base = write_msas(tmp_path, dict(BASE, cache_dir=False))
+        configs = run_sweep.expand_sweep({'base': base})
+        assert run_sweep.load_cached_inputs(configs) == {}
+
+
+class TestRunWeights():
+
+    def test_tree_opt_in(self, tmp_path):
+        args = write_msas(tmp_path, BASE)
+        weights = run_sweep.run_weights(args, str(tmp_path / 'no_tree'))
+        assert os.listdir(tmp_path / 'no_tree') == []
+        assert weights == run_sweep.run_weights(
+            args, str(tmp_path / 'tree'), write_tree=True)
+        assert os.listdir(tmp_path / 'tree') == ['tree.nwk']
+
+
+class TestDigestNWorkers():
+
+    def test_default(self):
+        assert run_sweep.digest_n_workers({}) == 1
+
+    def test_wrong(self):
+        for i in [0, 1.5, '2']:
+            with pytest.raises(ValueError):
+                _ = run_sweep.digest_n_workers({'n_workers': i})